@@ -0,0 +1,209 @@
+'''
+Benchmarks for the guess hot path, persistence and dictionary loading.
+
+Run them with `pytest -m benchmark` (see test_benchmarks.py), or with `python benchmarks.py`,
+optionally saving the results with `--output results.json` and checking them against an earlier
+run with `--compare baseline.json`. Comparing exits with an error if anything got slower than
+the allowed tolerance.
+'''
+
+import os
+import sys
+import json
+import contextlib
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from typing import Callable
+
+
+MIN_TIME = 0.2
+REPEATS = 5
+
+
+def measure(func: Callable[[], object], min_time: float = MIN_TIME, repeats: int = REPEATS) -> float:
+    '''
+    Time a function, returning the best seconds per call over several rounds.
+    '''
+    # Work out how many calls make up a round of at least `min_time`
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        calls *= 2
+
+    best = elapsed / calls
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        best = min(best, (time.perf_counter() - start) / calls)
+
+    return best
+
+
+def bench_evaluate_guess() -> float:
+    from dictionary import get_solution_words_for
+    from wordle_logic import evaluate_guess
+
+    words = get_solution_words_for('en')
+    pairs = [(random.choice(words), random.choice(words)) for _ in range(1000)]
+    return measure(lambda: [tuple(evaluate_guess(guess, answer)) for guess, answer in pairs]) / len(pairs)
+
+
+def bench_enter_guess() -> float:
+    from dictionary import get_solution_words_for
+    from wordy_chat import enter_guess
+    from wordy_types import ActiveGame
+
+    words = get_solution_words_for('en')
+    guesses = [random.choice(words) for _ in range(6)]
+
+    def play():
+        game = ActiveGame(lang='en', answer=words[0])
+        for guess in guesses:
+            enter_guess(guess, game)
+
+    return measure(play) / len(guesses)
+
+
+def bench_handle_new_guess() -> float:
+    import main
+    from stub_user import StubUser
+    from dictionary import get_solution_words_for
+
+    words = get_solution_words_for('en')
+    users = [StubUser(id) for id in range(100)]
+
+    async def reply(*args, **kwargs):
+        pass
+
+    async def guess_round():
+        for user in users:
+            await main.handle_new_guess(random.choice(words), 'en', user, reply)
+
+    loop = asyncio.new_event_loop()
+    try:
+        return measure(lambda: loop.run_until_complete(guess_round())) / len(users)
+    finally:
+        loop.close()
+
+
+def bench_database_save(user_count: int) -> float:
+    from game_codec import encode_user
+    from json_db import JSONDatabase
+    from wordy_chat import enter_guess
+    from wordy_types import ActiveGame, UserInfo
+
+    # A realistic mix of players, with roughly one in ten part way through a game
+    records = {}
+    for id in range(user_count):
+        user = UserInfo(username=f'Player#{id:04}')
+        user.stats.wins, user.stats.losses = id % 50, id % 7
+        user.stats.games = {'en': id % 57, 'de': id % 3}
+        if id % 10 == 0:
+            user.current_game = ActiveGame(lang='en', answer='crane')
+            enter_guess('slate', user.current_game)
+            enter_guess('brine', user.current_game)
+        records[str(id)] = encode_user(user)
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'database.json')
+        with open(path, 'wt', encoding='utf-8') as f:
+            json.dump(records, f)
+
+        db = JSONDatabase(path)
+
+        def save():
+            db.mark_dirty()
+            db.save()
+
+        return measure(save, repeats=3)
+
+
+def bench_fetch_cached_file(hot: bool) -> float:
+    import file_reader
+    from dictionary import _parse_lines
+
+    path = 'data/en/accepted_words.txt'
+    file_reader.fetch_cached_file(path, _parse_lines)
+
+    def fetch():
+        if not hot:
+            file_reader._file_caches.pop(path, None)
+        file_reader.fetch_cached_file(path, _parse_lines)
+
+    # Every cold fetch logs that it's reading the file, which would swamp the output
+    with open(os.devnull, 'wt') as devnull, contextlib.redirect_stdout(devnull):
+        return measure(fetch)
+
+
+BENCHMARKS: dict[str, Callable[[], float]] = {
+    'evaluate_guess': bench_evaluate_guess,
+    'enter_guess': bench_enter_guess,
+    'handle_new_guess': bench_handle_new_guess,
+    'database_save_1k': lambda: bench_database_save(1_000),
+    'database_save_10k': lambda: bench_database_save(10_000),
+    'database_save_100k': lambda: bench_database_save(100_000),
+    'fetch_cached_file_hot': lambda: bench_fetch_cached_file(True),
+    'fetch_cached_file_cold': lambda: bench_fetch_cached_file(False),
+}
+
+
+def compare(results: dict[str, float], baseline: dict[str, float], tolerance: float) -> list[str]:
+    '''
+    Find the benchmarks that got slower than the baseline by more than the tolerance.
+
+    >>> compare({'a': 1.3, 'b': 1.0, 'c': 5.0}, {'a': 1.0, 'b': 1.0}, 0.2)
+    ['a']
+    '''
+    return [
+        name for name, seconds in results.items()
+        if name in baseline and seconds > baseline[name] * (1 + tolerance)
+    ]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the Wordy benchmarks")
+    parser.add_argument('names', nargs='*', help=f"Benchmarks to run, from: {', '.join(BENCHMARKS)} (default all)")
+    parser.add_argument('--output', help="Save results to this JSON file")
+    parser.add_argument('--compare', help="Compare results against this JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed slowdown before failing a comparison")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    # Keep the benchmark players and their games out of the real database and totals
+    database_folder = tempfile.mkdtemp()
+    os.environ['DATABASE_PATH'] = os.path.join(database_folder, 'database.json')
+    os.environ['GLOBAL_STATS_PATH'] = os.path.join(database_folder, 'global_stats.json')
+    os.environ['DAILY_RESULTS_PATH'] = os.path.join(database_folder, 'daily_results.json')
+    with open(os.environ['DATABASE_PATH'], 'wt', encoding='utf-8') as f:
+        f.write('{}')
+
+    results: dict[str, float] = {}
+    for name in args.names or BENCHMARKS:
+        results[name] = BENCHMARKS[name]()
+        print(f"{name:>24}: {results[name]*1e6:12.2f} µs")
+
+    if args.output:
+        with open(args.output, 'wt', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+
+    if args.compare:
+        with open(args.compare, 'rt', encoding='utf-8') as f:
+            baseline = json.load(f)
+        for name in results:
+            if name in baseline:
+                print(f"{name:>24}: {results[name] / baseline[name]:.2f}x baseline")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"Slower than baseline: {', '.join(regressions)}")
+            sys.exit(1)
@@ -0,0 +1,187 @@
+'''
+A compact binary dictionary format, loaded with mmap so startup doesn't parse any text.
+
+Each language's solution and accepted words are stored in one file as fixed-width letter
+codes, along with a sorted order for binary search. Build the files with
+`python compiled_dictionary.py build [lang ...]` whenever the text word lists change,
+and compare load times with `python compiled_dictionary.py bench`.
+'''
+
+import mmap
+import struct
+from typing import Iterator, Sequence, overload
+
+
+MAGIC = b'WDIC'
+VERSION = 1
+HEADER = struct.Struct('<4sHHII')
+SECTION = struct.Struct('<III')
+
+
+class CompiledWords(Sequence[str]):
+    '''
+    A read-only list of words backed by a compiled dictionary, in their original order.
+
+    Membership tests are a binary search, and words are only decoded when accessed.
+
+    >>> data = compile_words('cab', [['bac', 'cab', 'aab']])
+    >>> words, = parse_compiled(data)
+    >>> list(words), len(words), words[-1]
+    (['bac', 'cab', 'aab'], 3, 'aab')
+    >>> 'cab' in words, 'abc' in words, 'x' in words
+    (True, False, False)
+    '''
+    def __init__(self, data: bytes|mmap.mmap, alphabet: str, length: int, count: int, words_offset: int, order_offset: int):
+        self._data = memoryview(data)
+        self._alphabet = alphabet
+        self._codes = {letter: code for code, letter in enumerate(alphabet, 1)}
+        self._length = length
+        self._count = count
+        self._words_offset = words_offset
+        self._order = self._data[order_offset:order_offset + count*4].cast('I')
+
+    def __len__(self) -> int:
+        return self._count
+
+    @overload
+    def __getitem__(self, index: int) -> str: ...
+    @overload
+    def __getitem__(self, index: slice) -> list[str]: ...
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('word index out of range')
+
+        return ''.join(self._alphabet[code - 1] for code in self._encoded(index))
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self._count):
+            yield self[i]
+
+    def __contains__(self, word: object) -> bool:
+        if not isinstance(word, str) or len(word) != self._length:
+            return False
+        try:
+            key = bytes(self._codes[letter] for letter in word)
+        except KeyError:
+            return False
+
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._encoded(self._order[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low < self._count and self._encoded(self._order[low]) == key
+
+    def _encoded(self, index: int) -> bytes:
+        start = self._words_offset + index * self._length
+        return bytes(self._data[start:start + self._length])
+
+
+def parse_compiled(data: bytes|mmap.mmap) -> tuple[CompiledWords, ...]:
+    '''
+    Read the word lists from a compiled dictionary, without copying them out of the data.
+    '''
+    magic, version, length, alphabet_size, section_count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a compiled dictionary file")
+
+    offset = HEADER.size
+    alphabet = bytes(data[offset:offset + alphabet_size]).decode('utf-8')
+    offset += alphabet_size
+
+    sections = []
+    for _ in range(section_count):
+        count, words_offset, order_offset = SECTION.unpack_from(data, offset)
+        sections.append(CompiledWords(data, alphabet, length, count, words_offset, order_offset))
+        offset += SECTION.size
+
+    return tuple(sections)
+
+
+def compile_words(alphabet: str, word_lists: Sequence[Sequence[str]]) -> bytes:
+    '''
+    Build a compiled dictionary from some word lists, all with words of the same length.
+
+    Letters are numbered in alphabet order, with any extra letters found in the words added on the end.
+    '''
+    extra_letters = sorted({letter for words in word_lists for word in words for letter in word} - set(alphabet))
+    alphabet += ''.join(extra_letters)
+    codes = {letter: code for code, letter in enumerate(alphabet, 1)}
+    length = next((len(words[0]) for words in word_lists if words), 0)
+
+    encoded_alphabet = alphabet.encode('utf-8')
+    header = HEADER.pack(MAGIC, VERSION, length, len(encoded_alphabet), len(word_lists)) + encoded_alphabet
+    offset = len(header) + SECTION.size * len(word_lists)
+
+    sections = b''
+    body = b''
+    for words in word_lists:
+        encoded = [bytes(codes[letter] for letter in word) for word in words]
+        order = sorted(range(len(encoded)), key=encoded.__getitem__)
+
+        words_data = b''.join(encoded)
+        order_data = struct.pack(f'<{len(order)}I', *order)
+        sections += SECTION.pack(len(words), offset, offset + len(words_data))
+        body += words_data + order_data
+        offset += len(words_data) + len(order_data)
+
+    return header + sections + body
+
+
+def get_compiled_path(lang: str) -> str:
+    return f'data/{lang}/words.bin'
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    import time
+    from pathlib import Path
+
+    from dictionary import languages, _parse_lines
+
+    def build(langs: Sequence[str]):
+        for lang in langs:
+            solutions = _parse_lines(Path(f'data/{lang}/solution_words.txt').read_bytes())
+            accepted = _parse_lines(Path(f'data/{lang}/accepted_words.txt').read_bytes())
+            data = compile_words(languages[lang]['alphabet'], [solutions, accepted])
+
+            temp_path = get_compiled_path(lang) + '.tmp'
+            Path(temp_path).write_bytes(data)
+            os.replace(temp_path, get_compiled_path(lang))
+            print(f"Built {get_compiled_path(lang)}: {len(data)/1024:.0f} KiB")
+
+    def bench(repeats: int = 20):
+        def load_text():
+            for lang in languages:
+                for name in ('solution_words', 'accepted_words'):
+                    words = _parse_lines(Path(f'data/{lang}/{name}.txt').read_bytes())
+                    _ = 'zzzzz' in words
+
+        def load_compiled():
+            for lang in languages:
+                with open(get_compiled_path(lang), 'rb') as f:
+                    for words in parse_compiled(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)):
+                        _ = 'zzzzz' in words
+
+        for name, load in (('text', load_text), ('compiled', load_compiled)):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                load()
+            elapsed = (time.perf_counter() - start) / repeats
+            print(f"{name:>8}: {elapsed*1000:.2f} ms to load and search every language")
+
+    if sys.argv[1:2] == ['build']:
+        build(sys.argv[2:] or list(languages))
+    elif sys.argv[1:2] == ['bench']:
+        bench()
+    else:
+        print("Usage: python compiled_dictionary.py build [lang ...] | bench")
+        sys.exit(1)
@@ -0,0 +1,25 @@
+from collections import OrderedDict
+
+import pytest
+
+import daily
+import game_store
+import global_stats
+from json_db import JSONDatabase
+
+
+@pytest.fixture
+def scratch_database(tmp_path, monkeypatch):
+    '''
+    Keep players and totals made by a test out of whatever databases were opened on import.
+    '''
+    def scratch(name: str) -> JSONDatabase:
+        path = tmp_path / name
+        path.write_text('{}', encoding='utf-8')
+        return JSONDatabase(str(path))
+
+    monkeypatch.setattr(game_store, '_db', scratch('database.json'))
+    monkeypatch.setattr(game_store, '_cache', OrderedDict())
+    monkeypatch.setattr(game_store, '_dirty', set())
+    monkeypatch.setattr(global_stats._store, '_db', scratch('global_stats.json'))
+    monkeypatch.setattr(daily._store, '_db', scratch('daily_results.json'))
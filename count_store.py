@@ -0,0 +1,92 @@
+'''
+Small tables of counts that every bot process adds to as games finish, such as the server-wide totals.
+'''
+import os
+import sys
+import asyncio
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+import game_store
+from json_db import JSONDatabase
+from sqlite_db import SQLiteDatabase
+from write_behind import WriteBehindFlusher
+
+
+class CountStore:
+    '''
+    Records kept in a file of their own, named by the `path_setting` environment variable, or for
+    processes sharing players, in `table` of the database they share.
+
+    The file is opened the first time it's needed (and created if it doesn't exist). Records are
+    changed in place with `modify`, as other processes may be counting at the same time.
+    '''
+    def __init__(self, table: str, path_setting: str, default_path: str):
+        self.table = table
+        self.path_setting = path_setting
+        self.default_path = default_path
+        self._db: Optional[JSONDatabase | SQLiteDatabase] = None
+        self._flusher: Optional[WriteBehindFlusher] = None
+
+
+    def get_db(self) -> JSONDatabase | SQLiteDatabase:
+        if self._db is None:
+            self._db = self._open()
+        return self._db
+
+
+    def _open(self) -> JSONDatabase | SQLiteDatabase:
+        if game_store.is_shared():
+            return game_store.open_shared_table(self.table)
+
+        path = os.getenv(self.path_setting, self.default_path)
+        if not os.path.exists(path):
+            Path(path).write_text('{}', encoding='utf-8')
+        return JSONDatabase(path)
+
+
+    def get(self, id: str) -> Optional[dict[str, Any]]:
+        return self.get_db().get(id, None)
+
+
+    def items(self) -> Iterator[tuple[str, dict[str, Any]]]:
+        return self.get_db().items()
+
+
+    async def modify(self, id: str, change: Callable[[Optional[dict[str, Any]]], dict[str, Any]]):
+        '''
+        Replace a record with what `change` makes of it (None if there isn't one yet).
+
+        In a shared database this waits for other processes to finish writing, so is done in a worker thread.
+        '''
+        db = self.get_db()
+        if isinstance(db, SQLiteDatabase):
+            await asyncio.get_running_loop().run_in_executor(None, db.modify, id, change)
+        else:
+            db.modify(id, change)
+
+
+    def save(self):
+        '''
+        Save the records, unless they are already being saved in the background.
+        '''
+        if self._db is not None and self._flusher is None:
+            self._db.save()
+
+
+    def start_saving(self, interval: float):
+        '''
+        Save the records every `interval` seconds from a worker thread, instead of on every `save`.
+        Must be called from within the running event loop.
+        '''
+        if self._flusher is None:
+            self._flusher = WriteBehindFlusher(self.get_db(), interval, sys.maxsize)
+            self._flusher.start()
+
+
+    def flush(self):
+        '''
+        Save the records immediately, regardless of mode. Used at shutdown.
+        '''
+        if self._db is not None:
+            self._db.save()
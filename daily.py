@@ -0,0 +1,118 @@
+'''
+The daily puzzle, where everyone playing a language gets the same word each day.
+
+Words are picked from a shuffled schedule over each language's solution list, so every bot
+instance agrees on the word without having to store it. How everyone did is counted in a
+small table per language and day, kept in its own file (or, for processes sharing players, in a
+table of the database they share).
+'''
+import os
+import random
+import datetime
+import functools
+from typing import Any, Optional
+
+from count_store import CountStore
+from dictionary import get_solution_words_for
+from wordy_chat import render_code, render_distribution
+from wordy_types import MAX_GUESSES, EndResult
+
+
+# Day number zero, and the seed that decides the order of words (changing it changes every day's word)
+DAILY_EPOCH = datetime.date(2022, 1, 1)
+DAILY_SEED = os.getenv('DAILY_SEED', 'wordy')
+
+
+_store = CountStore('daily_results', 'DAILY_RESULTS_PATH', 'daily_results.json')
+save = _store.save
+start_saving = _store.start_saving
+flush = _store.flush
+
+
+def get_today() -> int:
+    '''
+    Get today's day number. Days change at midnight UTC.
+    '''
+    return (datetime.datetime.now(datetime.timezone.utc).date() - DAILY_EPOCH).days
+
+
+def get_daily_word(lang: str, day: int) -> str:
+    '''
+    Get the answer for a day's puzzle.
+
+    Each pass through the solution list uses a fresh shuffle, so every word comes up once before any repeats.
+
+    >>> import contextlib, io
+    >>> with contextlib.redirect_stdout(io.StringIO()):
+    ...     words = get_solution_words_for('en')
+    ...     first_pass = {get_daily_word('en', day) for day in range(len(words))}
+    ...     same = get_daily_word('en', 100) == get_daily_word('en', 100)
+    >>> len(first_pass) == len(set(words)), same
+    (True, True)
+    '''
+    words = get_solution_words_for(lang)
+    cycle, position = divmod(day, len(words))
+    return words[_get_schedule(lang, len(words), cycle)[position]]
+
+
+@functools.lru_cache(maxsize=32)
+def _get_schedule(lang: str, count: int, cycle: int) -> tuple[int, ...]:
+    '''
+    Get the order solution words are used in during one pass through the list.
+    '''
+    order = list(range(count))
+    random.Random(f'{DAILY_SEED}:{lang}:{cycle}').shuffle(order)
+    return tuple(order)
+
+
+def get_outcomes(lang: str, day: int) -> list[int]:
+    '''
+    Count how a day's puzzle went, as the number of wins in each number of guesses followed by the losses.
+    '''
+    return _counts(_store.get(f'{lang}:{day}'))
+
+
+def _counts(record: Optional[dict[str, Any]]) -> list[int]:
+    return list(record['counts']) if record else [0]*(MAX_GUESSES + 1)
+
+
+async def record_outcome(lang: str, day: int, result: EndResult, guesses: int):
+    '''
+    Count a finished daily game.
+    '''
+    def count(record: Optional[dict[str, Any]]) -> dict[str, Any]:
+        counts = _counts(record)
+        counts[guesses - 1 if result == EndResult.WIN else MAX_GUESSES] += 1
+        return dict(counts=counts)
+
+    await _store.modify(f'{lang}:{day}', count)
+
+
+def render_outcomes(lang: str, day: int) -> str:
+    '''
+    Describe how everyone did on a day's puzzle.
+    '''
+    counts = get_outcomes(lang, day)
+    wins = sum(counts[:MAX_GUESSES])
+    played = wins + counts[MAX_GUESSES]
+    if not played:
+        return "Nobody has finished today's puzzle yet."
+
+    return (f"{played} player{'' if played == 1 else 's'} finished, {wins / played:.0%} solved it:\n"
+        f"```{render_distribution(counts[:MAX_GUESSES])}X {counts[MAX_GUESSES]}```")
+
+
+@functools.lru_cache(maxsize=4096)
+def render_share(lang: str, day: int, codes: tuple[int, ...], won: bool, length: int, colorblind: bool = False) -> str:
+    '''
+    Render a spoiler-free summary of a finished daily game. As many players end up with the same
+    results, each one is only rendered once.
+
+    >>> print(render_share('en', 10, (5, 26), True, 3))
+    Wordy daily #10 [en] 2/6
+    ⬛🟨🟩
+    🟩🟩🟩
+    '''
+    score = len(codes) if won else 'X'
+    rows = '\n'.join(render_code(code, length, colorblind) for code in codes)
+    return f"Wordy daily #{day} [{lang}] {score}/{MAX_GUESSES}\n{rows}"
@@ -0,0 +1,351 @@
+'''
+Streams player records between database formats without loading the whole database at once.
+
+`python db_tool.py database.json users.ndjson` reads the json database one record at a time,
+checks each record is a valid player, and writes it out as it goes. Formats are picked from
+the file extensions, or given with `--from` and `--to`:
+
+ * `json`: a database file as used by `JSONDatabase`
+ * `ndjson`: one `{"id": ..., "data": ...}` object per line
+ * `csv`: one row of stats per player, for analysis (can't be read back)
+ * `sqlite`: a database file as used by `SQLiteDatabase`
+
+So a database.json can be rebuilt with e.g. `python db_tool.py users.ndjson database.json`.
+
+Invalid records are reported and skipped (or stop the run with `--strict`), and the exit code
+is 1 if any were skipped. Progress is printed to stderr.
+'''
+
+import os
+import sys
+import csv
+import json
+import time
+import sqlite3
+import argparse
+from pathlib import Path
+from typing import Any, Iterator, Optional, TextIO
+
+from dictionary import languages
+from game_codec import decode_user
+from wordy_types import UserInfo
+
+
+FORMATS = {
+    '.json': 'json',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.csv': 'csv',
+    '.sqlite': 'sqlite',
+    '.db': 'sqlite',
+}
+
+CSV_COLUMNS = ['id', 'username', 'colorblind', 'wins', 'losses', 'surrenders',
+    *(f'games_{lang}' for lang in languages), 'playing', 'guesses']
+
+
+def iter_json_records(file: TextIO, chunk_size: int = 1024*1024) -> Iterator[tuple[str, Any]]:
+    '''
+    Read the items of a json object one at a time, only holding about `chunk_size` characters at once.
+
+    >>> import io
+    >>> text = '{"1": {"a": [1, 2]}, "22": {"b": "x}"} ,"3":{}}'
+    >>> list(iter_json_records(io.StringIO(text), chunk_size=4))
+    [('1', {'a': [1, 2]}), ('22', {'b': 'x}'}), ('3', {})]
+    >>> list(iter_json_records(io.StringIO('{}')))
+    []
+    '''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def fill() -> bool:
+        # Drop what has been used, then read some more
+        nonlocal buffer, pos, eof
+        if eof:
+            return False
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return not eof
+
+    def skip_space():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or not fill():
+                return
+
+    def expect(chars: str) -> str:
+        nonlocal pos
+        skip_space()
+        if pos >= len(buffer) or buffer[pos] not in chars:
+            found = buffer[pos:pos+20] if pos < len(buffer) else 'end of file'
+            raise ValueError(f"Expected one of {chars!r} but found {found!r}")
+        pos += 1
+        return buffer[pos-1]
+
+    def value() -> Any:
+        nonlocal pos
+        skip_space()
+        while True:
+            try:
+                result, end = decoder.raw_decode(buffer, pos)
+                # A value running up to the end of the buffer may continue in the next chunk
+                if end < len(buffer) or eof:
+                    pos = end
+                    return result
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+
+    expect('{')
+    skip_space()
+    if buffer[pos:pos+1] == '}':
+        return
+
+    while True:
+        key = value()
+        expect(':')
+        yield key, value()
+        if expect(',}') == '}':
+            return
+
+
+class RecordReader:
+    '''
+    Reads every record from a file in the given format, one at a time.
+
+    The file is opened by `open`, or when first iterated over, and closed once every record is read.
+    '''
+    def __init__(self, path: str, format: str):
+        if format not in ('json', 'ndjson', 'sqlite'):
+            raise ValueError(f"Can't read records from {format}")
+        self.path = path
+        self.format = format
+        self._file: Optional[TextIO] = None
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def open(self):
+        '''
+        Open the source, raising if it's missing or can't be read.
+
+        SQLite sources are opened read-only, so the source is never changed (or, given a wrong path,
+        created), and have their players table checked.
+        '''
+        if self.format != 'sqlite':
+            self._file = open(self.path, 'rt', encoding='utf-8')
+            return
+
+        from sqlite_db import SQL_SELECT_ALL
+
+        if not os.path.isfile(self.path):
+            raise FileNotFoundError(f"No such database: {self.path}")
+
+        self._connection = sqlite3.connect(Path(self.path).absolute().as_uri() + '?mode=ro', uri=True)
+        try:
+            self._connection.execute(SQL_SELECT_ALL.format(table='users') + " LIMIT 0")
+        except sqlite3.Error:
+            self.close()
+            raise
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __iter__(self) -> Iterator[tuple[str, Any]]:
+        if (self._file is None or self._file.closed) and self._connection is None:
+            self.open()
+
+        try:
+            if self._connection is not None:
+                yield from self._iter_sqlite(self._connection)
+            elif self._file is not None:
+                if self.format == 'json':
+                    yield from iter_json_records(self._file)
+                else:
+                    for line in self._file:
+                        if line.strip():
+                            record = json.loads(line)
+                            yield str(record['id']), record['data']
+        finally:
+            self.close()
+
+    def _iter_sqlite(self, connection: sqlite3.Connection) -> Iterator[tuple[str, Any]]:
+        from sqlite_db import SQL_SELECT_ALL
+
+        for id, data in connection.execute(SQL_SELECT_ALL.format(table='users')):
+            yield id, json.loads(data)
+
+    def position(self) -> Optional[int]:
+        '''
+        Get roughly how many bytes have been read so far, if known.
+        '''
+        if self._file is None or self._file.closed:
+            return None
+        return self._file.buffer.tell()
+
+
+class RecordWriter:
+    '''
+    Writes records to a file in the given format, one at a time.
+    '''
+    def __init__(self, path: str, format: str, batch_size: int = 1000):
+        self.path = path
+        self.format = format
+        self.batch_size = batch_size
+        self.count = 0
+        self._file: Any = None
+        self._csv: Any = None
+        self._db: Any = None
+
+        if format == 'sqlite':
+            from sqlite_db import SQLiteDatabase
+            self._db = SQLiteDatabase(path)
+        elif format in ('json', 'ndjson', 'csv'):
+            # Write to a temporary file, so a failed run never leaves a partial file behind
+            self._file = open(path + '.tmp', 'wt', encoding='utf-8', newline='')
+            if format == 'json':
+                self._file.write('{')
+            elif format == 'csv':
+                self._csv = csv.writer(self._file)
+                self._csv.writerow(CSV_COLUMNS)
+        else:
+            raise ValueError(f"Can't write records to {format}")
+
+    def write(self, id: str, raw: dict[str, Any], info: Optional[UserInfo]):
+        if self.format == 'json':
+            separator = ',\n' if self.count else '\n'
+            self._file.write(f'{separator}    {json.dumps(id)}: {json.dumps(raw, separators=(",", ":"))}')
+        elif self.format == 'ndjson':
+            self._file.write(json.dumps(dict(id=id, data=raw), separators=(',', ':')) + '\n')
+        elif self.format == 'csv':
+            info = info or decode_user(raw)
+            game = info.current_game
+            self._csv.writerow([id, info.username or '', int(info.settings.colorblind),
+                info.stats.wins, info.stats.losses, info.stats.surrenders,
+                *(info.stats.games.get(lang, 0) for lang in languages),
+                game.lang if game else '', len(game.board_state) if game else ''])
+        else:
+            self._db[id] = raw
+            if len(self._db.pending) >= self.batch_size:
+                self._db.save()
+
+        self.count += 1
+
+    def close(self):
+        if self._db is not None:
+            self._db.save()
+            return
+
+        file = self._file
+        assert file is not None
+        if self.format == 'json':
+            file.write('\n}\n')
+        file.close()
+        os.replace(self.path + '.tmp', self.path)
+
+    def abort(self):
+        if self._file is not None:
+            self._file.close()
+            os.remove(self.path + '.tmp')
+
+
+class Progress:
+    '''
+    Prints how far through the input we are, at most once every `interval` seconds.
+    '''
+    def __init__(self, path: str, interval: float = 1.0):
+        self.total_bytes = os.path.getsize(path) if os.path.isfile(path) else 0
+        self.interval = interval
+        self.start = time.monotonic()
+        self.last = self.start
+
+    def update(self, records: int, bytes_read: Optional[int] = None, done: bool = False):
+        now = time.monotonic()
+        if not done and now - self.last < self.interval:
+            return
+        self.last = now
+
+        rate = records / max(now - self.start, 1e-9)
+        text = f"{records} records ({rate:.0f}/s)"
+        if bytes_read is not None and self.total_bytes:
+            text += f", {bytes_read / self.total_bytes:.0%} of input"
+        print(text, file=sys.stderr, end='\n' if done else '\r', flush=True)
+
+
+def convert(source: str, dest: str, source_format: str, dest_format: str, validate: bool = True, strict: bool = False) -> tuple[int, int]:
+    '''
+    Copy every record from one file to another, returning the number copied and the number skipped as invalid.
+    '''
+    # Open the source first, so a missing or unreadable one leaves nothing behind at the destination
+    reader = RecordReader(source, source_format)
+    reader.open()
+    try:
+        writer = RecordWriter(dest, dest_format)
+    except BaseException:
+        reader.close()
+        raise
+    progress = Progress(source)
+    skipped = 0
+
+    try:
+        for id, raw in reader:
+            info = None
+            if validate or dest_format == 'csv':
+                try:
+                    info = decode_user(raw)
+                except Exception as ex:
+                    if strict:
+                        raise ValueError(f"Record {id} is not a valid player: {ex}") from ex
+                    print(f"Skipping record {id}: {ex}", file=sys.stderr)
+                    skipped += 1
+                    continue
+
+            writer.write(id, raw, info)
+            progress.update(writer.count, reader.position())
+    except BaseException:
+        reader.close()
+        writer.abort()
+        raise
+
+    writer.close()
+    progress.update(writer.count, done=True)
+    return writer.count, skipped
+
+
+def guess_format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError(f"Can't tell the format of {path}, please give it with --from or --to")
+    return FORMATS[ext]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stream player records from one database format to another")
+    parser.add_argument('source', help="File to read players from")
+    parser.add_argument('dest', help="File to write players to")
+    parser.add_argument('--from', dest='source_format', choices=sorted(set(FORMATS.values()) - {'csv'}),
+        help="Format of the source (guessed from the extension by default)")
+    parser.add_argument('--to', dest='dest_format', choices=sorted(set(FORMATS.values())),
+        help="Format of the destination (guessed from the extension by default)")
+    parser.add_argument('--no-validate', action='store_true', help="Copy records as they are, without checking them")
+    parser.add_argument('--strict', action='store_true', help="Stop at the first invalid record instead of skipping it")
+    args = parser.parse_args()
+
+    try:
+        source_format = args.source_format or guess_format(args.source)
+        dest_format = args.dest_format or guess_format(args.dest)
+    except ValueError as ex:
+        parser.error(str(ex))
+
+    copied, skipped = convert(args.source, args.dest, source_format, dest_format, not args.no_validate, args.strict)
+    print(f"Copied {copied} players to {args.dest}" + (f", skipped {skipped} invalid records" if skipped else ''))
+    sys.exit(1 if skipped else 0)
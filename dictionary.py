@@ -2,9 +2,22 @@
 This file gives fully cached access to the dictionary words.
 
 Note that dictionaries that change on disk will be reloaded automatically.
+
+Setting `DICTIONARY_FORMAT=compiled` loads the words from the memory-mapped files built by
+`compiled_dictionary.py` instead of parsing the text word lists.
 '''
 
-from file_reader import fetch_cached_file
+import os
+from typing import Any, Container, Iterable, Sequence
+
+from compiled_dictionary import get_compiled_path, parse_compiled
+from file_reader import fetch_cached_file, fetch_cached_mmap
+
+
+_use_compiled = os.getenv('DICTIONARY_FORMAT', 'text') == 'compiled'
+
+# Per-language guess index, remade (without copying any words) whenever either of the word lists is reloaded
+_word_indexes: dict[str, tuple[Sequence[str], Sequence[str], Container[str]]] = {}
 
 
 languages = {
@@ -51,29 +64,94 @@ def get_alphabet_for(lang: str) -> str:
     return languages[lang]['alphabet']
 
 
-def get_solution_words_for(lang: str) -> list[str]:
+def get_solution_words_for(lang: str) -> Sequence[str]:
     '''
     Get the solution words for a language.
     '''
     if lang not in languages:
         raise ValueError(f'Language {lang} is not supported')
 
+    if _use_compiled:
+        return fetch_cached_mmap(get_compiled_path(lang), parse_compiled)[0]
+
     return fetch_cached_file(f'data/{lang}/solution_words.txt', _parse_lines)
 
 
-def get_acceptable_words_for(lang: str) -> list[str]:
+def get_acceptable_words_for(lang: str) -> Sequence[str]:
     '''
     Get the acceptable guess words for a language.
     '''
     if lang not in languages:
         raise ValueError(f'Language {lang} is not supported')
 
+    if _use_compiled:
+        return fetch_cached_mmap(get_compiled_path(lang), parse_compiled)[1]
+
     return fetch_cached_file(f'data/{lang}/accepted_words.txt', _parse_lines)
 
 
-def _parse_lines(data: bytes) -> list[str]:
+def preload_all():
+    '''
+    Load the word lists for every language, so they are all known to the file watcher.
+    '''
+    for lang in languages:
+        get_word_index_for(lang)
+
+
+def get_word_index_for(lang: str) -> Container[str]:
+    '''
+    Get a set of every valid guess for a language, covering both solution and acceptable words.
+
+    Both word lists are already searchable, as text word lists get a set of their words when
+    they are loaded (on the file watcher's thread, when it's running) and compiled word lists
+    are sorted. So the index only looks in each of them, and nothing is built here.
+    '''
+    solutions = get_solution_words_for(lang)
+    acceptable = get_acceptable_words_for(lang)
+
+    cached = _word_indexes.get(lang)
+    if cached and cached[0] is solutions and cached[1] is acceptable:
+        return cached[2]
+
+    index = _CombinedWords(solutions, acceptable)
+    _word_indexes[lang] = (solutions, acceptable, index)
+    return index
+
+
+def is_valid_guess(lang: str, word: str) -> bool:
+    '''
+    Check if a word is allowed as a guess in the given language, without scanning the word lists.
+    '''
+    return word in get_word_index_for(lang)
+
+
+class _CombinedWords:
+    def __init__(self, *word_lists: Container[Any]):
+        self.word_lists = word_lists
+
+    def __contains__(self, word: object) -> bool:
+        return any(word in words for words in self.word_lists)
+
+
+class _IndexedWords(list[str]):
+    '''
+    A word list that also keeps a set of its words, so checking for a word doesn't scan the list.
+
+    >>> words = _IndexedWords(['abcd', 'efgh'])
+    >>> 'efgh' in words, 'ijkl' in words, words[1]
+    (True, False, 'efgh')
+    '''
+    def __init__(self, words: Iterable[str]):
+        super().__init__(words)
+        self.word_set = frozenset(self)
+
+    def __contains__(self, word: object) -> bool:
+        return word in self.word_set
+
+
+def _parse_lines(data: bytes) -> _IndexedWords:
     lines = data.decode('utf-8').splitlines()
-    return [word for word in lines if word]
+    return _IndexedWords(word for word in lines if word)
 
 
 if __name__ == '__main__':
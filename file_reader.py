@@ -1,16 +1,25 @@
 from __future__ import annotations
 
 import os
+import mmap
+import time
 import functools
+import threading
+import traceback
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Callable, TypeVar, cast
+from typing import Any, Callable, Optional, TypeVar, cast
+
+import metrics
 
 
 TResult = TypeVar('TResult')
 NO_CACHE = object()
 
-_file_caches = {}
+_file_caches: dict[str, FileLoaderState] = {}
+
+# Set while the background watcher is running, so request handlers skip stat calls entirely
+_watcher: Optional[FileWatcher] = None
 
 
 @dataclass
@@ -20,6 +29,11 @@ class FileLoaderState:
     mtime: float = 0
     size: int = 0
     cache: Any = NO_CACHE
+    transform: Optional[Callable[[Any], Any]] = None
+    mapped: bool = False
+    reloads: int = 0
+    last_reload_seconds: float = 0
+    total_reload_seconds: float = 0
 
 
 def cache_file(path: str) -> Callable[[Callable[[bytes], TResult]], Callable[[], TResult]]:
@@ -31,12 +45,7 @@ def cache_file(path: str) -> Callable[[Callable[[bytes], TResult]], Callable[[],
     def cache_file_inner(func):
         @functools.wraps(func)
         def wrapper():
-            state = _file_caches.setdefault(path, FileLoaderState(path))
-            if _should_fetch_file(state):
-                data = _read_file(state)
-                state.cache = func(data)
-
-            return state.cache
+            return fetch_cached_file(path, func)
 
         return wrapper
 
@@ -48,14 +57,112 @@ def fetch_cached_file(path: str, transform_fn: Callable[[bytes], TResult]) -> TR
     Fetch a file from disk, transforming it using the given function and caching the result.
     Cached data is used if available and the file on disk is unchanged, skipping the transform stage.
     '''
+    return _fetch_cached(path, transform_fn)
+
+
+def fetch_cached_mmap(path: str, transform_fn: Callable[[mmap.mmap], TResult]) -> TResult:
+    '''
+    Like `fetch_cached_file`, but the transform is given a read-only memory map of the file
+    instead of its contents, so data can be used in place without being copied into memory.
+    '''
+    _file_caches.setdefault(path, FileLoaderState(path, mapped=True))
+    return _fetch_cached(path, transform_fn)
+
+
+def _fetch_cached(path: str, transform_fn: Callable[[Any], TResult]) -> TResult:
+    '''
+    Fetch a file, given to the transform as bytes or as a memory map, as its loader state says.
+    '''
     state = _file_caches.setdefault(path, FileLoaderState(path))
+    state.transform = transform_fn
+
+    # The watcher keeps loaded files up to date for us
+    if _watcher and state.cache is not NO_CACHE:
+        if metrics.enabled:
+            metrics.FILE_CACHE_REQUESTS.inc(result='hit')
+        return cast(Any, state.cache)
+
     if _should_fetch_file(state):
-        data = _read_file(state)
-        state.cache = transform_fn(data)
+        if metrics.enabled:
+            metrics.FILE_CACHE_REQUESTS.inc(result='miss')
+        _reload(state)
+    elif metrics.enabled:
+        metrics.FILE_CACHE_REQUESTS.inc(result='hit')
 
     return cast(Any, state.cache)
 
 
+def start_watching(interval: float = 5.0):
+    '''
+    Start a background thread that checks every loaded file for changes on the given interval.
+
+    Changed files are read and transformed on the watcher thread, then swapped in as a single
+    reference assignment, so callers of `fetch_cached_file` never touch the disk once loaded.
+    '''
+    global _watcher
+    if _watcher:
+        return
+
+    _watcher = FileWatcher(interval)
+    _watcher.start()
+
+
+def stop_watching():
+    '''
+    Stop the background watcher, returning to checking files on every access.
+    '''
+    global _watcher
+    if not _watcher:
+        return
+
+    watcher, _watcher = _watcher, None
+    watcher.stop()
+
+
+def get_reload_stats() -> dict[str, dict[str, Any]]:
+    '''
+    Get the number of times each cached file has been loaded, and how long that took.
+    '''
+    return {
+        path: dict(
+            reloads=state.reloads,
+            last_reload_seconds=state.last_reload_seconds,
+            total_reload_seconds=state.total_reload_seconds,
+        )
+        for path, state in list(_file_caches.items())
+    }
+
+
+class FileWatcher(threading.Thread):
+    '''
+    Background thread that reloads cached files when they change on disk.
+    '''
+    def __init__(self, interval: float):
+        super().__init__(name='file-watcher', daemon=True)
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.check_files()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def check_files(self):
+        for state in list(_file_caches.values()):
+            if state.transform is None or state.cache is NO_CACHE:
+                continue
+
+            try:
+                if _should_fetch_file(state):
+                    _reload(state)
+            except Exception:
+                print(f"Failed to reload file: {state.path}")
+                traceback.print_exc()
+
+
 def _should_fetch_file(state: FileLoaderState) -> bool:
     '''
     Works out if a file needs to be fetched from disk.
@@ -80,6 +187,25 @@ def _should_fetch_file(state: FileLoaderState) -> bool:
     return False
 
 
+def _reload(state: FileLoaderState):
+    '''
+    Read and transform a file, replacing the cached result in one step.
+    '''
+    start = time.perf_counter()
+    data = _map_file(state) if state.mapped else _read_file(state)
+    result = cast(Callable[[Any], Any], state.transform)(data)
+    state.cache = result
+
+    elapsed = time.perf_counter() - start
+    state.reloads += 1
+    state.last_reload_seconds = elapsed
+    state.total_reload_seconds += elapsed
+
+    if metrics.enabled:
+        metrics.FILE_RELOADS.inc(path=state.path)
+        metrics.FILE_RELOAD_SECONDS.observe(elapsed)
+
+
 def _read_file(state: FileLoaderState) -> bytes:
     print(f"Reading file: {state.path}")
     stat = os.stat(state.path)
@@ -88,3 +214,13 @@ def _read_file(state: FileLoaderState) -> bytes:
     state.size = stat.st_size
     return Path(state.path).read_bytes()
 
+
+def _map_file(state: FileLoaderState) -> mmap.mmap:
+    print(f"Mapping file: {state.path}")
+    with open(state.path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        state.ctime = stat.st_ctime
+        state.mtime = stat.st_mtime
+        state.size = stat.st_size
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
@@ -0,0 +1,149 @@
+'''
+Conversion between `UserInfo` objects and the compact records kept in the database.
+
+Active and daily games are stored with each result row as a base-3 number, the answer as its index in the
+language's solution list, and the guesses joined into one string. Records in the older, expanded
+format are still read as-is.
+
+As answers are stored by position, a checksum of the solution list is stored alongside. If the list has
+changed since, the answer at that position is only trusted if it gives the same results for the guesses
+made so far, and otherwise the game is dropped.
+'''
+
+import zlib
+from typing import Any, Sequence
+
+from dictionary import get_solution_words_for
+from wordle_logic import decode_result, encode_result, evaluate_guess
+from wordy_types import ActiveGame, UserInfo
+
+
+# Per-language answer lookup and list checksum, rebuilt whenever the solution list is reloaded
+_answer_indexes: dict[str, tuple[Sequence[str], dict[str, int], int]] = {}
+
+
+class AnswerChanged(Exception):
+    '''
+    A stored game's answer can't be recovered, as the solution list has changed since it was saved.
+    '''
+
+
+def encode_user(info: UserInfo) -> dict[str, Any]:
+    '''
+    Convert a player into a database record.
+    '''
+    data = info.dict()
+    if info.current_game is not None:
+        data['current_game'] = encode_game(info.current_game)
+    if info.daily_game is not None:
+        data['daily_game'] = encode_game(info.daily_game)
+    return data
+
+
+def decode_user(raw: dict[str, Any]) -> UserInfo:
+    '''
+    Convert a database record, in either format, back into a player.
+
+    A game whose answer can't be recovered from the solution list is dropped, as there's no telling what it was.
+
+    >>> import contextlib, io
+    >>> with contextlib.redirect_stdout(io.StringIO()):
+    ...     info = decode_user({'current_game': {'lang': 'en', 'state': 0, 'last_active': 0, 'a': 10**6, 'g': '', 'r': []}})
+    >>> info.current_game is None
+    True
+    '''
+    for field in ('current_game', 'daily_game'):
+        game = raw.get(field)
+        if game is not None and 'answer' not in game:
+            try:
+                raw = {**raw, field: decode_game(game)}
+            except (IndexError, AnswerChanged):
+                print(f"Dropping a stored game whose answer #{game['a']} is no longer in the {game['lang']} solution list")
+                raw = {**raw, field: None}
+    return UserInfo.parse_obj(raw)
+
+
+def encode_game(game: ActiveGame) -> dict[str, Any]:
+    '''
+    Pack a game into its compact form.
+
+    >>> import contextlib, io
+    >>> from wordy_types import LetterState
+    >>> game = ActiveGame(lang='en', answer='crane', board_state=['slate', 'crane'])
+    >>> game.results = [(LetterState.ABSENT,)*2 + (LetterState.CORRECT,) + (LetterState.ABSENT, LetterState.CORRECT), (LetterState.CORRECT,)*5]
+    >>> with contextlib.redirect_stdout(io.StringIO()):
+    ...     packed = encode_game(game)
+    >>> {key: value for key, value in packed.items() if key != 'c'}
+    {'lang': 'en', 'state': <EndResult.PLAYING: 0>, 'last_active': 0, 'a': 458, 'g': 'slatecrane', 'r': [20, 242]}
+    >>> ActiveGame.parse_obj(decode_game(packed)) == game
+    True
+
+    If the list has changed, the answer now at that position must fit the results.
+
+    >>> ActiveGame.parse_obj(decode_game({**packed, 'c': packed['c'] + 1})) == game
+    True
+    >>> decode_game({**packed, 'a': 459, 'c': packed['c'] + 1})
+    Traceback (most recent call last):
+    ...
+    game_codec.AnswerChanged
+    '''
+    data = game.dict(exclude={'answer', 'board_state', 'results'})
+    _, index, checksum = _get_answer_lookup(game.lang)
+    answer = index.get(game.answer)
+    if answer is None:
+        data['a'] = game.answer
+    else:
+        data['a'] = answer
+        data['c'] = checksum
+    data['g'] = ''.join(game.board_state)
+    data['r'] = [encode_result(result) for result in game.results]
+    return data
+
+
+def decode_game(data: dict[str, Any]) -> dict[str, Any]:
+    '''
+    Unpack a compact game into the fields of an `ActiveGame`.
+    '''
+    data = dict(data)
+    answer = data.pop('a')
+    # Records from before checksums were kept are checked like any other from a changed list
+    checksum = data.pop('c', None)
+    changed = False
+    if isinstance(answer, int):
+        solutions, _, current = _get_answer_lookup(data['lang'])
+        answer = solutions[answer]
+        changed = checksum != current
+
+    length = len(answer)
+    guesses = data.pop('g')
+    codes = data.pop('r')
+    data['answer'] = answer
+    data['board_state'] = [guesses[i:i+length] for i in range(0, len(guesses), length)]
+    if changed and any(encode_result(tuple(evaluate_guess(guess, answer))) != code
+                       for guess, code in zip(data['board_state'], codes)):
+        raise AnswerChanged()
+    data['results'] = [decode_result(code, length) for code in codes]
+    return data
+
+
+def solution_checksum(lang: str) -> int:
+    '''
+    Get a checksum of a language's current solution list, which changes whenever the list does.
+    '''
+    return _get_answer_lookup(lang)[2]
+
+
+def _get_answer_lookup(lang: str) -> tuple[Sequence[str], dict[str, int], int]:
+    '''
+    Get a language's solution list, the index of each word in it, and a checksum of the list.
+    '''
+    solutions = get_solution_words_for(lang)
+
+    cached = _answer_indexes.get(lang)
+    if cached and cached[0] is solutions:
+        return cached
+
+    index = {word: i for i, word in enumerate(solutions)}
+    checksum = zlib.crc32('\n'.join(solutions).encode('utf-8'))
+    _answer_indexes[lang] = cached = (solutions, index, checksum)
+    return cached
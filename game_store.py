@@ -1,25 +1,301 @@
 import os
-from typing import Optional
+import time
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterator, Optional
 
+import metrics
+import user_locks
+from game_codec import decode_user, encode_user
 from json_db import JSONDatabase
-from wordy_types import ActiveGame, UserInfo
+from sqlite_db import SQLiteDatabase, SQLiteRankings
+from storage import Storage
+from write_behind import WriteBehindFlusher
+from wordy_types import ActiveGame, Stats, UserInfo
 
 
-_db = JSONDatabase(os.getenv('DATABASE_PATH', 'database.json'))
+# When set, other processes use the same database, and each player is locked across all of them while in use
+_lock_dir = os.getenv('USER_LOCK_DIR')
+_shared_locks = user_locks.StripedFileLock(_lock_dir) if _lock_dir else None
 
 
-def get_info_for_user(id: int):
+def _open_database() -> Storage:
+    '''
+    Open the storage backend chosen by the `DATABASE_BACKEND` setting.
+    '''
+    path = os.getenv('DATABASE_PATH', 'database.json')
+    backend = os.getenv('DATABASE_BACKEND', 'json')
+
+    if _shared_locks and backend != 'sqlite':
+        raise ValueError('Sharing players between processes (USER_LOCK_DIR) needs DATABASE_BACKEND=sqlite')
+
+    if backend == 'json':
+        return JSONDatabase(path,
+            journal=os.getenv('DATABASE_JOURNAL', '') == '1',
+            compact_bytes=int(os.getenv('DATABASE_JOURNAL_COMPACT_BYTES', 16*1024*1024)))
+
+    if backend == 'sqlite':
+        return SQLiteDatabase(path)
+
+    raise ValueError(f'Database backend {backend} is not supported')
+
+
+_db: Optional[Storage] = None
+
+
+def _get_db() -> Storage:
+    '''
+    Get the database, opening it the first time it's needed rather than on import.
+    '''
+    global _db
+    if _db is None:
+        _db = _open_database()
+    return _db
+
+
+# When set, saves are batched up and done in the background rather than on every write
+_flusher: Optional[WriteBehindFlusher] = None
+
+# Recently used players are kept parsed, and only converted back to dicts when saved or evicted
+# (with a shared database another process may change a player at any time, so nothing is kept)
+_cache_size = 0 if _shared_locks else int(os.getenv('USER_CACHE_SIZE', '10000'))
+_cache: OrderedDict[str, UserInfo] = OrderedDict()
+_dirty: set[str] = set()
+_cache_stats = dict(hits=0, misses=0, evictions=0)
+
+# Language of each game in progress by player, once `track_active_games` has been called
+_active_games: Optional[dict[str, str]] = None
+
+# When each of those games was last seen changing, least recently first
+_game_activity: OrderedDict[str, float] = OrderedDict()
+
+
+def get_info_for_user(id: int) -> UserInfo:
+    '''
+    Get a player's info. The returned object is shared, so call `set_info_for_user` after changing it.
+    '''
+    key = str(id)
+    user = _cache.get(key)
+    if user is not None:
+        _cache.move_to_end(key)
+        _cache_stats['hits'] += 1
+        return user
+
+    _cache_stats['misses'] += 1
     try:
-        raw = _db[str(id)]
-        return UserInfo.parse_obj(raw)
+        raw = _get_db()[key]
+        user = decode_user(raw)
     except KeyError:
         user = UserInfo()
-        _db[str(id)] = user.dict()
-        return user
+        _get_db()[key] = encode_user(user)
+
+    _remember(key, user)
+    return user
 
 
 def set_info_for_user(id: int, info: UserInfo):
-    _db[str(id)] = info.dict()
+    key = str(id)
+    _dirty.add(key)
+    _remember(key, info)
+    _track_active_game(key, info)
+    _evict()
+
+
+@asynccontextmanager
+async def hold_shared_user(key: str) -> AsyncIterator[None]:
+    '''
+    Lock a player against other processes sharing the database, saving any changes before letting go.
+    '''
+    assert _shared_locks is not None
+    async with _shared_locks.hold(key):
+        try:
+            yield
+        finally:
+            # Writing waits on any other process that is, so happens in a worker thread
+            _sync_dirty()
+            write = _get_db().begin_save()
+            if write:
+                await asyncio.get_running_loop().run_in_executor(None, write)
+
+
+if _shared_locks:
+    user_locks.hold_across_processes(hold_shared_user)
+
+
+def is_shared() -> bool:
+    '''
+    Whether players are shared with other processes using the same database.
+    '''
+    return _shared_locks is not None
+
+
+def open_shared_table(table: str) -> SQLiteDatabase:
+    '''
+    Open another table in the database shared with other processes, for things they all add to.
+    '''
+    return SQLiteDatabase(os.getenv('DATABASE_PATH', 'database.json'), table)
+
+
+def open_shared_rankings() -> SQLiteRankings:
+    '''
+    Open the leaderboard rankings kept in the database shared with other processes.
+    '''
+    return SQLiteRankings(os.getenv('DATABASE_PATH', 'database.json'))
+
+
+def get_cache_stats() -> dict[str, int]:
+    '''
+    Get the player cache's hit, miss and eviction counts, along with its current size.
+    '''
+    return dict(_cache_stats, size=len(_cache), dirty=len(_dirty))
+
+
+def track_active_games():
+    '''
+    Find every game in progress, then keep track of them as players are updated.
+    This needs to scan the whole database, so is only done when asked for.
+    '''
+    global _active_games
+    _active_games = {}
+    _game_activity.clear()
+    now = time.time()
+    activity = []
+    for key, raw in _get_db().items():
+        game = raw.get('current_game')
+        if game:
+            _active_games[key] = game['lang']
+            activity.append((game.get('last_active') or now, key))
+
+    # Games from before activity was kept count as starting now
+    for last_seen, key in sorted(activity):
+        _game_activity[key] = last_seen
+
+    for key, info in list(_cache.items()):
+        _track_active_game(key, info)
+
+
+def iter_player_stats() -> Iterator[tuple[str, Optional[str], Stats]]:
+    '''
+    Go through every player's id, name and stats, including changes not yet saved.
+    Only the stats are parsed, so this is much quicker than fetching each player in full.
+    '''
+    for key, raw in _get_db().items():
+        info = _cache.get(key)
+        if info is not None:
+            yield key, info.username, info.stats
+        else:
+            yield key, raw.get('username'), Stats.parse_obj(raw.get('stats') or {})
+
+
+
+def get_active_game_counts() -> dict[str, int]:
+    '''
+    Count the games in progress in each language. Empty unless `track_active_games` was called.
+    '''
+    counts: dict[str, int] = {}
+    for lang in list((_active_games or {}).values()):
+        counts[lang] = counts.get(lang, 0) + 1
+    return counts
+
+
+def _track_active_game(key: str, info: UserInfo):
+    if _active_games is None:
+        return
+
+    if info.current_game:
+        _active_games[key] = info.current_game.lang
+        _game_activity[key] = time.time()
+        _game_activity.move_to_end(key)
+    else:
+        _active_games.pop(key, None)
+        _game_activity.pop(key, None)
+
+
+def get_idle_games(cutoff: float, limit: int) -> list[str]:
+    '''
+    Find up to `limit` players whose games haven't changed since before `cutoff`.
+    Empty unless `track_active_games` was called.
+    '''
+    keys = []
+    for key, last_seen in _game_activity.items():
+        if last_seen >= cutoff or len(keys) >= limit:
+            break
+        keys.append(key)
+    return keys
+
+
+def retire_idle_game(key: str, cutoff: float) -> bool:
+    '''
+    End a player's game if nobody has guessed since before `cutoff`, counting it as abandoned, and
+    drop the player from the cache. The caller must hold the player's lock.
+    '''
+    info = get_info_for_user(int(key))
+    game = info.current_game
+    if game is not None and game.last_active >= cutoff:
+        # Still in use, so check again once it has been idle for long enough
+        _place_activity(key, game.last_active)
+        return False
+
+    if game is not None:
+        info.stats.abandoned += 1
+        info.current_game = None
+        set_info_for_user(int(key), info)
+    else:
+        _track_active_game(key, info)
+
+    # Nobody is playing, so there's no point keeping the player parsed
+    if _cache.pop(key, None) is not None and key in _dirty:
+        _dirty.discard(key)
+        _get_db()[key] = encode_user(info)
+
+    return game is not None
+
+
+def _place_activity(key: str, last_seen: float):
+    '''
+    Record when a game was last seen changing, keeping `_game_activity` in time order for `get_idle_games`.
+    Games seen since are moved back after it, which is only ever the most recent few.
+
+    >>> _game_activity.update(a=1.0, b=3.0, c=4.0)
+    >>> _place_activity('a', 3.5); list(_game_activity.items())
+    [('b', 3.0), ('a', 3.5), ('c', 4.0)]
+    >>> _game_activity.clear()
+    '''
+    _game_activity.pop(key, None)
+    later = []
+    for other in reversed(_game_activity):
+        if _game_activity[other] <= last_seen:
+            break
+        later.append(other)
+
+    _game_activity[key] = last_seen
+    for other in reversed(later):
+        _game_activity.move_to_end(other)
+
+
+def _remember(key: str, info: UserInfo):
+    _cache[key] = info
+    _cache.move_to_end(key)
+    _evict()
+
+
+def _evict():
+    while len(_cache) > _cache_size:
+        key, info = _cache.popitem(last=False)
+        _cache_stats['evictions'] += 1
+        if key in _dirty:
+            _dirty.discard(key)
+            _get_db()[key] = encode_user(info)
+
+
+def _sync_dirty():
+    '''
+    Copy changed players from the cache into the database, ready to be saved.
+    '''
+    for key in _dirty:
+        _get_db()[key] = encode_user(_cache[key])
+    _dirty.clear()
 
 
 def fetch_stored_game(id: int) -> Optional[ActiveGame]:
@@ -39,5 +315,64 @@ def clear_game(id: int):
     set_info_for_user(id, user)
 
 
+metrics.Collected('wordy_user_cache_requests_total', 'Player lookups, by whether they were already cached', 'counter',
+    lambda: {(('result', 'hit'),): _cache_stats['hits'], (('result', 'miss'),): _cache_stats['misses']})
+metrics.Collected('wordy_user_cache_evictions_total', 'Players dropped from the cache to make room', 'counter',
+    lambda: {(): _cache_stats['evictions']})
+metrics.Collected('wordy_user_cache_size', 'Players currently cached', 'gauge',
+    lambda: {(): len(_cache)})
+metrics.Collected('wordy_active_games', 'Games currently in progress', 'gauge',
+    lambda: {(('lang', lang),): count for lang, count in get_active_game_counts().items()})
+
+
 def write_to_disk():
-    _db.save()
+    '''
+    Save changed players, or in write-behind mode, let the flusher know there's more to save.
+    Players shared with other processes are saved off the event loop as their lock is let go instead.
+    '''
+    if _shared_locks:
+        return
+
+    if _flusher:
+        _flusher.notify(len(_dirty) + len(_get_db().dirty_keys))
+        return
+
+    _sync_dirty()
+    _get_db().save()
+
+
+def start_write_behind(interval: float, max_dirty: int):
+    '''
+    Switch to write-behind mode, where `write_to_disk` only schedules a background save.
+    Must be called from within the running event loop.
+    '''
+    global _flusher
+    if _flusher:
+        return
+
+    if _shared_locks:
+        print("Write-behind is not available while sharing the database with other processes")
+        return
+
+    _flusher = WriteBehindFlusher(_get_db(), interval, max_dirty, before_save=_sync_dirty)
+    _flusher.start()
+
+
+async def stop_write_behind():
+    '''
+    Leave write-behind mode, saving anything still outstanding.
+    '''
+    global _flusher
+    if not _flusher:
+        return
+
+    flusher, _flusher = _flusher, None
+    await flusher.stop()
+
+
+def flush_to_disk():
+    '''
+    Save all outstanding changes immediately, regardless of mode. Used at shutdown.
+    '''
+    _sync_dirty()
+    _get_db().save()
@@ -0,0 +1,59 @@
+'''
+Server-wide game statistics for each language, updated as games finish and kept in their own small file
+(or, for processes sharing players, in a table of the database they share).
+'''
+import datetime
+from typing import Any, Optional
+
+from count_store import CountStore
+from wordy_types import MAX_GUESSES, EndResult
+
+
+_store = CountStore('global_stats', 'GLOBAL_STATS_PATH', 'global_stats.json')
+
+# Saving, in the background once started
+save = _store.save
+start_saving = _store.start_saving
+flush = _store.flush
+
+
+def empty_totals() -> dict[str, Any]:
+    '''
+    Totals for a language where no games have finished yet.
+    '''
+    return dict(
+        since=datetime.date.today().isoformat(),
+        wins=0,
+        losses=0,
+        surrenders=0,
+        distribution=[0]*MAX_GUESSES,
+    )
+
+
+def get_totals() -> dict[str, dict[str, Any]]:
+    '''
+    Get the totals for every language that has had a game finish, by language.
+    '''
+    return dict(_store.items())
+
+
+async def record_game(lang: str, result: EndResult, guesses: int):
+    '''
+    Count a finished game, along with how many guesses it took if it was won.
+    '''
+    def count(old_totals: Optional[dict[str, Any]]) -> dict[str, Any]:
+        old_totals = old_totals or empty_totals()
+
+        # Records are replaced rather than changed, so that saving can safely use a shallow copy
+        totals = dict(old_totals, distribution=list(old_totals['distribution']))
+        if result == EndResult.WIN:
+            totals['wins'] += 1
+            totals['distribution'][guesses - 1] += 1
+        elif result == EndResult.LOSE:
+            totals['losses'] += 1
+        elif result == EndResult.SURRENDER:
+            totals['surrenders'] += 1
+        return totals
+
+    await _store.modify(lang, count)
+
@@ -0,0 +1,169 @@
+'''
+Hint suggestions, ranking guesses by how much they are expected to narrow down the answer.
+
+The scoring runs in a process pool so it never blocks the bot, and results are cached
+by board, so asking again (or another player reaching the same board) is free.
+'''
+
+import os
+import asyncio
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Sequence
+
+import numpy as np
+
+from dictionary import get_solution_words_for
+from game_codec import solution_checksum
+from pattern_table import get_pattern_table
+from wordle_batch import encode_words, evaluate_guess_batch
+from wordle_logic import encode_result
+from wordy_types import ActiveGame
+
+
+CACHE_SIZE = 1024
+CHUNK_SIZE = 1024
+MAX_FALLBACK_GUESSES = 500
+
+_pool: Optional[ProcessPoolExecutor] = None
+_cache: OrderedDict[tuple, tuple[list[tuple[str, float]], int]] = OrderedDict()
+
+
+async def suggest_guesses(game: ActiveGame, count: int = 3) -> tuple[list[tuple[str, float]], int]:
+    '''
+    Get the best next guesses for a game, with their expected information in bits,
+    along with how many possible answers remain.
+    '''
+    codes = tuple(encode_result(result) for result in game.results)
+    # Keyed on the solution list too, so hints from before a reload aren't reused after it
+    key = (game.lang, solution_checksum(game.lang), tuple(game.board_state), codes, count)
+
+    cached = _cache.get(key)
+    if cached is not None:
+        _cache.move_to_end(key)
+        return cached
+
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    try:
+        suggestion = await loop.run_in_executor(pool, rank_guesses, game.lang, game.board_state, codes, count)
+    except BrokenProcessPool:
+        # A worker died (killed for memory, say), which breaks the whole pool, so start over with a new one
+        _discard_pool(pool)
+        suggestion = await loop.run_in_executor(_get_pool(), rank_guesses, game.lang, game.board_state, codes, count)
+
+    _cache[key] = suggestion
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+
+    return suggestion
+
+
+def shutdown_hint_pool():
+    global _pool
+    if _pool:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    '''
+    Stop using a broken pool, unless another hint has already replaced it.
+    '''
+    global _pool
+    if _pool is pool:
+        print("Hint pool broke, starting a new one")
+        _pool = None
+    pool.shutdown(wait=False)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Workers are started fresh rather than forked, as a fork would copy the file watcher's state without its
+        # thread (so never seeing a reload) and could copy a lock another thread was holding. A fresh worker
+        # imports the bot's main module again, so that must not open the database or start anything on import
+        workers = os.getenv('HINT_WORKERS')
+        _pool = ProcessPoolExecutor(max_workers=int(workers) if workers else None,
+            mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def rank_guesses(lang: str, board_state: Sequence[str], result_codes: Sequence[int], count: int) -> tuple[list[tuple[str, float]], int]:
+    '''
+    Rank guesses by expected information gain over the answers still possible.
+
+    Uses the language's pattern table if built, otherwise scores a sample of the remaining
+    candidates directly.
+    '''
+    solutions = get_solution_words_for(lang)
+    table = get_pattern_table(lang)
+    candidates = filter_candidates(lang, board_state, result_codes)
+
+    # With only a couple of options left, just guessing one of them is the best plan
+    if len(candidates) <= 2:
+        return [(solutions[i], float(len(candidates) - 1)) for i in candidates[:count]], len(candidates)
+
+    if table:
+        guesses = table.guesses
+        scores = np.concatenate([
+            _entropies(table.patterns[start:start+CHUNK_SIZE][:, candidates])
+            for start in range(0, len(guesses), CHUNK_SIZE)
+        ])
+    else:
+        encoded = encode_words(solutions)[candidates]
+        step = max(1, len(candidates) // MAX_FALLBACK_GUESSES)
+        guesses = [solutions[i] for i in candidates[::step]]
+        scores = _entropies(np.stack([evaluate_guess_batch(guess, encoded) for guess in guesses]))
+
+    # Prefer words that could be the answer when the information is otherwise equal
+    candidate_words = {solutions[i] for i in candidates}
+    bonus = np.fromiter((word in candidate_words for word in guesses), dtype=bool, count=len(guesses)) * 1e-6
+
+    ranked: list[tuple[str, float]] = []
+    for i in np.argsort(-(scores + bonus), kind='stable'):
+        if guesses[i] not in board_state:
+            ranked.append((guesses[i], float(scores[i])))
+            if len(ranked) == count:
+                break
+
+    return ranked, len(candidates)
+
+
+def filter_candidates(lang: str, board_state: Sequence[str], result_codes: Sequence[int]) -> list[int]:
+    '''
+    Get the indexes of the solution words that are consistent with the results so far.
+    '''
+    solutions = get_solution_words_for(lang)
+    table = get_pattern_table(lang)
+    encoded = None
+    mask = np.ones(len(solutions), dtype=bool)
+
+    for guess, code in zip(board_state, result_codes):
+        if table and guess in table.guess_index:
+            mask &= table.row(guess) == code
+        else:
+            encoded = encode_words(solutions) if encoded is None else encoded
+            mask &= evaluate_guess_batch(guess, encoded) == code
+
+    return np.flatnonzero(mask).tolist()
+
+
+def _entropies(patterns: np.ndarray) -> np.ndarray:
+    '''
+    Get the entropy in bits of the result distribution for each row of guess results.
+
+    >>> _entropies(np.array([[0, 0, 0, 0], [0, 1, 2, 3], [0, 0, 1, 1]], dtype=np.uint8)).tolist()
+    [0.0, 2.0, 1.0]
+    '''
+    rows, columns = patterns.shape
+    buckets = int(patterns.max()) + 1 if patterns.size else 1
+    offsets = np.arange(rows, dtype=np.int64)[:, None] * buckets
+    counts = np.bincount((patterns + offsets).ravel(), minlength=rows*buckets).reshape(rows, buckets)
+
+    probabilities = counts / columns
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return -np.nansum(probabilities * np.log2(probabilities), axis=1) + 0.0
+
@@ -0,0 +1,89 @@
+'''
+Ends games that players have wandered away from, so they stop taking up memory and save time.
+'''
+
+import time
+import asyncio
+import traceback
+from typing import Optional
+
+import metrics
+from game_store import get_idle_games, retire_idle_game, write_to_disk
+from user_locks import hold_user
+
+
+class IdleGameSweeper:
+    '''
+    Every `interval` seconds, ends any game without a guess for `max_idle` seconds and counts it as abandoned.
+
+    Games are found through the index kept by `game_store.track_active_games`, which must have
+    been called first. They are ended `batch_size` at a time, letting other work run in between.
+    '''
+    def __init__(self, max_idle: float, interval: float, batch_size: int = 200):
+        self.max_idle = max_idle
+        self.interval = interval
+        self.batch_size = batch_size
+        self.swept = 0
+        self._task: Optional[asyncio.Task] = None
+
+
+    def start(self):
+        '''
+        Start sweeping in the background. Must be called from within the running event loop.
+        '''
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+    async def sweep(self) -> int:
+        '''
+        End every game that has been idle for too long, returning how many there were.
+        '''
+        start = time.perf_counter()
+        cutoff = time.time() - self.max_idle
+        swept = 0
+
+        while True:
+            keys = get_idle_games(cutoff, self.batch_size)
+            if not keys:
+                break
+
+            for key in keys:
+                # Take the lock like a command would, in case the player is just coming back
+                async with hold_user(int(key)):
+                    if retire_idle_game(key, cutoff):
+                        swept += 1
+
+            await asyncio.sleep(0)
+
+        if swept:
+            write_to_disk()
+
+        self.swept += swept
+        if metrics.enabled:
+            metrics.GAMES_SWEPT.inc(swept)
+            metrics.SWEEP_SECONDS.observe(time.perf_counter() - start)
+        if swept:
+            print(f"Ended {swept} idle games in {time.perf_counter() - start:.2f}s")
+
+        return swept
+
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception:
+                print("Failed to sweep idle games:")
+                traceback.print_exc()
@@ -1,6 +1,12 @@
+import os
 import json
+import time
+import shutil
+import threading
 from pathlib import Path
-from typing import TypeVar, Any, cast
+from typing import BinaryIO, Callable, Iterator, Optional, TypeVar, Any, cast
+
+import metrics
 
 
 TFallback = TypeVar('TFallback')
@@ -11,11 +17,26 @@ NO_FALLBACK = object()
 class JSONDatabase:
     """
     A very simple JSON file-based database.
+
+    In journal mode every change is also appended to a log file next to the database,
+    so saving only needs to flush the log. Once the log grows past `compact_bytes` it is
+    folded back into a fresh copy of the main file. Saves made with `begin_save`, meant for
+    running off the event loop, also wait for the log to reach the disk.
     """
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, journal: bool = False, compact_bytes: int = 16*1024*1024):
         self.filename: str = filename
+        self.journal: bool = journal
+        self.compact_bytes: int = compact_bytes
+        self.log_filename: str = filename + '.log'
+        self.old_log_filename: str = filename + '.log.old'
         self.data: dict[str, dict[str, Any]] = self._load()
         self.dirty: bool = False
+        self.dirty_keys: set[str] = set()
+        self._write_lock = threading.Lock()
+        self._save_generation = 0
+        self._written_generation = 0
+        self._compacting = False
+        self._log: Optional[BinaryIO] = open(self.log_filename, 'ab') if journal else None
 
 
     def _load(self) -> dict[str, dict[str, Any]]:
@@ -25,39 +46,185 @@ class JSONDatabase:
         with open(self.filename, 'rt', encoding='utf-8') as f:
             data = json.load(f)
 
+        if self.journal:
+            # A leftover old log means we stopped mid-compaction, and it must be replayed first
+            for log_filename in (self.old_log_filename, self.log_filename):
+                if os.path.exists(log_filename):
+                    self._replay_log(data, log_filename)
+
         return data
 
 
+    def _replay_log(self, data: dict[str, dict[str, Any]], log_filename: str):
+        """
+        Apply a log file on top of the loaded data, cutting off any partly written final record.
+        """
+        contents = Path(log_filename).read_bytes()
+        good_length = _replay_journal(data, contents)
+        if good_length != len(contents):
+            print(f"Discarding incomplete record at the end of {log_filename}")
+            with open(log_filename, 'r+b') as f:
+                f.truncate(good_length)
+
+
     def save(self):
         """
-        Save the database to the file.
+        Save the database to the file. This runs on the caller's thread, so in journal mode the
+        log is only handed to the OS, without waiting for it to reach the disk.
         """
+        write = self._begin_save(sync=False)
+        if write:
+            write()
+
+
+    def begin_save(self) -> Optional[Callable[[], None]]:
+        """
+        Snapshot the database for saving, returning a function that does the actual writing.
+
+        The snapshot is cheap to take, and the returned function is safe to run in another
+        thread while the database continues to be modified. Returns None if nothing changed.
+        """
+        return self._begin_save(sync=True)
+
+
+    def _begin_save(self, sync: bool) -> Optional[Callable[[], None]]:
         if self.data is None:
             raise Exception("No data to save.")
 
+        if self.journal:
+            if not self.dirty and not os.path.exists(self.old_log_filename):
+                return None
+            return self._begin_journal_save(sync)
+
         if not self.dirty:
-            return
+            return None
 
-        # Convert to JSON first before we touch the file (safer if there are errors)
-        data = json.dumps(self.data, indent=4, separators=(',', ': '), sort_keys=True)
+        # Records are always replaced rather than modified in place, so a shallow copy is enough
+        snapshot = dict(self.data)
+        self._save_generation += 1
+        generation = self._save_generation
+        self.dirty = False
+        self.dirty_keys.clear()
+
+        return lambda: self._write(snapshot, generation)
 
-        # Write the data
-        Path(self.filename).write_text(data, encoding='utf-8')
 
+    def _begin_journal_save(self, sync: bool) -> Optional[Callable[[], None]]:
+        """
+        Flush the log, and if it has grown too large start folding it into the main file. With
+        `sync`, the returned function first waits for the log to reach the disk.
+        """
+        log = cast(BinaryIO, self._log)
+        log.flush()
         self.dirty = False
+        self.dirty_keys.clear()
+
+        # The log may be swapped for a new one before the returned function runs, so keep it open until then
+        log_fd = os.dup(log.fileno()) if sync else None
+
+        def sync_log():
+            if log_fd is not None:
+                try:
+                    os.fsync(log_fd)
+                finally:
+                    os.close(log_fd)
+
+        # An old log left behind by a failed or interrupted compaction still needs folding in, whatever the size
+        unmerged = os.path.exists(self.old_log_filename)
+        if self._compacting or (log.tell() < self.compact_bytes and not unmerged):
+            return sync_log if sync else None
 
+        # Move the current log aside and start a new one, so changes made during the compaction are kept
+        log.close()
+        if unmerged:
+            # Add to the old log rather than replace it, as its changes aren't in the main file yet
+            with open(self.old_log_filename, 'ab') as old_log, open(self.log_filename, 'rb') as new_log:
+                shutil.copyfileobj(new_log, old_log)
+                old_log.flush()
+                if sync:
+                    os.fsync(old_log.fileno())
+            os.remove(self.log_filename)
+        else:
+            os.replace(self.log_filename, self.old_log_filename)
+        self._log = open(self.log_filename, 'ab')
 
-    def mark_dirty(self):
+        snapshot = dict(self.data)
+        self._save_generation += 1
+        generation = self._save_generation
+        self._compacting = True
+
+        def compact():
+            try:
+                sync_log()
+                # The old log is all that has these changes until the new file is on disk
+                self._write(snapshot, generation, sync=True)
+                os.remove(self.old_log_filename)
+            finally:
+                self._compacting = False
+
+        return compact
+
+
+    def _append_log(self, record: dict[str, Any]):
+        """
+        Append a single change to the log.
+        """
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        written = cast(BinaryIO, self._log).write(line.encode('utf-8'))
+        if metrics.enabled:
+            metrics.DATABASE_WRITTEN_BYTES.inc(written, file='journal')
+
+
+    def _write(self, snapshot: dict[str, dict[str, Any]], generation: int, sync: bool = False):
+        """
+        Write a snapshot to the file, unless a newer snapshot has already been written.
+        With `sync`, wait for it to be on disk before returning.
+        """
+        with self._write_lock:
+            if generation <= self._written_generation:
+                return
+
+            start = time.perf_counter()
+
+            # Convert to JSON first before we touch the file (safer if there are errors)
+            data = json.dumps(snapshot, indent=4, separators=(',', ': '), sort_keys=True).encode('utf-8')
+
+            # Write to a temporary file and swap it in, so a crash never leaves a partial file
+            temp_filename = self.filename + '.tmp'
+            with open(temp_filename, 'wb') as f:
+                written = f.write(data)
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(temp_filename, self.filename)
+
+            self._written_generation = generation
+
+            if metrics.enabled:
+                metrics.DATABASE_SAVE_SECONDS.observe(time.perf_counter() - start)
+                metrics.DATABASE_WRITTEN_BYTES.inc(written, file='snapshot')
+
+
+    def mark_dirty(self, id: Optional[str] = None):
         """
         Mark the database as dirty, so it will be saved in future.
         """
         self.dirty = True
+        if id is not None:
+            self.dirty_keys.add(str(id))
 
 
     def __getitem__(self, id: str) -> dict[str, Any]:
         return self.data[str(id)]
 
 
+    def items(self) -> Iterator[tuple[str, dict[str, Any]]]:
+        """
+        Iterate over a snapshot of every item.
+        """
+        return iter(list(self.data.items()))
+
+
     def get(self, id: str, fallback:TFallback=NO_FALLBACK) -> dict[str, Any]|TFallback:
         """
         Get the value of an item, or return a fallback value if it doesn't exist.
@@ -72,7 +239,9 @@ class JSONDatabase:
 
     def __setitem__(self, id: str, value: dict[str, Any]) -> dict[str, Any]:
         self.data[str(id)] = value
-        self.mark_dirty()
+        if self.journal:
+            self._append_log(dict(k=str(id), v=value))
+        self.mark_dirty(id)
         return value
 
 
@@ -83,10 +252,49 @@ class JSONDatabase:
         old_values = self.data[str(id)]
         new_values = {**old_values, **update_values}
         self.data[str(id)] = new_values
-        self.mark_dirty()
+        if self.journal:
+            self._append_log(dict(k=str(id), u=update_values))
+        self.mark_dirty(id)
         return update_values
 
 
+    def modify(self, id: str, change: Callable[[Optional[dict[str, Any]]], dict[str, Any]]) -> dict[str, Any]:
+        """
+        Replace an item with what `change` makes of its current value (None if it doesn't exist).
+        """
+        self[id] = value = change(self.data.get(str(id)))
+        return value
+
+
+def _replay_journal(data: dict[str, dict[str, Any]], contents: bytes) -> int:
+    """
+    Apply journal records to the data, returning the length of the valid part of the journal.
+
+    Only the final record may be incomplete, as that is what a crash mid-append leaves behind.
+
+    >>> data = {'1': {'a': 1}}
+    >>> _replay_journal(data, b'{"k":"1","u":{"b":2}}\\n{"k":"2","v":{"c":3}}\\n{"k":"3","v":{')
+    44
+    >>> data
+    {'1': {'a': 1, 'b': 2}, '2': {'c': 3}}
+    """
+    offset = 0
+    while offset < len(contents):
+        end = contents.find(b'\n', offset)
+        if end == -1:
+            break
+
+        record = json.loads(contents[offset:end])
+        if 'v' in record:
+            data[record['k']] = record['v']
+        else:
+            data[record['k']] = {**data[record['k']], **record['u']}
+
+        offset = end + 1
+
+    return offset
+
+
 if __name__ == '__main__':
     from typing import Any
 
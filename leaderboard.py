@@ -0,0 +1,289 @@
+'''
+Player rankings for the leaderboard, kept up to date as games finish rather than worked out per request.
+
+Processes sharing players keep the rankings in their shared database instead, so that every process
+sees the games finished by the others.
+'''
+import os
+import asyncio
+from bisect import bisect_left, insort
+from typing import Iterable, Optional
+
+import game_store
+from sqlite_db import SQLiteRankings
+from wordy_types import Stats
+
+
+# Number of places shown on a leaderboard
+LEADERBOARD_SIZE = int(os.getenv('LEADERBOARD_SIZE', '10'))
+
+
+class RankingIndex:
+    '''
+    Every ranked player, sorted best first, so the top places can be read off the front.
+
+    Entries are `(sort key, player id)` tuples where smaller sorts first. `version` only
+    changes when something in the top `size` places changes, so it can be used to cache
+    anything rendered from them.
+
+    >>> index = RankingIndex(size=2)
+    >>> index.update('a', (-3,)); index.update('b', (-5,)); index.update('c', (-1,))
+    >>> index.top()
+    [((-5,), 'b'), ((-3,), 'a')]
+    >>> version = index.version
+    >>> index.update('c', (-2,))
+    >>> index.version == version
+    True
+    >>> index.update('c', (-4,))
+    >>> index.top()
+    [((-5,), 'b'), ((-4,), 'c')]
+    >>> index.version == version
+    False
+    '''
+    def __init__(self, size: int = LEADERBOARD_SIZE):
+        self.size = size
+        self.version = 0
+        self._entries: list[tuple[tuple, str]] = []
+        self._keys: dict[str, tuple] = {}
+
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+    def update(self, id: str, key: Optional[tuple]):
+        '''
+        Move a player to the place given by their new sort key, or remove them if it is None.
+        '''
+        old_key = self._keys.get(id)
+        if old_key == key:
+            return
+
+        changed = False
+        if old_key is not None:
+            rank = bisect_left(self._entries, (old_key, id))
+            del self._entries[rank]
+            del self._keys[id]
+            changed = rank < self.size
+
+        if key is not None:
+            entry = (key, id)
+            insort(self._entries, entry)
+            self._keys[id] = key
+            changed = changed or self.rank_of(id) < self.size
+
+        if changed:
+            self.version += 1
+
+
+    def rank_of(self, id: str) -> int:
+        '''
+        Get a player's place, counting from zero, or the number of ranked players if they aren't ranked.
+        '''
+        key = self._keys.get(id)
+        if key is None:
+            return len(self._entries)
+        return bisect_left(self._entries, (key, id))
+
+
+    def top(self, count: Optional[int] = None) -> list[tuple[tuple, str]]:
+        '''
+        Get the best `count` entries (by default the leaderboard size).
+        '''
+        return self._entries[:self.size if count is None else count]
+
+
+    def load(self, keys: dict[str, Optional[tuple]]):
+        '''
+        Replace every entry at once, which is much quicker than adding players one by one.
+        '''
+        self._keys = {id: key for id, key in keys.items() if key is not None}
+        self._entries = sorted((key, id) for id, key in self._keys.items())
+        self.version += 1
+
+
+class SharedRanking:
+    '''
+    One ranking from rankings shared with other processes, read just like a `RankingIndex`.
+
+    Other processes can change it at any time, so the top places are read again every time,
+    and `version` is worked out from them.
+    '''
+    def __init__(self, board: str, size: int = LEADERBOARD_SIZE):
+        self.board = board
+        self.size = size
+
+
+    @property
+    def version(self) -> int:
+        return hash(tuple(self._read(self.size)))
+
+
+    def top(self, count: Optional[int] = None) -> list[tuple[tuple, str]]:
+        return [(key, id) for key, id, _ in self._read(self.size if count is None else count)]
+
+
+    def _read(self, count: int) -> list[tuple[tuple, str, Optional[str]]]:
+        assert _shared is not None
+        rows = _shared.top(self.board, count)
+        for _, id, name in rows:
+            if name is not None:
+                _names[id] = name
+        return rows
+
+
+# Rankings across all languages, and within each one
+_overall = RankingIndex()
+_by_lang: dict[str, RankingIndex] = {}
+
+# Names shown on the leaderboard, for every ranked player
+_names: dict[str, str] = {}
+
+# When set, rankings are kept here, shared with other processes, instead
+_shared: Optional[SQLiteRankings] = None
+
+
+def share_rankings(rankings: SQLiteRankings):
+    '''
+    Keep the rankings in a database shared with other processes from now on.
+    '''
+    global _shared
+    _shared = rankings
+
+
+def init_shared():
+    '''
+    Share the rankings with the other processes sharing players, if there are any.
+    Each keeps them up to date as its games finish.
+    '''
+    if game_store.is_shared():
+        share_rankings(game_store.open_shared_rankings())
+
+
+def overall_key(stats: Stats) -> Optional[tuple]:
+    '''
+    Rank players by wins, then by win rate. Players who haven't finished a game aren't ranked.
+
+    >>> overall_key(Stats(wins=3, losses=1))
+    (-3, -0.75)
+    >>> overall_key(Stats()) is None
+    True
+    '''
+    played = stats.wins + stats.losses + stats.surrenders
+    if not played:
+        return None
+    return (-stats.wins, -(stats.wins / played))
+
+
+def language_key(stats: Stats, lang: str) -> Optional[tuple]:
+    '''
+    Rank players within a language by wins in it, then by win rate in it.
+    Players who haven't finished a game in the language aren't ranked.
+
+    Wins by language are only counted since guess distributions were added, while games by language go
+    back further. So that older players' win rates aren't understated, wins from before then are shared
+    out between their languages by the number of games played in each. That's exact for players of a
+    single language, and an estimate for the rest.
+
+    >>> language_key(Stats(wins=3, losses=1, games={'en': 4}, distribution={'en': [0, 1, 2, 0, 0, 0]}), 'en')
+    (-3, -0.75)
+    >>> language_key(Stats(wins=6, losses=2, games={'en': 4, 'de': 4}, distribution={'en': [0, 2, 0, 0, 0, 0]}), 'en')
+    (-4, -1.0)
+    >>> language_key(Stats(wins=6, losses=2, games={'en': 4, 'de': 4}, distribution={'en': [0, 2, 0, 0, 0, 0]}), 'de')
+    (-2, -0.5)
+    >>> language_key(Stats(wins=5, games={'en': 5}), 'de') is None
+    True
+    '''
+    games = stats.games.get(lang, 0)
+    if not games:
+        return None
+
+    wins = sum(stats.distribution.get(lang, ()))
+    uncounted = stats.wins - sum(sum(counts) for counts in stats.distribution.values())
+    if uncounted > 0:
+        wins = min(games, wins + round(uncounted * games / sum(stats.games.values())))
+    return (-wins, -(wins / games))
+
+
+def get_index(lang: Optional[str] = None) -> RankingIndex | SharedRanking:
+    '''
+    Get the ranking for a language, or the overall ranking if no language is given.
+    '''
+    if _shared is not None:
+        return SharedRanking(lang or '')
+    return _local_index(lang)
+
+
+def _local_index(lang: Optional[str] = None) -> RankingIndex:
+    '''
+    Get a ranking kept in this process, for when the rankings aren't shared.
+    '''
+    if lang is None:
+        return _overall
+    index = _by_lang.get(lang)
+    if index is None:
+        index = _by_lang[lang] = RankingIndex()
+    return index
+
+
+def get_name(id: str) -> str:
+    return _names.get(id) or 'Unknown player'
+
+
+async def record_stats(id: int|str, username: Optional[str], stats: Stats):
+    '''
+    Update a player's place in every ranking after their stats have changed.
+    '''
+    key = str(id)
+    if _shared is not None:
+        # Other processes may be holding the database's write lock, so wait for it off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, _shared.update, key, username, _shared_keys(stats))
+        return
+
+    renamed = username is not None and _names.get(key) != username
+    if username is not None:
+        _names[key] = username
+
+    _update(_overall, key, overall_key(stats), renamed)
+    for lang in stats.games:
+        _update(_local_index(lang), key, language_key(stats, lang), renamed)
+
+
+def _update(index: RankingIndex, key: str, sort_key: Optional[tuple], renamed: bool):
+    index.update(key, sort_key)
+    if renamed and index.rank_of(key) < index.size:
+        index.version += 1
+
+
+def _shared_keys(stats: Stats) -> dict[str, Optional[tuple]]:
+    '''
+    Get a player's sort key on every board they're ranked on, as kept in shared rankings.
+    '''
+    keys = {'': overall_key(stats)}
+    for lang in stats.games:
+        keys[lang] = language_key(stats, lang)
+    return keys
+
+
+def rebuild(players: Iterable[tuple[str, Optional[str], Stats]]):
+    '''
+    Rank every player from scratch, given their id, name and stats.
+    '''
+    if _shared is not None:
+        _shared.load((key, username, _shared_keys(stats)) for key, username, stats in players)
+        return
+
+    overall: dict[str, Optional[tuple]] = {}
+    by_lang: dict[str, dict[str, Optional[tuple]]] = {lang: {} for lang in _by_lang}
+    _names.clear()
+
+    for key, username, stats in players:
+        if username is not None:
+            _names[key] = username
+        overall[key] = overall_key(stats)
+        for lang in stats.games:
+            by_lang.setdefault(lang, {})[key] = language_key(stats, lang)
+
+    _overall.load(overall)
+    for lang, keys in by_lang.items():
+        _local_index(lang).load(keys)
@@ -0,0 +1,212 @@
+'''
+An offline load generator, playing many simulated players against the command handlers directly.
+
+No Discord connection is needed. Each player plays in one language, thinks between commands, plays
+games of realistic length, and now and then checks their board or stats or gives up. Run with e.g.
+`python loadtest.py --players 1000 --duration 60 --langs en,de` for 1000 players in each language,
+and it reports throughput and latency per command, split into time spent blocking the event loop
+and time spent awaiting.
+
+Players start from an empty database in a temporary folder, with totals and daily results of its
+own, and settings such as `DATABASE_BACKEND` or `WRITE_BEHIND_INTERVAL` are taken from the
+environment as usual.
+'''
+
+import os
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+from time import perf_counter
+from typing import Any, Coroutine, Generator
+
+from stub_user import StubUser
+from wordy_types import MAX_GUESSES
+
+
+# How many guesses players take to solve a word, roughly as seen in real games (more than MAX_GUESSES means they lost)
+GAME_LENGTH_WEIGHTS = {1: 1, 2: 6, 3: 23, 4: 33, 5: 24, 6: 10, MAX_GUESSES + 1: 3}
+
+
+class StepTimer:
+    '''
+    Runs a coroutine, measuring how long it spends running on the event loop between awaits.
+
+    >>> async def work():
+    ...     sum(range(1000))
+    ...     await asyncio.sleep(0.01)
+    ...     return 'done'
+    >>> timer = StepTimer(work())
+    >>> asyncio.run(timer.run())
+    'done'
+    >>> timer.busy < 0.01
+    True
+    '''
+    def __init__(self, coro: Coroutine):
+        self.coro = coro
+        self.busy = 0.0
+
+    async def run(self) -> Any:
+        return await self
+
+    def __await__(self) -> Generator[Any, Any, Any]:
+        value: Any = None
+        error: BaseException|None = None
+        while True:
+            start = perf_counter()
+            try:
+                yielded = self.coro.throw(error) if error else self.coro.send(value)
+            except StopIteration as stop:
+                self.busy += perf_counter() - start
+                return stop.value
+            self.busy += perf_counter() - start
+
+            try:
+                value, error = (yield yielded), None
+            except BaseException as ex:
+                value, error = None, ex
+
+
+class LoadTest:
+    def __init__(self, main: Any, langs: list[str], think_time: float, reply_latency: float):
+        self.main = main
+        self.langs = langs
+        self.think_time = think_time
+        self.reply_latency = reply_latency
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.blocking: dict[str, list[float]] = defaultdict(list)
+        self.loop_lag: list[float] = []
+
+    async def reply(self, *args, **kwargs):
+        # Stand in for the round trip to Discord
+        await asyncio.sleep(random.expovariate(1 / self.reply_latency) if self.reply_latency else 0)
+
+    async def command(self, name: str, coro: Coroutine):
+        timer = StepTimer(coro)
+        start = perf_counter()
+        await timer
+        self.latencies[name].append(perf_counter() - start)
+        self.blocking[name].append(timer.busy)
+
+    async def think(self):
+        await asyncio.sleep(random.expovariate(1 / self.think_time) if self.think_time else 0)
+
+    async def play(self, user: StubUser, lang: str, deadline: float):
+        from dictionary import get_solution_words_for
+        from game_store import fetch_stored_game
+
+        words = get_solution_words_for(lang)
+        while time.monotonic() < deadline:
+            # Carry on with a game left unfinished by the last round
+            game = fetch_stored_game(user.id)
+            length = random.choices(list(GAME_LENGTH_WEIGHTS), weights=list(GAME_LENGTH_WEIGHTS.values()))[0]
+
+            for turn in range(len(game.board_state) + 1 if game else 1, MAX_GUESSES + 1):
+                game = fetch_stored_game(user.id)
+                guess = game.answer if game and turn == length else random.choice(words)
+                await self.command('guess', self.main.handle_new_guess(guess, lang, user, self.reply))
+                await self.think()
+
+                if not fetch_stored_game(user.id):
+                    break
+
+                if random.random() < 0.1:
+                    await self.command('show', self.main.handle_show(user, self.reply))
+                    await self.think()
+
+                if random.random() < 0.02:
+                    await self.command('surrender', self.main.handle_surrender(user, self.reply))
+                    await self.think()
+                    break
+
+            if random.random() < 0.3:
+                await self.command('stats', self.main.handle_stats(user, self.reply))
+                await self.think()
+
+    async def watch_loop_lag(self, interval: float = 0.01):
+        while True:
+            start = perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag.append(perf_counter() - start - interval)
+
+    async def run(self, players: int, duration: float):
+        deadline = time.monotonic() + duration
+        watcher = asyncio.create_task(self.watch_loop_lag())
+
+        # Spread the players' arrival over the first few seconds, like a real rush
+        async def arrive(user: StubUser, lang: str):
+            await asyncio.sleep(random.uniform(0, min(duration / 4, 5)))
+            await self.play(user, lang, deadline)
+
+        await asyncio.gather(*(arrive(StubUser(100000 + n * players + i), lang)
+            for n, lang in enumerate(self.langs) for i in range(players)))
+        watcher.cancel()
+
+    def report(self, elapsed: float):
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        print(f"{total} commands in {elapsed:.1f}s = {total / elapsed:.1f} commands/s")
+        print(f"{'command':>10} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'blocking':>9} {'awaiting':>9}")
+        for name, latencies in sorted(self.latencies.items()):
+            blocking = sum(self.blocking[name]) / len(latencies)
+            mean = sum(latencies) / len(latencies)
+            print(f"{name:>10} {len(latencies):>7} {percentile(latencies, 50)*1000:>8.2f} "
+                  f"{percentile(latencies, 95)*1000:>8.2f} {percentile(latencies, 99)*1000:>8.2f} "
+                  f"{blocking*1000:>7.2f}ms {(mean - blocking)*1000:>7.2f}ms")
+
+        if self.loop_lag:
+            print(f"Event loop lag: p50 {percentile(self.loop_lag, 50)*1000:.2f}ms, "
+                  f"p99 {percentile(self.loop_lag, 99)*1000:.2f}ms, max {max(self.loop_lag)*1000:.2f}ms")
+
+
+def percentile(values: list[float], percent: float) -> float:
+    '''
+    Get a percentile of some values, using the nearest rank.
+
+    >>> percentile([4, 1, 3, 2], 50), percentile([4, 1, 3, 2], 99)
+    (2, 4)
+    '''
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, -(-len(ordered) * percent // 100) - 1))
+    return ordered[int(rank)]
+
+
+async def _run(args: argparse.Namespace):
+    import main
+    import game_store
+
+    # Use the same saving strategy the bot would
+    write_behind_interval = os.getenv('WRITE_BEHIND_INTERVAL')
+    if write_behind_interval:
+        game_store.start_write_behind(float(write_behind_interval), int(os.getenv('WRITE_BEHIND_MAX_DIRTY', '1000')))
+
+    test = LoadTest(main, args.langs.split(','), args.think, args.reply_latency)
+    start = perf_counter()
+    await test.run(args.players, args.duration)
+    elapsed = perf_counter() - start
+
+    await game_store.stop_write_behind()
+    test.report(elapsed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulate many players at once, without Discord")
+    parser.add_argument('--players', type=int, default=500, help="Number of concurrent players in each language")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds to keep starting new games for")
+    parser.add_argument('--langs', default='en', help="Comma separated languages to play in")
+    parser.add_argument('--think', type=float, default=2.0, help="Mean seconds a player waits between commands")
+    parser.add_argument('--reply-latency', type=float, default=0.05, help="Mean seconds a reply takes to send")
+    args = parser.parse_args()
+
+    # Keep the simulated players and their games out of the real database and totals
+    suffix = '.sqlite' if os.getenv('DATABASE_BACKEND') == 'sqlite' else '.json'
+    database_folder = tempfile.mkdtemp()
+    os.environ['DATABASE_PATH'] = os.path.join(database_folder, 'database' + suffix)
+    os.environ['GLOBAL_STATS_PATH'] = os.path.join(database_folder, 'global_stats.json')
+    os.environ['DAILY_RESULTS_PATH'] = os.path.join(database_folder, 'daily_results.json')
+    if suffix == '.json':
+        with open(os.environ['DATABASE_PATH'], 'wt', encoding='utf-8') as f:
+            f.write('{}')
+
+    asyncio.run(_run(args))
@@ -1,38 +1,69 @@
 '''
 This file contains the Discord interaction, implemented using the Disnake library.
 '''
-from typing import Callable
+from typing import Any, Callable, Optional
 from dotenv import load_dotenv
 load_dotenv()
 
 import os
+import signal
+import asyncio
 import traceback
 
 import disnake
 from disnake.ext import commands
 
-from wordy_types import EndResult
-from game_store import get_info_for_user, set_info_for_user, write_to_disk
-from wordy_chat import begin_game, enter_guess, get_emotes_for_colorblind, render_result
-from dictionary import languages, get_acceptable_words_for, get_alphabet_for, get_solution_words_for
-
-
-bot = commands.Bot(command_prefix="/", description="Wordy Guessing Game", help_command=None,
-    activity=disnake.Game(name='with dictionaries'))
-
-
-def generate_game_commands(languages: dict):
+import daily
+import global_stats
+import leaderboard
+import metrics
+import profiling
+import race
+from wordy_types import MAX_GUESSES, ActiveGame, EndResult
+from user_locks import hold_user, serialized_per_user
+from game_store import get_info_for_user, set_info_for_user, write_to_disk, start_write_behind, flush_to_disk, track_active_games, iter_player_stats, is_shared
+from wordle_logic import encode_result
+from wordy_chat import begin_game, enter_guess, get_emotes_for_colorblind, render_board, render_distribution
+from dictionary import languages, get_alphabet_for, is_valid_guess, preload_all
+from file_reader import start_watching
+from hints import suggest_guesses, shutdown_hint_pool
+from idle_sweeper import IdleGameSweeper
+from reply_queue import ReplyQueue, INTERACTION, PREFIX
+
+
+# Made by `create_bot`, so importing this file (as the tests and hint workers do) starts nothing
+bot: Optional[commands.Bot|commands.AutoShardedBot] = None
+sweeper: Optional[IdleGameSweeper] = None
+replies: Optional[ReplyQueue] = None
+
+
+def prefix_reply(ctx: commands.Context) -> Callable:
+    '''Get the function for replying to a prefix command.'''
+    if replies is None:
+        return ctx.reply
+    return replies.wrap(ctx.reply, ('channel', ctx.channel.id), PREFIX, ctx.author.id)
+
+
+def slash_reply(inter, send: Optional[Callable] = None) -> Callable:
+    '''Get the function for responding to a slash command, with `send` if the first response has already been made.'''
+    send = send or inter.response.send_message
+    if replies is None:
+        return send
+    return replies.wrap(send, ('interaction', inter.id), INTERACTION)
+
+
+def generate_game_commands(bot: commands.Bot|commands.AutoShardedBot, languages: dict):
     '''For each language we support, generate a prefix command and a slash command.'''
     for lang_code, lang in languages.items():
 
         def make_commands(lang_code):
             async def handle_lang_prefix(ctx: commands.Context, guess: str):
                 nonlocal lang_code
-                await handle_new_guess(guess, lang_code, ctx.author, ctx.reply)
+                await handle_new_guess(guess, lang_code, ctx.author, prefix_reply(ctx))
 
             async def handle_lang_slash(inter, guess:str):
                 nonlocal lang_code
-                await handle_new_guess(guess, lang_code, inter.author, inter.response.send_message)
+                await handle_new_guess(guess, lang_code, inter.author, slash_reply(inter))
 
             return handle_lang_prefix, handle_lang_slash
 
@@ -41,7 +72,57 @@ def generate_game_commands(languages: dict):
         bot.slash_command(name=lang['command'], description=lang['help'])(handle_lang_slash)
 
 
-# Fixed prefix commands
+async def on_ready():
+    # Optionally report slow commands and event loop stalls
+    profiling.start(asyncio.get_running_loop())
+
+    # Optionally batch up database saves and do them off the event loop
+    write_behind_interval = os.getenv("WRITE_BEHIND_INTERVAL")
+    if write_behind_interval:
+        start_write_behind(float(write_behind_interval), int(os.getenv("WRITE_BEHIND_MAX_DIRTY", "1000")))
+
+    # Save the server-wide totals and daily results in the background rather than after every game
+    stats_save_interval = float(os.getenv("STATS_SAVE_INTERVAL", "30"))
+    global_stats.start_saving(stats_save_interval)
+    daily.start_saving(stats_save_interval)
+
+    # Optionally end games nobody has touched in a while
+    if sweeper:
+        sweeper.start()
+
+    # Let queued replies go out before closing when asked to stop
+    if replies is not None:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, shut_down)
+            except NotImplementedError:
+                pass
+
+
+_shutdown: Optional[asyncio.Task] = None
+
+def shut_down():
+    '''
+    Close the bot, giving queued replies a while to be sent first. Asking again stops straight away.
+    '''
+    global _shutdown
+    if _shutdown is not None:
+        asyncio.get_running_loop().stop()
+        return
+
+    async def drain_and_close():
+        # Only set up to be called once the bot and its reply queue are made
+        assert bot is not None and replies is not None
+        try:
+            await asyncio.wait_for(replies.drain(), float(os.getenv("REPLY_DRAIN_SECONDS", "10")))
+        except asyncio.TimeoutError:
+            print(f"Shutting down with {replies.pending()} replies still queued")
+        await replies.stop()
+        await bot.close()
+
+    _shutdown = asyncio.get_running_loop().create_task(drain_and_close())
+
 
 HELP_TEXT_PRE = """**Wordy is a Wordle-like clone that supports multiple languages.**
 
@@ -55,58 +136,151 @@ In colorblind mode 🟦 represents the right letter on the wrong position and 
 HELP_TEXT_POST = """```
 To give up (or to switch languages) use `/surrender`.
 To toggle colorblind mode on or off use `/colorblind`.
+To get some suggestions for your next guess use `/hint`.
+To play today's puzzle, the same for everyone, use `/daily <guess> [language]`.
+To see the best players use `/leaderboard`, or `/leaderboard <language>` for a single language.
+To see how everyone is doing use `/globalstats`.
+To race everyone in the channel to the same word use `/race`, then `/race <guess>`.
 
 *Wordy saves your DiscordID together with your Discord name and your game stats to provide game statistics.*
 """
 
-@bot.command(name='surrender', help="Give up and reveal the word!")
-async def surrender_prefix(ctx: commands.Context):
-    await handle_surrender(ctx.author, ctx.reply)
 
-@bot.command(name='help', help="Get your stats")
-async def help_prefix(ctx: commands.Context):
-    await handle_help(ctx.reply)
+def create_bot() -> commands.Bot|commands.AutoShardedBot:
+    '''
+    Make the bot along with everything its commands use, as set up in the environment.
+    '''
+    global bot, sweeper, replies
+
+    bot_options: dict[str, Any] = dict(command_prefix="/", description="Wordy Guessing Game", help_command=None,
+        activity=disnake.Game(name='with dictionaries'))
+
+    # When run by the supervisor, only connect the gateway shards given to this process
+    shard_ids = os.getenv("SHARD_IDS")
+    new_bot: commands.Bot|commands.AutoShardedBot
+    if shard_ids:
+        new_bot = commands.AutoShardedBot(**bot_options,
+            shard_ids=[int(shard_id) for shard_id in shard_ids.split(',')], shard_count=int(os.getenv("SHARD_COUNT", "1")))
+    else:
+        new_bot = commands.Bot(**bot_options)
+    bot = new_bot
+
+    # Optionally end games nobody has touched in a while (on_ready runs again on every reconnect, so there's only ever one)
+    idle_game_seconds = os.getenv("IDLE_GAME_SECONDS")
+    if idle_game_seconds and is_shared():
+        # Every process would have to scan all the players to find their games
+        print("Idle games aren't swept while sharing the database with other processes")
+        idle_game_seconds = None
+    sweeper = IdleGameSweeper(float(idle_game_seconds), float(os.getenv("IDLE_SWEEP_INTERVAL", "300"))) if idle_game_seconds else None
+
+    # Processes sharing players share the rankings too
+    leaderboard.init_shared()
+
+    # Optionally send replies through a queue that keeps within Discord's rate limits
+    replies = ReplyQueue(int(os.getenv("REPLY_ROUTE_LIMIT", "5")), float(os.getenv("REPLY_ROUTE_PERIOD", "5")),
+        int(os.getenv("REPLY_GLOBAL_LIMIT", "50"))) if os.getenv("REPLY_QUEUE") else None
 
-@bot.command(name='stats', help="Get your stats")
-async def stats_prefix(ctx: commands.Context):
-    await handle_stats(ctx.author, ctx.reply)
+    new_bot.add_listener(on_ready)
+    add_fixed_commands(new_bot)
+    generate_game_commands(new_bot, languages)
+    return new_bot
 
-@bot.command(name='colorblind', help="Toggle colorblind mode on or off")
-async def colorblind_prefix(ctx: commands.Context):
-    await handle_colorblind(ctx.author, ctx.reply)
 
-@bot.command(name='show', help="Show current board state")
-async def show_prefix(ctx: commands.Context):
-    await handle_show(ctx.author, ctx.reply)
+def add_fixed_commands(bot: commands.Bot|commands.AutoShardedBot):
+    '''Add the commands that don't depend on the language.'''
 
+    # Prefix commands
 
-# Fixed slash commands
+    @bot.command(name='surrender', help="Give up and reveal the word!")
+    async def surrender_prefix(ctx: commands.Context):
+        await handle_surrender(ctx.author, prefix_reply(ctx))
 
+    @bot.command(name='help', help="Get your stats")
+    async def help_prefix(ctx: commands.Context):
+        await handle_help(prefix_reply(ctx))
 
-@bot.slash_command(name='surrender', description="Give up and reveal the word!")
-async def surrender_slash(inter):
-    await handle_surrender(inter.user, inter.response.send_message)
+    @bot.command(name='stats', help="Get your stats")
+    async def stats_prefix(ctx: commands.Context):
+        await handle_stats(ctx.author, prefix_reply(ctx))
 
-@bot.slash_command(name='help', description="How to play Wordy")
-async def help_slash(inter):
-    await handle_help(inter.response.send_message)
+    @bot.command(name='colorblind', help="Toggle colorblind mode on or off")
+    async def colorblind_prefix(ctx: commands.Context):
+        await handle_colorblind(ctx.author, prefix_reply(ctx))
 
-@bot.slash_command(name='stats', description="Get your stats")
-async def stats_slash(inter):
-    await handle_stats(inter.user, inter.response.send_message)
+    @bot.command(name='show', help="Show current board state")
+    async def show_prefix(ctx: commands.Context):
+        await handle_show(ctx.author, prefix_reply(ctx))
 
-@bot.slash_command(name='colorblind', description="Toggle colorblind mode on or off")
-async def colorblind_slash(inter):
-    await handle_colorblind(inter.user, inter.response.send_message)
+    @bot.command(name='hint', help="Suggest some good next guesses")
+    async def hint_prefix(ctx: commands.Context):
+        await handle_hint(ctx.author, prefix_reply(ctx))
 
-@bot.slash_command(name='show', description="Show current board state")
-async def show_slash(inter):
-    await handle_show(inter.user, inter.response.send_message)
+    @bot.command(name='daily', help="Play today's puzzle, the same for everyone")
+    async def daily_prefix(ctx: commands.Context, guess: Optional[str] = None, lang: str = 'en'):
+        await handle_daily(guess, lang, ctx.author, prefix_reply(ctx))
+
+    @bot.command(name='globalstats', help="Show stats for all players")
+    async def globalstats_prefix(ctx: commands.Context):
+        await handle_globalstats(prefix_reply(ctx))
+
+    @bot.command(name='leaderboard', help="Show the best players")
+    async def leaderboard_prefix(ctx: commands.Context, lang: Optional[str] = None):
+        await handle_leaderboard(lang, prefix_reply(ctx))
+
+
+    # Slash commands
+
+    @bot.slash_command(name='surrender', description="Give up and reveal the word!")
+    async def surrender_slash(inter):
+        await handle_surrender(inter.user, slash_reply(inter))
+
+    @bot.slash_command(name='help', description="How to play Wordy")
+    async def help_slash(inter):
+        await handle_help(slash_reply(inter))
+
+    @bot.slash_command(name='stats', description="Get your stats")
+    async def stats_slash(inter):
+        await handle_stats(inter.user, slash_reply(inter))
+
+    @bot.slash_command(name='colorblind', description="Toggle colorblind mode on or off")
+    async def colorblind_slash(inter):
+        await handle_colorblind(inter.user, slash_reply(inter))
+
+    @bot.slash_command(name='show', description="Show current board state")
+    async def show_slash(inter):
+        await handle_show(inter.user, slash_reply(inter))
+
+    @bot.slash_command(name='hint', description="Suggest some good next guesses")
+    async def hint_slash(inter):
+        # Working out a hint can take a moment, so let Discord know we're on it
+        await inter.response.defer()
+        await handle_hint(inter.user, slash_reply(inter, inter.followup.send))
+
+    @bot.slash_command(name='daily', description="Play today's puzzle, the same for everyone")
+    async def daily_slash(inter, guess: Optional[str] = None, language: str = commands.Param('en', choices=list(languages))):
+        await handle_daily(guess, language, inter.user, slash_reply(inter))
+
+    @bot.slash_command(name='globalstats', description="Show stats for all players")
+    async def globalstats_slash(inter):
+        await handle_globalstats(slash_reply(inter))
+
+    @bot.slash_command(name='leaderboard', description="Show the best players")
+    async def leaderboard_slash(inter, language: str = commands.Param(None, choices=list(languages))):
+        await handle_leaderboard(language, slash_reply(inter))
+
+    @bot.slash_command(name='race', description="Race everyone in this channel to guess the same word")
+    async def race_slash(inter, guess: Optional[str] = None, language: str = commands.Param('en', choices=list(languages))):
+        # Guesses wait for the scoreboard to be updated, and only the player should see their board
+        await inter.response.defer(ephemeral=True)
+        await handle_race(guess, language, inter.channel, inter.user, slash_reply(inter, inter.followup.send))
 
 
 # Common functionality
 
 
+@metrics.timed(metrics.COMMAND_SECONDS, command='show')
+@profiling.profiled('show')
+@serialized_per_user
 async def handle_show(user: disnake.User|disnake.Member, reply: Callable):
     # Show the current board state
     player = get_info_for_user(user.id)
@@ -118,13 +292,46 @@ async def handle_show(user: disnake.User|disnake.Member, reply: Callable):
     # Render the results
     description = "Your board:\n"
     description += "```"
-    for result,word in zip(player.current_game.results, player.current_game.board_state):
-        description += f"{render_result(result, player.settings.colorblind)} {word}\n"
+    description += render_board(player.current_game, player.settings.colorblind)
     description += "```"
 
-    await reply(description)
+    await reply_with_board(reply, 'game', False, description)
 
 
+@metrics.timed(metrics.COMMAND_SECONDS, command='hint')
+@profiling.profiled('hint')
+@serialized_per_user
+async def handle_hint(user: disnake.User|disnake.Member, reply: Callable):
+    player = get_info_for_user(user.id)
+
+    if player.current_game is None:
+        await reply("You haven't started a game yet!")
+        return
+
+    try:
+        suggestions, remaining = await suggest_guesses(player.current_game)
+    except Exception:
+        print(f"Failed to work out a hint for {user}:")
+        traceback.print_exc()
+        await reply("Sorry, we're unable to come up with a hint right now 😿")
+        return
+
+    # The answer may have been dropped from the word list since the game started
+    if not remaining:
+        await reply("None of the words we know fit your results so far, so there's no hint to give!")
+        return
+
+    description = f"There {'is' if remaining == 1 else 'are'} {remaining} possible word{'' if remaining == 1 else 's'} left.\n"
+    description += "Try one of these:\n"
+    for word, bits in suggestions:
+        description += f"`{word}` ({bits:.2f} bits)\n"
+
+    await reply(description.strip('\n'))
+
+
+@metrics.timed(metrics.COMMAND_SECONDS, command='colorblind')
+@profiling.profiled('colorblind')
+@serialized_per_user
 async def handle_colorblind(user: disnake.User|disnake.Member, reply: Callable):
     # Toggle colorblind state for the user
     player = get_info_for_user(user.id)
@@ -142,6 +349,8 @@ Your icon colors are: absent letter {emote_absent}, wrong position {emote_presen
     await reply(description)
 
 
+@metrics.timed(metrics.COMMAND_SECONDS, command='help')
+@profiling.profiled('help')
 async def handle_help(reply: Callable):
     description = HELP_TEXT_PRE
 
@@ -154,6 +363,85 @@ async def handle_help(reply: Callable):
     await reply(description)
 
 
+async def reply_with_board(reply: Callable, board: str, final: bool, *args, **kwargs):
+    '''
+    Reply with a board. If replies are queued, a board for a game that isn't `final` is replaced by
+    the next board of the same kind if it hasn't been sent by then.
+    '''
+    send_board = getattr(reply, 'send_board', None)
+    if send_board is None:
+        await reply(*args, **kwargs)
+    else:
+        await send_board(board, final, *args, **kwargs)
+
+
+def find_language(name: str) -> Optional[str]:
+    '''
+    Find a language by its code or by its game command.
+    '''
+    name = name.lower()
+    if name in languages:
+        return name
+    return next((code for code, info in languages.items() if info['command'] == name), None)
+
+
+async def check_guess(guess: str, lang: str, reply: Callable) -> Optional[str]:
+    '''
+    Tidy up a guess and make sure it can be played, telling the player if not.
+    '''
+    guess = guess.lower()
+    guess = guess.removeprefix('guess:')
+    if len(guess) != 5:
+        await reply("Guess must be 5 letters long")
+        return None
+
+    # Make sure the word is valid
+    if not is_valid_guess(lang, guess):
+        await reply("That's not a valid word!")
+        return None
+
+    # Make sure the guess uses only letters from the language's dictionary
+    dictionary = get_alphabet_for(lang)
+    if any(char not in dictionary for char in guess):
+        await reply(f"You can only use the following letters: `{dictionary}`")
+        return None
+
+    return guess
+
+
+# Rendered leaderboards by language (None for overall), along with the ranking version they show
+_leaderboard_embeds: dict[Optional[str], tuple[int, disnake.Embed]] = {}
+
+@metrics.timed(metrics.COMMAND_SECONDS, command='leaderboard')
+@profiling.profiled('leaderboard')
+async def handle_leaderboard(lang: Optional[str], reply: Callable):
+    if lang is not None:
+        lang = find_language(lang)
+        if lang is None:
+            await reply(f"Unknown language! Choose from: `{'`, `'.join(languages)}`")
+            return
+
+    # Only render again if the top places have changed since last time (shared rankings are read to find out)
+    index = leaderboard.get_index(lang)
+    version = index.version
+    cached = _leaderboard_embeds.get(lang)
+    if cached and cached[0] == version:
+        await reply(embed=cached[1])
+        return
+
+    title = "Wordy leaderboard" if lang is None else f"Wordy leaderboard [{lang}]"
+    lines = []
+    for place, (key, id) in enumerate(index.top(), 1):
+        lines.append(f"**{place}.** {leaderboard.get_name(id)}: 🏆 {-key[0]} ({-key[1]:.0%} won)")
+
+    embed = disnake.Embed(title=title, description='\n'.join(lines) or "Nobody has finished a game yet!", color=0x00ff00)
+    _leaderboard_embeds[lang] = (version, embed)
+    await reply(embed=embed)
+
+
+@metrics.timed(metrics.COMMAND_SECONDS, command='stats')
+@profiling.profiled('stats')
+@serialized_per_user
 async def handle_stats(user: disnake.User|disnake.Member, reply: Callable):
     try:
         player = get_info_for_user(user.id)
@@ -170,15 +458,46 @@ async def handle_stats(user: disnake.User|disnake.Member, reply: Callable):
     embed.add_field(name="🏆 Won", value=stats.wins, inline=True)
     embed.add_field(name="☠️ Lost", value=stats.losses, inline=True)
     embed.add_field(name="🏳️ Surrendered", value=stats.surrenders, inline=False)
+    if stats.abandoned:
+        embed.add_field(name="💤 Abandoned", value=stats.abandoned, inline=False)
 
     embed.add_field(name='═══════════════════════', value="Games played in different languages:", inline=False)
     for lang,lang_count in player.stats.games.items():
         flag = 'gb' if lang == 'en' else lang
         embed.add_field(name=f"{lang} :flag_{flag}:", value=f"{lang_count}", inline=True)
 
+    if stats.distribution:
+        embed.add_field(name='═══════════════════════', value="Games won by number of guesses:", inline=False)
+        for lang,counts in stats.distribution.items():
+            flag = 'gb' if lang == 'en' else lang
+            embed.add_field(name=f"{lang} :flag_{flag}:", value=f"```{render_distribution(counts)}```", inline=True)
+
+    await reply(embed=embed)
+
+
+@metrics.timed(metrics.COMMAND_SECONDS, command='globalstats')
+@profiling.profiled('globalstats')
+async def handle_globalstats(reply: Callable):
+    totals = global_stats.get_totals()
+    if not totals:
+        await reply("Nobody has finished a game yet!")
+        return
+
+    embed = disnake.Embed(title="Wordy stats for all players", color=0x00ff00)
+    for lang,lang_totals in totals.items():
+        flag = 'gb' if lang == 'en' else lang
+        played = lang_totals['wins'] + lang_totals['losses'] + lang_totals['surrenders']
+        description = f"🏆 {lang_totals['wins']}  ☠️ {lang_totals['losses']}  🏳️ {lang_totals['surrenders']}\n"
+        description += f"{lang_totals['wins'] / played:.0%} won since {lang_totals['since']}\n"
+        description += f"```{render_distribution(lang_totals['distribution'])}```"
+        embed.add_field(name=f"{lang} :flag_{flag}:", value=description, inline=True)
+
     await reply(embed=embed)
 
 
+@metrics.timed(metrics.COMMAND_SECONDS, command='surrender')
+@profiling.profiled('surrender')
+@serialized_per_user
 async def handle_surrender(user: disnake.User | disnake.Member, reply: Callable):
     player = get_info_for_user(user.id)
     player.username = str(user)
@@ -189,29 +508,30 @@ async def handle_surrender(user: disnake.User | disnake.Member, reply: Callable)
     player.stats.surrenders += 1
     lang_games = player.stats.games.get(player.current_game.lang, 0)
     player.stats.games[player.current_game.lang] = lang_games + 1
+    await global_stats.record_game(player.current_game.lang, EndResult.SURRENDER, len(player.current_game.board_state))
     answer = player.current_game.answer
     player.current_game = None
     set_info_for_user(user.id, player)
+    await leaderboard.record_stats(user.id, player.username, player.stats)
+    write_to_disk()
+    global_stats.save()
 
     await reply(f"You coward! 🙄\nYour word was `{answer}`!")
 
 
+@metrics.timed(metrics.COMMAND_SECONDS, command='guess')
+@profiling.profiled('guess')
+@serialized_per_user
 async def handle_new_guess(guess: str, lang: str, user: disnake.User|disnake.Member, reply: Callable):
     # Validate input
     if not guess:
         await reply(f"To play Wordy simply type `/wordy <guess>` to start or continue your own personal game.")
         return
 
-    guess = guess.lower()
-    guess = guess.removeprefix('guess:')
-    if len(guess) != 5:
-        await reply("Guess must be 5 letters long")
-        return
-
-    # Make sure the word is valid
-    if guess not in get_solution_words_for(lang) and guess not in get_acceptable_words_for(lang):
-        await reply("That's not a valid word!")
+    checked = await check_guess(guess, lang, reply)
+    if not checked:
         return
+    guess = checked
 
     # Gather text to return to the user
     description = ''
@@ -233,46 +553,221 @@ async def handle_new_guess(guess: str, lang: str, user: disnake.User|disnake.Mem
         await reply("You've already guessed that word!")
         return
 
-    # Make sure the guess uses only letters from the language's dictionary
-    dictionary = get_alphabet_for(lang)
-    if any(char not in dictionary for char in guess):
-        await reply(f"You can only use the following letters: `{dictionary}`")
-        return
-
     # Process the guess
-    enter_guess(guess, player.current_game)
+    game = player.current_game
+    enter_guess(guess, game)
 
     # Render the results
     description += "Your results so far:\n"
     description += "```"
-    for result,word in zip(player.current_game.results, player.current_game.board_state):
-        description += f"{render_result(result, player.settings.colorblind)} {word}\n"
+    description += render_board(game, player.settings.colorblind)
     description += "```"
 
     # See if the game is over
-    if player.current_game.state == EndResult.WIN:
-        description += f"\nCongratulations! 🎉\nCompleted in {len(player.current_game.board_state)} guesses!\n"
+    if game.state == EndResult.WIN:
+        description += f"\nCongratulations! 🎉\nCompleted in {len(game.board_state)} guesses!\n"
         player.stats.wins += 1
-    elif player.current_game.state == EndResult.LOSE:
-        description += f"\nNo more guesses! 😭\nYour word was `{player.current_game.answer}`!\n"
+        distribution = player.stats.distribution.setdefault(lang, [0]*MAX_GUESSES)
+        distribution[len(game.board_state) - 1] += 1
+    elif game.state == EndResult.LOSE:
+        description += f"\nNo more guesses! 😭\nYour word was `{game.answer}`!\n"
         player.stats.losses += 1
 
+    # If the game is done, record stats and remove game data
+    if game.state != EndResult.PLAYING:
+        lang_games = player.stats.games.get(game.lang, 0)
+        player.stats.games[game.lang] = lang_games + 1
+        await global_stats.record_game(game.lang, game.state, len(game.board_state))
+        player.current_game = None
+        await leaderboard.record_stats(user.id, player.username, player.stats)
+
+    # Store the updated player info before replying, so a reply that fails can't leave the game half finished
+    set_info_for_user(user.id, player)
+    write_to_disk()
+    global_stats.save()
+
     # Send the response
     embed = disnake.Embed(title="Wordy", description=description.strip('\n'))
-    await reply(embed=embed)
+    await reply_with_board(reply, 'game', game.state != EndResult.PLAYING, embed=embed)
 
-    # If the game is done, record stats and remove game data
-    if player.current_game.state != EndResult.PLAYING:
-        lang_games = player.stats.games.get(player.current_game.lang, 0)
-        player.stats.games[player.current_game.lang] = lang_games + 1
-        player.current_game = None
 
-    # Store the updated player info
+
+@metrics.timed(metrics.COMMAND_SECONDS, command='daily')
+@profiling.profiled('daily')
+@serialized_per_user
+async def handle_daily(guess: Optional[str], lang: str, user: disnake.User|disnake.Member, reply: Callable):
+    found_lang = find_language(lang)
+    if found_lang is None:
+        await reply(f"Unknown language! Choose from: `{'`, `'.join(languages)}`")
+        return
+    lang = found_lang
+
+    today = daily.get_today()
+    title = f"Wordy daily #{today} [{lang}]"
+    player = get_info_for_user(user.id)
+    game = player.daily_game if player.daily_day == today else None
+
+    # Without a guess, show how everyone is doing today
+    if not guess:
+        description = daily.render_outcomes(lang, today)
+        if game and game.lang == lang and game.state != EndResult.PLAYING:
+            codes = tuple(encode_result(result) for result in game.results)
+            description += "\nYour result:\n" + daily.render_share(lang, today, codes,
+                game.state == EndResult.WIN, len(game.answer), player.settings.colorblind)
+        await reply(embed=disnake.Embed(title=title, description=description))
+        return
+
+    if player.daily_finished.get(lang) == today:
+        await reply("You've already played today's puzzle! Use `/daily` to see how everyone did.")
+        return
+
+    guess = await check_guess(guess, lang, reply)
+    if not guess:
+        return
+
+    # Start today's puzzle if needed, replacing any earlier day's game
+    description = ''
+    player.username = str(user)
+    if game is None or game.state != EndResult.PLAYING:
+        description += "Starting today's puzzle...\n"
+        game = ActiveGame(lang=lang, answer=daily.get_daily_word(lang, today))
+        player.daily_game = game
+        player.daily_day = today
+
+    if game.lang != lang:
+        await reply("You are already playing today's puzzle in a different language!")
+        return
+
+    if guess in game.board_state:
+        await reply("You've already guessed that word!")
+        return
+
+    enter_guess(guess, game)
+
+    description += "Your results so far:\n"
+    description += "```"
+    description += render_board(game, player.settings.colorblind)
+    description += "```"
+
+    # Count the result towards today's totals, and give the player something to share
+    if game.state != EndResult.PLAYING:
+        await daily.record_outcome(lang, today, game.state, len(game.board_state))
+        player.daily_finished[lang] = today
+        if game.state == EndResult.WIN:
+            description += f"\nCongratulations! 🎉\nCompleted in {len(game.board_state)} guesses!\n"
+        else:
+            description += f"\nNo more guesses! 😭\nThe word was `{game.answer}`!\n"
+        codes = tuple(encode_result(result) for result in game.results)
+        description += "\n" + daily.render_share(lang, today, codes,
+            game.state == EndResult.WIN, len(game.answer), player.settings.colorblind)
+
+    # Store the updated player info before replying, so a reply that fails can't leave the game half finished
     set_info_for_user(user.id, player)
     write_to_disk()
+    daily.save()
+
+    embed = disnake.Embed(title=title, description=description.strip('\n'))
+    await reply_with_board(reply, 'daily', game.state != EndResult.PLAYING, embed=embed)
+
+
+
+@metrics.timed(metrics.COMMAND_SECONDS, command='race')
+@profiling.profiled('race')
+async def handle_race(guess: Optional[str], lang: str, channel: disnake.TextChannel|disnake.Thread|disnake.VoiceChannel, user: disnake.User|disnake.Member, reply: Callable):
+    current = race.get_race(channel.id)
+
+    # Without a guess, start a race unless there's one going already
+    if not guess:
+        if current is not None:
+            await reply("There's already a race on in this channel! Guess with `/race <word>`.", ephemeral=True)
+            return
+
+        found_lang = find_language(lang)
+        if found_lang is None:
+            await reply(f"Unknown language! Choose from: `{'`, `'.join(languages)}`", ephemeral=True)
+            return
+
+        # The scoreboard is a message of its own, as an interaction can only be edited for a while
+        title = f"Wordy race [{found_lang}]"
+        message: asyncio.Future[disnake.Message] = asyncio.get_running_loop().create_future()
+
+        async def publish(text: str):
+            await (await message).edit(embed=disnake.Embed(title=title, description=text))
+
+        # Claim the channel before awaiting anything, so two races can't be started at once
+        started = race.start_race(channel.id, found_lang, publish, float(os.getenv("RACE_UPDATE_INTERVAL", "1.0")))
+        try:
+            message.set_result(await channel.send(embed=disnake.Embed(title=title, description=started.render())))
+        except Exception as ex:
+            race.end_race(channel.id, started)
+            # Guesses already waiting on the scoreboard get the error too, and it's read here so
+            # asyncio doesn't complain about it when there aren't any
+            message.set_exception(ex)
+            message.exception()
+            raise
+
+        await reply("Race started! Everyone in this channel is guessing the same word.", ephemeral=True)
+        return
+
+    if current is None:
+        await reply("There's no race in this channel, start one with `/race`!", ephemeral=True)
+        return
+
+    guess = await check_guess(guess, current.lang, reply)
+    if not guess:
+        return
 
+    # Wait for the guess to show on the scoreboard, along with everyone else's from around the same time
+    error = await current.guess(user.id, str(user), guess)
+    if error:
+        await reply(error, ephemeral=True)
+        return
+
+    # Reading the player's settings can create their record, so it needs their lock like any other command
+    async with hold_user(user.id):
+        colorblind = get_info_for_user(user.id).settings.colorblind
+
+    game = current.players[user.id].game
+    description = "Your race so far:\n"
+    description += "```"
+    description += render_board(game, colorblind)
+    description += "```"
+    if game.state == EndResult.WIN:
+        description += f"\nYou won the race! 🎉\nCompleted in {len(game.board_state)} guesses!"
+    elif game.state == EndResult.LOSE:
+        description += "\nNo more guesses! 😭"
+
+    await reply(embed=disnake.Embed(title=f"Wordy race [{current.lang}]", description=description), ephemeral=True)
 
 
 if __name__ == "__main__":
-    generate_game_commands(languages)
-    bot.run(os.getenv("DISCORD_TOKEN"))
+    running_bot = create_bot()
+
+    # Rank every player once, after which rankings are updated as games finish
+    # (shared rankings are made once by the supervisor rather than by every process)
+    if not is_shared():
+        leaderboard.rebuild(iter_player_stats())
+
+    # Optionally reload dictionaries in the background instead of checking them on every guess
+    reload_interval = os.getenv("DICTIONARY_RELOAD_INTERVAL")
+    if reload_interval:
+        preload_all()
+        start_watching(float(reload_interval))
+
+    # Keep track of games in progress if they're going to be counted or swept (a process sharing
+    # players can't see the others' games change, so it doesn't scan for counts it can't keep up)
+    if (metrics.enabled or sweeper) and not is_shared():
+        track_active_games()
+
+    # Optionally export metrics over HTTP or to a file
+    if metrics.enabled:
+        metrics.start_exporting()
+
+    try:
+        running_bot.run(os.getenv("DISCORD_TOKEN"))
+    finally:
+        # Make sure nothing still waiting to be written is lost
+        flush_to_disk()
+        global_stats.flush()
+        daily.flush()
+        shutdown_hint_pool()
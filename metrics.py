@@ -0,0 +1,256 @@
+'''
+Counters and latency histograms, exported in the Prometheus text format.
+
+Metrics are switched on by setting `METRICS_PORT` (serve them over HTTP at /metrics) and/or
+`METRICS_FILE` (write them to a file every `METRICS_FILE_INTERVAL` seconds). When neither is
+set the `timed` decorator leaves functions untouched, and other recording is skipped by
+checking `enabled` first, so metrics cost next to nothing.
+'''
+
+import os
+import time
+import bisect
+import asyncio
+import functools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Iterable, TypeVar
+
+
+TFunc = TypeVar('TFunc', bound=Callable[..., Any])
+Labels = tuple[tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+enabled = bool(os.getenv('METRICS_PORT') or os.getenv('METRICS_FILE'))
+
+_registry: list['Metric'] = []
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.kind}'
+        yield from self.render_samples()
+
+    def render_samples(self) -> Iterable[str]:
+        return ()
+
+
+class Counter(Metric):
+    '''
+    A value that only goes up, optionally split by labels.
+
+    >>> requests = Counter('test_requests_total', 'Requests handled')
+    >>> requests.inc(result='hit'); requests.inc(2, result='miss')
+    >>> print('\\n'.join(requests.render()))
+    # HELP test_requests_total Requests handled
+    # TYPE test_requests_total counter
+    test_requests_total{result="hit"} 1
+    test_requests_total{result="miss"} 2
+    >>> _registry.remove(requests)
+    '''
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render_samples(self) -> Iterable[str]:
+        for labels, value in sorted(self.values.items()):
+            yield f'{self.name}{_format_labels(labels)} {_format_value(value)}'
+
+
+class Histogram(Metric):
+    '''
+    A distribution of observed values, such as durations, counted into buckets.
+
+    >>> latency = Histogram('test_seconds', 'Time taken', buckets=(0.1, 1))
+    >>> latency.observe(0.05, command='a'); latency.observe(0.5, command='a')
+    >>> print('\\n'.join(latency.render_samples()))
+    test_seconds_bucket{command="a",le="0.1"} 1
+    test_seconds_bucket{command="a",le="1"} 2
+    test_seconds_bucket{command="a",le="+Inf"} 2
+    test_seconds_sum{command="a"} 0.55
+    test_seconds_count{command="a"} 2
+    >>> _registry.remove(latency)
+    '''
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = buckets
+        self.values: dict[Labels, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self.values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def render_samples(self) -> Iterable[str]:
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                le = bound if isinstance(bound, str) else _format_value(bound)
+                yield f'{self.name}_bucket{_format_labels(labels + (("le", le),))} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(labels)} {_format_value(round(total[0], 9))}'
+            yield f'{self.name}_count{_format_labels(labels)} {cumulative}'
+
+
+class Collected(Metric):
+    '''
+    A metric whose values are fetched from a callback each time metrics are exported,
+    for things that are already being counted elsewhere.
+    '''
+    def __init__(self, name: str, help: str, kind: str, collect: Callable[[], dict[Labels, float]]):
+        super().__init__(name, help)
+        self.kind = kind
+        self.collect = collect
+
+    def render_samples(self) -> Iterable[str]:
+        for labels, value in sorted(self.collect().items()):
+            yield f'{self.name}{_format_labels(labels)} {_format_value(value)}'
+
+
+def timed(histogram: Histogram, **labels: str) -> Callable[[TFunc], TFunc]:
+    '''
+    Decorate a function or coroutine function to record how long each call takes.
+    Does nothing when metrics are disabled.
+    '''
+    def decorator(func: TFunc) -> TFunc:
+        if not enabled:
+            return func
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start, **labels)
+            return async_wrapper  # type: ignore
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+def render() -> str:
+    '''
+    Export every metric in the Prometheus text format.
+    '''
+    return '\n'.join(line for metric in list(_registry) for line in metric.render()) + '\n'
+
+
+def start_exporting():
+    '''
+    Start serving and/or dumping metrics, as configured by the environment.
+    '''
+    port = os.getenv('METRICS_PORT')
+    if port:
+        start_http_server(int(port))
+
+    path = os.getenv('METRICS_FILE')
+    if path:
+        start_file_dumper(path, float(os.getenv('METRICS_FILE_INTERVAL', '15')))
+
+
+def start_http_server(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    '''
+    Serve metrics at http://host:port/metrics from a background thread.
+    '''
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+def start_file_dumper(path: str, interval: float) -> threading.Thread:
+    '''
+    Write metrics to a file every `interval` seconds from a background thread.
+    '''
+    def dump_forever():
+        while True:
+            time.sleep(interval)
+            dump_to_file(path)
+
+    thread = threading.Thread(target=dump_forever, name='metrics-file', daemon=True)
+    thread.start()
+    return thread
+
+
+def dump_to_file(path: str):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wt', encoding='utf-8') as f:
+        f.write(render())
+    os.replace(temp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any):
+        pass
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# Metrics shared across the bot
+
+COMMAND_SECONDS = Histogram('wordy_command_seconds', 'Time taken to handle each command')
+DATABASE_SAVE_SECONDS = Histogram('wordy_database_save_seconds', 'Time taken to write the database to disk')
+DATABASE_WRITTEN_BYTES = Counter('wordy_database_written_bytes_total', 'Bytes written to the database files')
+FILE_CACHE_REQUESTS = Counter('wordy_file_cache_requests_total', 'Cached file lookups, by whether the file had to be loaded')
+FILE_RELOADS = Counter('wordy_file_reloads_total', 'Times each cached file was loaded from disk')
+FILE_RELOAD_SECONDS = Histogram('wordy_file_reload_seconds', 'Time taken to load and parse a cached file')
+GAMES_SWEPT = Counter('wordy_games_swept_total', 'Idle games ended by the sweeper')
+SWEEP_SECONDS = Histogram('wordy_sweep_seconds', 'Time taken by each sweep for idle games')
+REPLIES = Counter('wordy_replies_total', 'Replies handled by the reply queue, by what happened to them')
+REPLY_WAIT_SECONDS = Histogram('wordy_reply_wait_seconds', 'Time replies spent queued before being sent')
+RACE_GUESSES_PER_EDIT = Histogram('wordy_race_guesses_per_edit', 'Race guesses shown by each scoreboard edit', buckets=(1, 2, 5, 10, 20, 50, 100, 200))
+RACE_EDIT_SECONDS = Histogram('wordy_race_edit_seconds', 'Time taken by each race scoreboard edit')
+
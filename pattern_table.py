@@ -0,0 +1,175 @@
+'''
+Precomputed guess/answer result tables, stored on disk and shared between processes with mmap.
+
+Build the tables with `python pattern_table.py [lang ...]` whenever the word lists change.
+Tables that no longer match their word lists are ignored until they are rebuilt.
+'''
+
+import os
+import mmap
+import time
+import struct
+import hashlib
+from typing import Optional, Sequence
+
+import numpy as np
+
+from dictionary import languages, get_acceptable_words_for, get_solution_words_for
+from wordle_batch import encode_words, evaluate_guess_batch, result_dtype
+
+
+MAGIC = b'WPAT'
+VERSION = 1
+HEADER = struct.Struct('<4sHHII16s16s')
+
+_tables: dict[str, tuple[Sequence[str], Sequence[str], Optional['PatternTable']]] = {}
+
+
+class PatternTable:
+    '''
+    A read-only table of the base-3 result for every (guess, answer) pair in a language.
+
+    Guesses are the solution words followed by any other accepted words, and answers are the
+    solution words, both in word list order.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'patterns.bin')
+    >>> write_pattern_table(path, ['abca', 'abcd'], ['aaab'])
+    >>> table = PatternTable(path, ['abca', 'abcd'], ['aaab'])
+    >>> table.pattern('aaab', 'abca'), table.pattern('abcd', 'abcd')
+    (64, 80)
+    >>> row = table.row('aaab')
+    >>> row.tolist()
+    [64, 55]
+    >>> table.close()
+    >>> row.tolist()
+    [64, 55]
+    >>> PatternTable(path, ['abca', 'abce'], ['aaab'])
+    Traceback (most recent call last):
+    ...
+    ValueError: Pattern table does not match the word lists
+    '''
+    def __init__(self, path: str, solutions: Sequence[str], accepted: Sequence[str]):
+        self.path = path
+        self.guesses = _guess_words(solutions, accepted)
+        self.guess_index = {word: i for i, word in enumerate(self.guesses)}
+        self.answer_index = {word: i for i, word in enumerate(solutions)}
+
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, length, guess_count, answer_count, solution_sum, accepted_sum = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("Not a pattern table file")
+        if (solution_sum, accepted_sum) != (_checksum(solutions), _checksum(accepted)) \
+                or (guess_count, answer_count) != (len(self.guesses), len(solutions)):
+            self.close()
+            raise ValueError("Pattern table does not match the word lists")
+
+        dtype = result_dtype(length)
+        self.patterns = np.frombuffer(self._mmap, dtype=dtype, count=guess_count*answer_count, offset=HEADER.size) \
+            .reshape(guess_count, answer_count)
+
+    def pattern(self, guess: str, answer: str) -> int:
+        '''
+        Get the base-3 result of a guess against an answer.
+        '''
+        return int(self.patterns[self.guess_index[guess], self.answer_index[answer]])
+
+    def row(self, guess: str) -> np.ndarray:
+        '''
+        Get the results of a guess against every answer.
+        '''
+        return self.patterns[self.guess_index[guess]]
+
+    def close(self):
+        '''
+        Unmap the table, or if rows from it are still in use, leave that until they're done with.
+        '''
+        # Let go of the mapped rows, leaving an empty table behind
+        self.patterns = np.zeros((0, 0), dtype=np.uint8)
+        try:
+            self._mmap.close()
+        except BufferError:
+            # The rows keep the mapping alive, and it is released along with the last of them
+            pass
+
+
+def get_pattern_table(lang: str) -> Optional[PatternTable]:
+    '''
+    Get the pattern table for a language, or None if it hasn't been built or is out of date.
+
+    The table is checked again whenever the word lists are reloaded.
+    '''
+    solutions = get_solution_words_for(lang)
+    accepted = get_acceptable_words_for(lang)
+
+    cached = _tables.get(lang)
+    if cached and cached[0] is solutions and cached[1] is accepted:
+        return cached[2]
+
+    # The word lists changed (or were never checked), so drop the old table
+    if cached and cached[2]:
+        cached[2].close()
+
+    table = None
+    try:
+        table = PatternTable(get_pattern_table_path(lang), solutions, accepted)
+    except FileNotFoundError:
+        pass
+    except ValueError as ex:
+        print(f"Ignoring pattern table for {lang}: {ex}")
+
+    _tables[lang] = (solutions, accepted, table)
+    return table
+
+
+def get_pattern_table_path(lang: str) -> str:
+    return f'data/{lang}/patterns.bin'
+
+
+def build_pattern_table(lang: str):
+    '''
+    Build the pattern table for a language from its current word lists.
+    '''
+    write_pattern_table(get_pattern_table_path(lang), get_solution_words_for(lang), get_acceptable_words_for(lang))
+
+
+def write_pattern_table(path: str, solutions: Sequence[str], accepted: Sequence[str]):
+    '''
+    Write a pattern table file for the given word lists.
+
+    The file is written under a temporary name and swapped in, so processes still using
+    the old table keep their mapping intact.
+    '''
+    guesses = _guess_words(solutions, accepted)
+    length = len(solutions[0])
+    encoded_answers = encode_words(solutions)
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, length, len(guesses), len(solutions), _checksum(solutions), _checksum(accepted)))
+        for guess in guesses:
+            f.write(evaluate_guess_batch(guess, encoded_answers).tobytes())
+
+    os.replace(temp_path, path)
+
+
+def _guess_words(solutions: Sequence[str], accepted: Sequence[str]) -> list[str]:
+    seen = set(solutions)
+    return list(solutions) + [word for word in accepted if not (word in seen or seen.add(word))]
+
+
+def _checksum(words: Sequence[str]) -> bytes:
+    return hashlib.blake2b('\n'.join(words).encode('utf-8'), digest_size=16).digest()
+
+
+if __name__ == '__main__':
+    import sys
+
+    for lang in sys.argv[1:] or languages:
+        start = time.perf_counter()
+        build_pattern_table(lang)
+        size = os.path.getsize(get_pattern_table_path(lang))
+        print(f"Built {get_pattern_table_path(lang)}: {size/1024/1024:.1f} MiB in {time.perf_counter()-start:.1f}s")
@@ -0,0 +1,233 @@
+'''
+Opt-in profiling of slow commands, and a monitor for event loop stalls.
+
+Set `PROFILE_SLOW_MS` to turn it on. While a profiled command runs, a background thread samples
+the event loop thread's stack every `PROFILE_SAMPLE_MS` milliseconds. Any command taking longer
+than the threshold gets a report ranking where those samples landed, written to `PROFILE_DIR`.
+The loop monitor logs the stack and the running coroutine whenever the loop is stuck for longer
+than the threshold, which catches slow work outside of commands too.
+'''
+
+import os
+import sys
+import time
+import asyncio
+import functools
+import itertools
+import threading
+import traceback
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+
+TResult = TypeVar('TResult')
+Frame = tuple[str, int, str]
+
+slow_threshold = float(os.getenv('PROFILE_SLOW_MS', '0')) / 1000
+enabled = slow_threshold > 0
+sample_interval = float(os.getenv('PROFILE_SAMPLE_MS', '5')) / 1000
+report_folder = os.getenv('PROFILE_DIR', 'profiles')
+report_frames = 15
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_thread_id: Optional[int] = None
+_in_flight: dict[asyncio.Task, 'CallRecord'] = {}
+_report_numbers = itertools.count(1)
+
+
+@dataclass
+class CallRecord:
+    name: str
+    start: float
+    samples: Counter = field(default_factory=Counter)
+    busy: float = 0
+    # Held by the sampler thread while adding a sample, as the loop thread may be reading them for a report
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+def start(loop: asyncio.AbstractEventLoop):
+    '''
+    Start the stack sampler and loop monitor for the given loop. Must be called from the loop's thread.
+    '''
+    global _loop, _loop_thread_id
+    if not enabled or _loop is not None:
+        return
+
+    _loop = loop
+    _loop_thread_id = threading.get_ident()
+    os.makedirs(report_folder, exist_ok=True)
+
+    threading.Thread(target=_sample_forever, name='profile-sampler', daemon=True).start()
+    LoopMonitor(loop, slow_threshold).start()
+
+
+def profiled(name: str) -> Callable[[Callable[..., Awaitable[TResult]]], Callable[..., Awaitable[TResult]]]:
+    '''
+    Decorate a command handler so slow calls are reported. Does nothing unless profiling is enabled.
+    '''
+    def decorator(func: Callable[..., Awaitable[TResult]]) -> Callable[..., Awaitable[TResult]]:
+        if not enabled:
+            return func
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> TResult:
+            task = asyncio.current_task()
+            record = CallRecord(name, time.perf_counter())
+            if task:
+                _in_flight[task] = record
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                if task:
+                    _in_flight.pop(task, None)
+                elapsed = time.perf_counter() - record.start
+                if elapsed >= slow_threshold:
+                    _report_slow_call(record, elapsed)
+
+        return wrapper
+
+    return decorator
+
+
+class LoopMonitor:
+    '''
+    Watches for the event loop being blocked, logging what was running at the time.
+
+    A task on the loop updates a heartbeat, and a thread checks the heartbeat is recent.
+    '''
+    def __init__(self, loop: asyncio.AbstractEventLoop, threshold: float):
+        self.loop = loop
+        self.threshold = threshold
+        self.heartbeat = time.monotonic()
+        self.stalls = 0
+        self._beater: Optional[asyncio.Task] = None
+
+    def start(self):
+        # Keep hold of the task, as the loop only keeps a weak reference to it
+        self._beater = self.loop.create_task(self._beat())
+        threading.Thread(target=self._watch, name='loop-monitor', daemon=True).start()
+
+    async def _beat(self):
+        while True:
+            self.heartbeat = time.monotonic()
+            await asyncio.sleep(self.threshold / 4)
+
+    def _watch(self):
+        reported = 0.0
+        while True:
+            time.sleep(self.threshold / 4)
+            heartbeat = self.heartbeat
+            stalled_for = time.monotonic() - heartbeat
+            if stalled_for < self.threshold or heartbeat == reported:
+                continue
+
+            # Only report each stall once, however long it lasts
+            reported = heartbeat
+            self.stalls += 1
+            task = asyncio.current_task(self.loop)
+            coroutine = task.get_coro() if task else None
+            stack = _loop_stack()
+
+            lines = [f"{time.strftime('%Y-%m-%d %H:%M:%S')} event loop blocked for over {stalled_for*1000:.0f}ms",
+                     f"Running: {getattr(coroutine, '__qualname__', None) or task or 'no task (loop callback)'}"]
+            lines += [f"  {file}:{line} in {function}" for file, line, function in reversed(stack)]
+            with open(os.path.join(report_folder, 'loop_stalls.log'), 'at', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n\n')
+
+
+def _sample_forever():
+    last_sample = time.perf_counter()
+    while True:
+        time.sleep(sample_interval)
+
+        # Sleeps can overrun while the loop holds the GIL, so use the real time between samples
+        now = time.perf_counter()
+        interval, last_sample = now - last_sample, now
+        if not _in_flight or _loop is None:
+            continue
+
+        try:
+            task = asyncio.current_task(_loop)
+            record = _in_flight.get(task) if task else None
+            if record is not None:
+                stack = tuple(_loop_stack())
+                with record.lock:
+                    record.samples[stack] += 1
+                    record.busy += interval
+        except Exception:
+            traceback.print_exc()
+
+
+def _loop_stack() -> list[Frame]:
+    '''
+    Get the loop thread's current stack, innermost frame first.
+    '''
+    frame = sys._current_frames().get(_loop_thread_id) if _loop_thread_id is not None else None
+    stack = []
+    while frame is not None:
+        stack.append((frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name))
+        frame = frame.f_back
+    return stack
+
+
+def rank_samples(samples: Counter) -> tuple[list[tuple[Frame, int]], list[tuple[str, int]]]:
+    '''
+    Rank sampled stacks by the innermost line running, and by the functions they passed through.
+
+    >>> samples = Counter({(('a.py', 3, 'slow'), ('a.py', 9, 'main')): 3, (('b.py', 1, 'fast'), ('a.py', 9, 'main')): 1})
+    >>> rank_samples(samples)
+    ([(('a.py', 3, 'slow'), 3), (('b.py', 1, 'fast'), 1)], [('a.py:main', 4), ('a.py:slow', 3), ('b.py:fast', 1)])
+    '''
+    innermost: Counter = Counter()
+    inclusive: Counter = Counter()
+    for stack, count in samples.items():
+        if stack:
+            innermost[stack[0]] += count
+        for function in {f'{file}:{name}' for file, _, name in stack}:
+            inclusive[function] += count
+
+    return innermost.most_common(), sorted(inclusive.items(), key=lambda item: (-item[1], item[0]))
+
+
+def _report_slow_call(record: CallRecord, elapsed: float):
+    '''
+    Write a report on a slow call from a worker thread, so neither the time taken nor any error
+    writing it gets in the way of the command itself.
+    '''
+    try:
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{next(_report_numbers)}-{record.name}-{int(elapsed*1000)}ms.txt"
+        asyncio.get_running_loop().run_in_executor(None, _write_report, filename, _render_report(record, elapsed))
+    except Exception:
+        print("Failed to report slow command:")
+        traceback.print_exc()
+
+
+def _render_report(record: CallRecord, elapsed: float) -> str:
+    # The sampler may not have finished with the record yet, so work from a copy
+    with record.lock:
+        samples, busy = Counter(record.samples), record.busy
+
+    total = sum(samples.values()) or 1
+    innermost, inclusive = rank_samples(samples)
+
+    lines = [f"Command {record.name} took {elapsed*1000:.1f}ms ({total} samples of the loop thread)",
+             "", "Where time was spent:"]
+    lines += [f"{count/total:6.1%}  {file}:{line} in {name}" for (file, line, name), count in innermost[:report_frames]]
+    lines += ["", "Including time in calls made from:"]
+    lines += [f"{count/total:6.1%}  {function}" for function, count in inclusive[:report_frames]]
+
+    # Time not covered by samples was spent waiting (on Discord, locks, threads...)
+    busy = min(busy, elapsed)
+    lines += ["", f"Roughly {busy*1000:.0f}ms running on the loop, {(elapsed-busy)*1000:.0f}ms awaiting"]
+    return '\n'.join(lines) + '\n'
+
+
+def _write_report(filename: str, text: str):
+    try:
+        os.makedirs(report_folder, exist_ok=True)
+        with open(os.path.join(report_folder, filename), 'wt', encoding='utf-8') as f:
+            f.write(text)
+    except OSError:
+        print(f"Failed to write profile report {filename}:")
+        traceback.print_exc()
@@ -0,0 +1,336 @@
+'''
+Channel races, where everyone in a channel tries to guess the same word first.
+
+Each player gets their own game with the race's answer, played just like a normal game, and the
+channel has one scoreboard message showing everyone's progress without giving any letters away.
+Rather than editing the scoreboard for every guess, guesses are collected for `window` seconds,
+applied together, and shown in one edit, so a busy channel doesn't run into Discord's rate limits.
+
+Run `python race.py` to simulate busy channels, comparing an edit per guess with collected edits.
+'''
+
+import time
+import random
+import asyncio
+import argparse
+import traceback
+from typing import Awaitable, Callable, Optional
+
+import metrics
+from wordle_logic import generate_new_word
+from wordy_chat import enter_guess, render_result
+from wordy_types import MAX_GUESSES, ActiveGame, EndResult, LetterState
+
+
+# Number of players listed on a scoreboard, and how long a race can go without guesses before it's given up on
+SCOREBOARD_ROWS = 15
+RACE_IDLE_SECONDS = 3600
+
+
+class RacePlayer:
+    def __init__(self, name: str, game: ActiveGame):
+        self.name = name
+        self.game = game
+
+    def progress(self) -> tuple[int, int]:
+        '''
+        How close the player is to the answer, for ordering the scoreboard (lower is better).
+        '''
+        best = max((result.count(LetterState.CORRECT) for result in self.game.results), default=0)
+        return -best, len(self.game.board_state)
+
+
+class ChannelRace:
+    '''
+    The state of one channel's race, and the scoreboard showing it.
+
+    `publish` is called with the rendered scoreboard, at most once every `window` seconds and
+    never more than one at a time.
+
+    >>> published = []
+    >>> async def publish(text): published.append(text)
+    >>> race = ChannelRace('en', 'abcd', publish, window=0.01)
+    >>> async def guesses(*entries): return await asyncio.gather(*(race.guess(*entry) for entry in entries))
+    >>> asyncio.run(guesses((1, 'ann', 'abce'), (2, 'bob', 'xbcd'), (1, 'ann', 'abce')))
+    [None, None, "You've already guessed that word!"]
+    >>> len(published), race.guesses
+    (1, 2)
+    >>> asyncio.run(guesses((2, 'bob', 'abcd')))
+    [None]
+    >>> race.winner, race.finished
+    (2, True)
+    >>> published[-1].splitlines()[0]
+    'bob won the race! The word was `abcd`.'
+    >>> asyncio.run(guesses((1, 'ann', 'abcf')))
+    ['Too late, the race is over!']
+    >>> len(published)
+    2
+
+    A guess that can't be applied fails, rather than leaving it waiting for the scoreboard:
+
+    >>> race = ChannelRace('en', 'abcd', publish, window=0.01)
+    >>> asyncio.run(guesses((1, 'ann', 'abc')))
+    Traceback (most recent call last):
+    ...
+    ValueError: Guess and answer must be of same length
+    >>> race._flusher is None, race.players
+    (True, {})
+    >>> race.render().splitlines()[1]
+    '0 players, 0 guesses'
+    '''
+    def __init__(self, lang: str, answer: str, publish: Callable[[str], Awaitable[None]], window: float = 1.0):
+        self.lang = lang
+        self.answer = answer
+        self.publish = publish
+        self.window = window
+        self.players: dict[int, RacePlayer] = {}
+        self.winner: Optional[int] = None
+        self.guesses = 0
+        self.edits = 0
+        self.last_active = time.monotonic()
+        self._pending: list[tuple[int, str, str, asyncio.Future]] = []
+        self._flusher: Optional[asyncio.Task] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.winner is not None or (bool(self.players) and
+            all(player.game.state != EndResult.PLAYING for player in self.players.values()))
+
+
+    async def guess(self, id: int, name: str, guess: str) -> Optional[str]:
+        '''
+        Enter a player's guess, returning once it shows on the scoreboard, or why it wasn't allowed.
+        '''
+        self.last_active = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((id, name, guess, future))
+        if self._flusher is None:
+            self._flusher = asyncio.get_running_loop().create_task(self._flush())
+        return await future
+
+
+    def apply(self, id: int, name: str, guess: str) -> Optional[str]:
+        '''
+        Enter a guess straight away, returning why it wasn't allowed if it wasn't.
+        '''
+        if self.finished:
+            return "Too late, the race is over!"
+
+        player = self.players.get(id) or RacePlayer(name, ActiveGame(lang=self.lang, answer=self.answer))
+        if player.game.state != EndResult.PLAYING:
+            return "You're out of guesses for this race!"
+        if guess in player.game.board_state:
+            return "You've already guessed that word!"
+
+        # Players only join the scoreboard once they have a guess to show
+        result = enter_guess(guess, player.game)
+        self.players[id] = player
+        self.guesses += 1
+        if result == EndResult.WIN:
+            self.winner = id
+        return None
+
+
+    def render(self) -> str:
+        '''
+        Render the scoreboard, showing each player's best guess without its letters.
+        '''
+        if self.winner is not None:
+            title = f"{self.players[self.winner].name} won the race! The word was `{self.answer}`."
+        elif self.finished:
+            title = f"Nobody got it! The word was `{self.answer}`."
+        else:
+            title = "Race on! Guess with `/race <word>`."
+
+        ranked = sorted(self.players.items(), key=lambda item: (item[0] != self.winner, item[1].progress()))
+        lines = [title, f"{len(self.players)} players, {self.guesses} guesses", '']
+        for rank, (id, player) in enumerate(ranked[:SCOREBOARD_ROWS], 1):
+            game = player.game
+            best = max(game.results, key=lambda result: result.count(LetterState.CORRECT))
+            mark = ' 🏆' if id == self.winner else ' ❌' if game.state == EndResult.LOSE else ''
+            lines.append(f"{rank}. {render_result(best)} {len(game.board_state)}/{MAX_GUESSES} {player.name}{mark}")
+        if len(ranked) > SCOREBOARD_ROWS:
+            lines.append(f"...and {len(ranked) - SCOREBOARD_ROWS} more")
+        return '\n'.join(lines)
+
+
+    async def _flush(self):
+        '''
+        Apply whatever guesses come in each window and publish the scoreboard, until they stop coming.
+        '''
+        try:
+            while self._pending:
+                await asyncio.sleep(self.window)
+                batch, self._pending = self._pending, []
+                errors: list[Optional[str]] = []
+                failure: Optional[Exception] = None
+                try:
+                    for id, name, guess, _ in batch:
+                        errors.append(self.apply(id, name, guess))
+                    shown = errors.count(None)
+                    start = time.perf_counter()
+                    try:
+                        # Leave the scoreboard alone if every guess was turned away
+                        if shown:
+                            await self.publish(self.render())
+                            self.edits += 1
+                    except Exception:
+                        print("Failed to update race scoreboard:")
+                        traceback.print_exc()
+
+                    if metrics.enabled and shown:
+                        metrics.RACE_GUESSES_PER_EDIT.observe(shown)
+                        metrics.RACE_EDIT_SECONDS.observe(time.perf_counter() - start)
+                except Exception as ex:
+                    print("Failed to apply race guesses:")
+                    traceback.print_exc()
+                    failure = ex
+                finally:
+                    # Answer every guess in the batch, even those never applied because of a failure
+                    for index, (_, _, _, future) in enumerate(batch):
+                        if future.done():
+                            continue
+                        if index < len(errors):
+                            future.set_result(errors[index])
+                        elif failure is not None:
+                            future.set_exception(failure)
+                        else:
+                            future.cancel()
+        finally:
+            # If cancelled, don't leave guesses that came in meanwhile waiting on a flush that has stopped
+            self._flusher = None
+            batch, self._pending = self._pending, []
+            for _, _, _, future in batch:
+                future.cancel()
+
+
+_races: dict[int, ChannelRace] = {}
+
+
+def _expired(race: ChannelRace) -> bool:
+    '''
+    Whether a race can be forgotten: it's finished or nobody has guessed in a while, and its
+    final scoreboard is out.
+    '''
+    idle = time.monotonic() - race.last_active > RACE_IDLE_SECONDS
+    return (race.finished or idle) and race._flusher is None
+
+
+def _prune():
+    '''
+    Forget every race that has expired, including those in channels nobody looks at again.
+
+    >>> _races[1], _races[2] = ChannelRace('en', 'abcd', None), ChannelRace('en', 'abcd', None)
+    >>> _races[1].winner = 7
+    >>> _races[2].last_active -= RACE_IDLE_SECONDS + 1
+    >>> _races[3] = ChannelRace('en', 'abcd', None)
+    >>> _prune(); list(_races)
+    [3]
+    >>> _races.clear()
+    '''
+    for channel_id in [channel_id for channel_id, race in _races.items() if _expired(race)]:
+        del _races[channel_id]
+
+
+def get_race(channel_id: int) -> Optional[ChannelRace]:
+    '''
+    Get the race going on in a channel, if any. Finished races are forgotten once their final
+    scoreboard is out, as are races nobody has guessed in for a while.
+
+    >>> race = _races[1] = ChannelRace('en', 'abcd', None)
+    >>> get_race(1) is race
+    True
+    >>> race.last_active -= RACE_IDLE_SECONDS + 1
+    >>> get_race(1) is None, 1 in _races
+    (True, False)
+    '''
+    race = _races.get(channel_id)
+    if race is not None and _expired(race):
+        del _races[channel_id]
+        return None
+    return race
+
+
+def start_race(channel_id: int, lang: str, publish: Callable[[str], Awaitable[None]], window: float = 1.0) -> ChannelRace:
+    '''
+    Start a race in a channel, clearing out expired races so they don't pile up.
+    '''
+    _prune()
+    race = _races[channel_id] = ChannelRace(lang, generate_new_word(lang), publish, window)
+    return race
+
+
+def end_race(channel_id: int, race: ChannelRace):
+    '''
+    Forget a channel's race, if it is still the one given.
+    '''
+    if _races.get(channel_id) is race:
+        del _races[channel_id]
+
+
+async def _simulate(channels: int, players: int, window: float, debounce: bool, seconds: float):
+    '''
+    Have players in each channel guess at random, and report how the scoreboards kept up.
+    '''
+    from dictionary import get_solution_words_for
+    from reply_queue import FakeTransport
+
+    words = get_solution_words_for('en')
+    transport = FakeTransport()
+    latencies: list[float] = []
+    races: list[ChannelRace] = []
+    made = 0
+
+    async def player(race: ChannelRace, id: int, lock: asyncio.Lock):
+        # Random guesses, avoiding the answer so the race lasts the whole simulation
+        guesses = random.sample([word for word in words if word != race.answer], 5)
+        nonlocal made
+        for guess in guesses:
+            await asyncio.sleep(random.uniform(0, 2 * seconds / len(guesses)))
+            made += 1
+            start = time.monotonic()
+            if debounce:
+                await race.guess(id, f'player{id}', guess)
+            else:
+                async with lock:
+                    race.apply(id, f'player{id}', guess)
+                    await race.publish(race.render())
+                    race.edits += 1
+            latencies.append(time.monotonic() - start)
+
+    start = time.monotonic()
+    tasks = []
+    for channel in range(channels):
+        race = ChannelRace('en', random.choice(words), transport.sender(('message', channel)), window)
+        races.append(race)
+        lock = asyncio.Lock()
+        tasks.extend(player(race, id, lock) for id in range(players))
+    # Give up on guesses that still aren't on the scoreboard a while after the players stop
+    tasks = [asyncio.ensure_future(task) for task in tasks]
+    _, unfinished = await asyncio.wait(tasks, timeout=seconds * 2 + 5)
+    for task in unfinished:
+        task.cancel()
+    elapsed = time.monotonic() - start
+
+    latencies.sort()
+    edits = sum(race.edits for race in races)
+    guesses = sum(race.guesses for race in races)
+    print(f"{'Collected' if debounce else 'Per guess'}: {guesses} guesses shown in {edits} edits over {elapsed:.1f}s, "
+          f"{edits / elapsed / channels:.2f} edits/s per channel, {transport.refused} refused with 429s")
+    if made > len(latencies):
+        print(f"  {made - len(latencies)} of {made} guesses weren't shown by the end")
+    print(f"  guess to scoreboard: p50 {latencies[len(latencies)//2]*1000:.0f}ms, "
+          f"p95 {latencies[int(len(latencies)*0.95)]*1000:.0f}ms, max {latencies[-1]*1000:.0f}ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulate busy channel races against a fake Discord")
+    parser.add_argument('--channels', type=int, default=3, help="Number of channels racing")
+    parser.add_argument('--players', type=int, default=300, help="Players in each channel")
+    parser.add_argument('--window', type=float, default=1.0, help="Seconds to collect guesses for before each edit")
+    parser.add_argument('--seconds', type=float, default=20, help="Roughly how long players keep guessing for")
+    args = parser.parse_args()
+
+    for debounce in (False, True):
+        random.seed(1)
+        asyncio.run(_simulate(args.channels, args.players, args.window, debounce, args.seconds))
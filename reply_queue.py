@@ -0,0 +1,373 @@
+'''
+An outbound queue for replies, keeping within Discord's rate limits instead of running into them.
+
+Handlers still just `await reply(...)`, but with a queued reply that returns as soon as the
+message is queued. Messages are sent in order within each route (a channel, or one interaction),
+and interaction responses, which must arrive within a few seconds, go ahead of prefix command
+replies. A board for a game still going on that is waiting to be sent is replaced by the player's
+next board, instead of both being sent.
+
+This is a fixed throttle: each route and all routes together are kept to a set number of replies
+per period, chosen to stay under Discord's usual limits. Discord's actual buckets aren't visible
+through disnake, which waits out any 429 by itself, so the limits are settings rather than learned.
+
+Run `python reply_queue.py` to compare sending a burst of replies directly and through the queue,
+using a fake transport that refuses requests over the limit and retries them like disnake does.
+'''
+
+import time
+import random
+import asyncio
+import argparse
+import traceback
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+import metrics
+
+
+# Lower goes first
+INTERACTION = 0
+PREFIX = 1
+
+
+class RateLimitBudget:
+    '''
+    How many more requests can be made before a rate limit resets, allowing `limit` requests
+    every `period` seconds.
+
+    >>> budget = RateLimitBudget(2, 1.0)
+    >>> budget.take(now=0.0); budget.take(now=0.1)
+    >>> budget.wait_time(now=0.2)
+    0.8
+    >>> budget.wait_time(now=1.0)
+    0.0
+    '''
+    def __init__(self, limit: int, period: float):
+        self.limit = limit
+        self.period = period
+        self.remaining = limit
+        self.reset_at = 0.0
+
+    def wait_time(self, now: float) -> float:
+        if now >= self.reset_at or self.remaining > 0:
+            return 0.0
+        return round(self.reset_at - now, 6)
+
+    def take(self, now: float):
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.period
+        self.remaining -= 1
+
+
+class QueuedReply:
+    def __init__(self, send: Callable[..., Awaitable[Any]], args: tuple, kwargs: dict,
+                 priority: int, coalesce_key: Optional[Hashable], replaceable: bool, order: int):
+        self.send = send
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.coalesce_key = coalesce_key
+        self.replaceable = replaceable
+        self.order = order
+        self.queued_at = time.monotonic()
+
+
+class Route:
+    '''
+    Replies waiting to be sent to one place, in order, with that place's rate limit budget.
+    '''
+    def __init__(self, budget: RateLimitBudget, uses_global: bool):
+        self.budget = budget
+        self.uses_global = uses_global
+        self.waiting: deque[QueuedReply] = deque()
+        self.busy = False
+        self.last_used = time.monotonic()
+
+
+class ReplyQueue:
+    '''
+    Sends queued replies from a background task, as fast as the rate limits allow.
+
+    `route_limit`/`route_period` are the budget for each channel, and `global_limit` is the number
+    of requests per second allowed in total (interaction responses don't count towards it). At most
+    `max_in_flight` replies are sent at once.
+
+    >>> transport = FakeTransport(latency=0)
+    >>> queue = ReplyQueue()
+    >>> board_reply = queue.wrap(transport.sender('channel'), 'channel', PREFIX, owner=1)
+    >>> hint_reply = queue.wrap(transport.sender('interaction', interaction=True), 'interaction', INTERACTION)
+    >>> async def burst():
+    ...     for turn in range(3):
+    ...         await getattr(board_reply, 'send_board')('game', turn == 2, f'board {turn}')
+    ...     await board_reply('stats')
+    ...     await hint_reply('hint')
+    ...     await queue.drain()
+    ...     await queue.stop()
+    >>> asyncio.run(burst())
+
+    The interaction reply goes first, even though it was queued last, and each board replaces the
+    one before it that was still waiting:
+
+    >>> [content for _, _, content in transport.sent]
+    ['hint', 'board 2', 'stats']
+    >>> queue.stats
+    {'queued': 5, 'sent': 3, 'coalesced': 2, 'failed': 0}
+    '''
+    def __init__(self, route_limit: int = 5, route_period: float = 5.0, global_limit: int = 50, max_in_flight: int = 50):
+        self.route_limit = route_limit
+        self.route_period = route_period
+        self.global_budget = RateLimitBudget(global_limit, 1.0)
+        self.max_in_flight = max_in_flight
+        self.routes: dict[Hashable, Route] = {}
+        self.stats = dict(queued=0, sent=0, coalesced=0, failed=0)
+        self._in_flight = 0
+        self._order = 0
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # The loop only keeps weak references to tasks, so those sending replies are kept here
+        self._sending: set[asyncio.Task] = set()
+
+
+    def wrap(self, send: Callable[..., Awaitable[Any]], route: Hashable, priority: int = PREFIX,
+             owner: Optional[Hashable] = None) -> Callable[..., Awaitable[None]]:
+        '''
+        Make a reply function that queues its message to be sent with `send`.
+
+        If an `owner` is given, the reply function also gets a `send_board(board, final, ...)` method,
+        for sending a board of the owner's. Unless it is `final`, the board is replaced by the owner's
+        next board of the same kind on the same route if that comes along before it is sent.
+        '''
+        async def reply(*args: Any, **kwargs: Any):
+            self.put(send, args, kwargs, route, priority)
+
+        async def send_board(board: str, final: bool, *args: Any, **kwargs: Any):
+            self.put(send, args, kwargs, route, priority, (owner, board), replaceable=not final)
+
+        if owner is not None:
+            setattr(reply, 'send_board', send_board)
+        return reply
+
+
+    def put(self, send: Callable[..., Awaitable[Any]], args: tuple, kwargs: dict, route_key: Hashable,
+            priority: int = PREFIX, coalesce_key: Optional[Hashable] = None, replaceable: bool = False):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+        route = self.routes.get(route_key)
+        if route is None:
+            # Interaction responses have their own limits, and don't count towards the global one
+            route = self.routes[route_key] = Route(RateLimitBudget(self.route_limit, self.route_period), priority != INTERACTION)
+        route.last_used = time.monotonic()
+
+        self.stats['queued'] += 1
+        if coalesce_key is not None:
+            for queued in route.waiting:
+                if queued.coalesce_key == coalesce_key and queued.replaceable:
+                    # Drop the older board, keeping the new one behind any other replies sent since
+                    route.waiting.remove(queued)
+                    self._count('coalesced')
+                    break
+
+        self._order += 1
+        route.waiting.append(QueuedReply(send, args, kwargs, priority, coalesce_key, replaceable, self._order))
+        self._wake.set()
+
+
+    def pending(self) -> int:
+        return sum(len(route.waiting) for route in self.routes.values()) + self._in_flight
+
+
+    async def drain(self):
+        '''
+        Wait until everything queued so far has been sent.
+        '''
+        while self.pending():
+            await asyncio.sleep(0.01)
+
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+    def _next(self, now: float) -> tuple[Optional[Route], float]:
+        '''
+        Pick the route whose next reply should be sent now, or else how long until one can be.
+        '''
+        best: Optional[Route] = None
+        wait = float('inf')
+        global_wait = self.global_budget.wait_time(now)
+
+        for route in self.routes.values():
+            if route.busy or not route.waiting:
+                continue
+
+            route_wait = max(route.budget.wait_time(now), global_wait if route.uses_global else 0.0)
+            if route_wait > 0:
+                wait = min(wait, route_wait)
+                continue
+
+            head = route.waiting[0]
+            if best is None or (head.priority, head.order) < (best.waiting[0].priority, best.waiting[0].order):
+                best = route
+
+        return best, wait
+
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            now = time.monotonic()
+            route, wait = self._next(now) if self._in_flight < self.max_in_flight else (None, float('inf'))
+
+            if route is None:
+                self._forget_idle_routes(now)
+                try:
+                    await asyncio.wait_for(self._wake.wait(), None if wait == float('inf') else wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            item = route.waiting.popleft()
+            route.busy = True
+            route.budget.take(now)
+            if route.uses_global:
+                self.global_budget.take(now)
+
+            self._in_flight += 1
+            task = asyncio.get_running_loop().create_task(self._send(route, item))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+
+    async def _send(self, route: Route, item: QueuedReply):
+        try:
+            if metrics.enabled:
+                metrics.REPLY_WAIT_SECONDS.observe(time.monotonic() - item.queued_at)
+
+            await item.send(*item.args, **item.kwargs)
+            self._count('sent')
+
+        except Exception:
+            self._count('failed')
+            print("Failed to send reply:")
+            traceback.print_exc()
+
+        finally:
+            route.busy = False
+            self._in_flight -= 1
+            self._wake.set()
+
+
+    def _forget_idle_routes(self, now: float, idle: float = 60.0):
+        for key, route in list(self.routes.items()):
+            if not route.waiting and not route.busy and now - route.last_used > idle and now >= route.budget.reset_at:
+                del self.routes[key]
+
+
+    def _count(self, result: str):
+        self.stats[result] += 1
+        if metrics.enabled:
+            metrics.REPLIES.inc(result=result)
+
+
+class FakeTransport:
+    '''
+    Pretends to be Discord as seen through disnake, which waits out a refused request and tries again.
+
+    Each route allows `route_limit` messages every `route_period` seconds, and all routes except
+    interactions together allow `global_limit` per second. Sending takes `latency` seconds on average,
+    and `refused` counts the requests that would have got a 429.
+    '''
+    def __init__(self, route_limit: int = 5, route_period: float = 5.0, global_limit: int = 50, latency: float = 0.05):
+        self.route_limit = route_limit
+        self.route_period = route_period
+        self.global_limit = global_limit
+        self.latency = latency
+        self.buckets: dict[Hashable, RateLimitBudget] = {}
+        self.global_bucket = RateLimitBudget(global_limit, 1.0)
+        self.sent: list[tuple[Hashable, float, Any]] = []
+        self.refused = 0
+
+    def sender(self, route: Hashable, interaction: bool = False) -> Callable[..., Awaitable[None]]:
+        async def send(content: Any = None, **kwargs: Any):
+            bucket = self.buckets.setdefault(route, RateLimitBudget(self.route_limit, self.route_period))
+            while True:
+                await asyncio.sleep(random.expovariate(1 / self.latency) if self.latency else 0)
+                now = time.monotonic()
+                wait = max(bucket.wait_time(now), 0.0 if interaction else self.global_bucket.wait_time(now))
+                if not wait:
+                    break
+                self.refused += 1
+                await asyncio.sleep(wait)
+
+            bucket.take(now)
+            if not interaction:
+                self.global_bucket.take(now)
+            self.sent.append((route, now, content if content is not None else kwargs.get('embed')))
+
+        return send
+
+
+async def _simulate(channels: int, players: int, guesses: int, interaction_share: float, use_queue: bool):
+    '''
+    Have players in a few channels send bursts of guesses, then report how the replies fared.
+    '''
+    transport = FakeTransport()
+    queue = ReplyQueue()
+    latencies: dict[int, list[float]] = {INTERACTION: [], PREFIX: []}
+
+    async def player(id: int):
+        channel = id % channels
+        for turn in range(guesses):
+            interaction = random.random() < interaction_share
+            route = f'interaction:{id}:{turn}' if interaction else f'channel:{channel}'
+            send = transport.sender(route, interaction)
+            start = time.monotonic()
+
+            async def timed_send(*args, _send=send, _start=start, _kind=INTERACTION if interaction else PREFIX, **kwargs):
+                await _send(*args, **kwargs)
+                latencies[_kind].append(time.monotonic() - _start)
+
+            if use_queue:
+                reply = queue.wrap(timed_send, route, INTERACTION if interaction else PREFIX, id)
+                await getattr(reply, 'send_board')('game', turn == guesses - 1, f'board {id} {turn}')
+            else:
+                await timed_send(f'board {id} {turn}')
+
+            await asyncio.sleep(random.uniform(0, 0.2))
+
+    start = time.monotonic()
+    await asyncio.gather(*(player(id) for id in range(players)))
+    if use_queue:
+        await queue.drain()
+        await queue.stop()
+    elapsed = time.monotonic() - start
+
+    print(f"{'Queued' if use_queue else 'Direct'}: {len(transport.sent)} messages sent in {elapsed:.1f}s, "
+          f"{transport.refused} refused with 429s" + (f", {queue.stats['coalesced']} boards coalesced" if use_queue else ''))
+    for kind, name in ((INTERACTION, 'interaction'), (PREFIX, 'prefix')):
+        values = sorted(latencies[kind])
+        if values:
+            print(f"  {name:>11} replies: p50 {values[len(values)//2]*1000:.0f}ms, "
+                  f"p95 {values[int(len(values)*0.95)]*1000:.0f}ms, max {values[-1]*1000:.0f}ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare replying directly and through the queue, against a fake Discord")
+    parser.add_argument('--channels', type=int, default=4, help="Number of channels the players are spread over")
+    parser.add_argument('--players', type=int, default=100, help="Number of players")
+    parser.add_argument('--guesses', type=int, default=6, help="Guesses each player makes in quick succession")
+    parser.add_argument('--interactions', type=float, default=0.5, help="Share of guesses made with slash commands")
+    args = parser.parse_args()
+
+    for use_queue in (False, True):
+        random.seed(1)
+        asyncio.run(_simulate(args.channels, args.players, args.guesses, args.interactions, use_queue))
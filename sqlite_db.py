@@ -0,0 +1,366 @@
+'''
+A SQLite storage backend, keeping one row per user so only active users need to be in memory.
+
+Other small tables can be kept in the same file, such as the server-wide totals and rankings of
+processes that share one database.
+'''
+
+import json
+import time
+import sqlite3
+import threading
+from typing import Any, Callable, Iterable, Iterator, Optional, TypeVar
+
+import metrics
+
+
+TFallback = TypeVar('TFallback')
+
+NO_FALLBACK = object()
+
+SQL_CREATE = "CREATE TABLE IF NOT EXISTS {table} (id TEXT PRIMARY KEY, data TEXT NOT NULL)"
+SQL_SELECT = "SELECT data FROM {table} WHERE id = ?"
+SQL_SELECT_ALL = "SELECT id, data FROM {table}"
+SQL_UPSERT = "INSERT INTO {table} (id, data) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET data = excluded.data"
+
+SQL_CREATE_RANKINGS = ("CREATE TABLE IF NOT EXISTS rankings (board TEXT NOT NULL, id TEXT NOT NULL, name TEXT, "
+                       "first INTEGER NOT NULL, second REAL NOT NULL, PRIMARY KEY (board, id))")
+SQL_CREATE_RANKINGS_ORDER = "CREATE INDEX IF NOT EXISTS rankings_order ON rankings (board, first, second, id)"
+SQL_RANK = ("INSERT INTO rankings (board, id, name, first, second) VALUES (?, ?, ?, ?, ?) ON CONFLICT(board, id) "
+            "DO UPDATE SET name = COALESCE(excluded.name, name), first = excluded.first, second = excluded.second")
+SQL_UNRANK = "DELETE FROM rankings WHERE board = ? AND id = ?"
+SQL_TOP = "SELECT first, second, id, name FROM rankings WHERE board = ? ORDER BY first, second, id LIMIT ?"
+
+
+class SQLiteDatabase:
+    """
+    A SQLite-backed database with the same interface as `JSONDatabase`.
+
+    Changes are held in memory until the next save, then committed together in a single
+    transaction. Saving can happen from a worker thread while reads continue on a separate
+    connection, which WAL mode allows without blocking. Items are kept in `table`, so several
+    databases can share one file.
+    """
+    def __init__(self, filename: str, table: str = 'users'):
+        self.filename: str = filename
+        self.table = table
+        self.dirty_keys: set[str] = set()
+        self.pending: dict[str, dict[str, Any]] = {}
+        self._in_flight: dict[int, dict[str, dict[str, Any]]] = {}
+        self._save_generation = 0
+        self._written_generation = 0
+        self._write_failed = False
+        # Guards _in_flight, which the thread doing a save changes while the event loop reads it
+        self._in_flight_lock = threading.Lock()
+
+        self._writer = self._connect()
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._writer.execute(SQL_CREATE.format(table=table))
+        self._writer.commit()
+        self._write_lock = threading.Lock()
+
+        self._reader = self._connect()
+        self._read_lock = threading.Lock()
+
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.filename, check_same_thread=False)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+
+    def __getitem__(self, id: str) -> dict[str, Any]:
+        id = str(id)
+
+        # Unsaved changes take priority over what is on disk, newest first
+        if id in self.pending:
+            return self.pending[id]
+        for batch in reversed(self._get_in_flight()):
+            if id in batch:
+                return batch[id]
+
+        with self._read_lock:
+            row = self._reader.execute(SQL_SELECT.format(table=self.table), (id,)).fetchone()
+
+        if row is None:
+            raise KeyError(id)
+
+        return json.loads(row[0])
+
+
+    def items(self) -> Iterator[tuple[str, dict[str, Any]]]:
+        """
+        Iterate over every item, reading rows one at a time from a separate connection.
+        Changes that haven't been saved yet are included.
+
+        >>> import os, tempfile
+        >>> db = SQLiteDatabase(os.path.join(tempfile.mkdtemp(), 'database.sqlite'))
+        >>> db['1'] = {'wins': 1}; db['2'] = {'wins': 2}; db.save()
+        >>> db['2'] = {'wins': 5}
+        >>> write = db.begin_save()
+        >>> db['3'] = {'wins': 3}
+        >>> sorted(db.items())
+        [('1', {'wins': 1}), ('2', {'wins': 5}), ('3', {'wins': 3})]
+        """
+        unsaved: dict[str, dict[str, Any]] = {}
+        for batch in self._get_in_flight():
+            unsaved.update(batch)
+        unsaved.update(self.pending)
+
+        connection = self._connect()
+        try:
+            for id, data in connection.execute(SQL_SELECT_ALL.format(table=self.table)):
+                yield id, unsaved.pop(id) if id in unsaved else json.loads(data)
+        finally:
+            connection.close()
+
+        yield from unsaved.items()
+
+
+    def get(self, id: str, fallback:TFallback=NO_FALLBACK) -> dict[str, Any]|TFallback:
+        """
+        Get the value of an item, or return a fallback value if it doesn't exist.
+        """
+        try:
+            return self[id]
+        except KeyError:
+            if fallback is NO_FALLBACK:
+                raise
+            return fallback
+
+
+    def __setitem__(self, id: str, value: dict[str, Any]) -> dict[str, Any]:
+        self.pending[str(id)] = value
+        self.mark_dirty(id)
+        return value
+
+
+    def update(self, id: str, update_values: dict[str, Any]) -> dict[str, Any]:
+        """
+        Update the value of an item.
+        """
+        old_values = self[id]
+        self[id] = {**old_values, **update_values}
+        return update_values
+
+
+    def modify(self, id: str, change: Callable[[Optional[dict[str, Any]]], dict[str, Any]]) -> dict[str, Any]:
+        """
+        Replace an item with what `change` makes of its current value (None if it doesn't exist),
+        committing straight away.
+
+        This happens in one transaction that holds SQLite's write lock throughout, so other
+        processes sharing the file can't change the item in between. It mustn't be mixed with
+        unsaved changes to the same item, and as it waits for other processes to finish writing,
+        it shouldn't be called on the event loop.
+
+        >>> import os, tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), 'database.sqlite')
+        >>> first, second = SQLiteDatabase(path, 'totals'), SQLiteDatabase(path, 'totals')
+        >>> count = lambda old: {'games': (old or {'games': 0})['games'] + 1}
+        >>> first.modify('en', count); second.modify('en', count)
+        {'games': 1}
+        {'games': 2}
+        """
+        id = str(id)
+        with self._write_lock, self._writer:
+            self._writer.execute("BEGIN IMMEDIATE")
+            row = self._writer.execute(SQL_SELECT.format(table=self.table), (id,)).fetchone()
+            value = change(json.loads(row[0]) if row else None)
+            self._writer.execute(SQL_UPSERT.format(table=self.table), (id, json.dumps(value, separators=(',', ':'))))
+        return value
+
+
+    def mark_dirty(self, id: Optional[str] = None):
+        """
+        Mark an item as changed. Only items that have been set are ever written.
+        """
+        if id is not None:
+            self.dirty_keys.add(str(id))
+
+
+    def save(self):
+        """
+        Commit all pending changes.
+        """
+        write = self.begin_save()
+        if write:
+            write()
+
+
+    def begin_save(self) -> Optional[Callable[[], None]]:
+        """
+        Take the pending changes, returning a function that commits them.
+
+        The returned function is safe to run in another thread. Changes from saves that
+        haven't finished yet are included again, so whichever save finishes last wins, and
+        changes from a save that failed are tried again even if nothing else has changed.
+
+        >>> import os, tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), 'database.sqlite')
+        >>> db = SQLiteDatabase(path)
+        >>> db['1'] = {'wins': 1}
+        >>> older = db.begin_save()
+        >>> db['2'] = {'wins': 2}
+        >>> newer = db.begin_save()
+        >>> newer(); older()
+        >>> sorted(SQLiteDatabase(path).items())
+        [('1', {'wins': 1}), ('2', {'wins': 2})]
+
+        A save that fails, here because another connection holds the write lock, is tried again
+        by the next one, and its changes can still be read in the meantime.
+
+        >>> blocker = sqlite3.connect(path)
+        >>> _ = blocker.execute("BEGIN IMMEDIATE")
+        >>> _ = db._writer.execute("PRAGMA busy_timeout = 0")
+        >>> db['3'] = {'wins': 3}
+        >>> db.save()
+        Traceback (most recent call last):
+        ...
+        sqlite3.OperationalError: database is locked
+        >>> db['3']
+        {'wins': 3}
+        >>> blocker.rollback()
+        >>> db.save()
+        >>> SQLiteDatabase(path)['3']
+        {'wins': 3}
+        """
+        if not self.pending and not self._write_failed:
+            return None
+        self._write_failed = False
+
+        batch: dict[str, dict[str, Any]] = {}
+        for older in self._get_in_flight():
+            batch.update(older)
+        batch.update(self.pending)
+
+        self._save_generation += 1
+        generation = self._save_generation
+        with self._in_flight_lock:
+            self._in_flight[generation] = batch
+        self.pending = {}
+        self.dirty_keys.clear()
+
+        return lambda: self._write(batch, generation)
+
+
+    def _write(self, batch: dict[str, dict[str, Any]], generation: int):
+        with self._write_lock:
+            if generation > self._written_generation:
+                start = time.perf_counter()
+                try:
+                    rows = [(id, json.dumps(value, separators=(',', ':'))) for id, value in batch.items()]
+                    with self._writer:
+                        self._writer.executemany(SQL_UPSERT.format(table=self.table), rows)
+                except Exception:
+                    # The batch stays in flight, to be included in the next save
+                    self._write_failed = True
+                    raise
+                self._written_generation = generation
+
+                if metrics.enabled:
+                    metrics.DATABASE_SAVE_SECONDS.observe(time.perf_counter() - start)
+                    metrics.DATABASE_WRITTEN_BYTES.inc(sum(len(data) for _, data in rows), file='sqlite')
+
+            # Anything older than this is now covered
+            with self._in_flight_lock:
+                for older in [g for g in self._in_flight if g <= generation]:
+                    del self._in_flight[older]
+
+
+    def _get_in_flight(self) -> list[dict[str, dict[str, Any]]]:
+        """
+        Get the batches of saves that haven't finished yet, oldest first.
+        """
+        with self._in_flight_lock:
+            return [self._in_flight[generation] for generation in sorted(self._in_flight)]
+
+
+    def import_json(self, json_filename: str) -> int:
+        """
+        Import all items from a `JSONDatabase` file, replacing any existing rows for them.
+        """
+        with open(json_filename, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+
+        rows = [(str(id), json.dumps(value, separators=(',', ':'))) for id, value in data.items()]
+        with self._write_lock, self._writer:
+            self._writer.executemany(SQL_UPSERT.format(table=self.table), rows)
+
+        return len(rows)
+
+
+class SQLiteRankings:
+    """
+    Leaderboard rankings kept in a table, so that processes sharing a database share their
+    leaderboards too. Each board ranks players by a sort key of an int and a float, smallest first.
+
+    >>> import os, tempfile
+    >>> rankings = SQLiteRankings(os.path.join(tempfile.mkdtemp(), 'database.sqlite'))
+    >>> rankings.update('a', 'ann', {'': (-3, -0.5), 'en': (-3, -0.5)})
+    >>> rankings.update('b', 'bob', {'': (-5, -1.0)})
+    >>> rankings.top('', 10)
+    [((-5, -1.0), 'b', 'bob'), ((-3, -0.5), 'a', 'ann')]
+    >>> rankings.update('a', None, {'': (-6, -0.6), 'en': None})
+    >>> rankings.top('', 1), rankings.top('en', 10)
+    ([((-6, -0.6), 'a', 'ann')], [])
+    >>> rankings.load([('c', 'cat', {'': (-1, -1.0)})])
+    >>> rankings.top('', 10)
+    [((-1, -1.0), 'c', 'cat')]
+    """
+    def __init__(self, filename: str):
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute(SQL_CREATE_RANKINGS)
+            self._connection.execute(SQL_CREATE_RANKINGS_ORDER)
+        self._lock = threading.Lock()
+
+        # Reads have a connection of their own, so they never wait behind a write waiting on another process
+        self._reader = sqlite3.connect(filename, check_same_thread=False)
+        self._read_lock = threading.Lock()
+
+
+    def update(self, id: str, name: Optional[str], keys: dict[str, Optional[tuple]]):
+        """
+        Set a player's sort key on each of the given boards, taking them off a board if it is None.
+        Their name is kept as it was if None.
+        """
+        with self._lock, self._connection:
+            for board, key in keys.items():
+                if key is None:
+                    self._connection.execute(SQL_UNRANK, (board, id))
+                else:
+                    self._connection.execute(SQL_RANK, (board, id, name, *key))
+
+
+    def top(self, board: str, count: int) -> list[tuple[tuple, str, Optional[str]]]:
+        """
+        Get the best `count` players on a board, as their sort key, id and name.
+        """
+        with self._read_lock:
+            rows = self._reader.execute(SQL_TOP, (board, count)).fetchall()
+        return [((first, second), id, name) for first, second, id, name in rows]
+
+
+    def load(self, players: Iterable[tuple[str, Optional[str], dict[str, Optional[tuple]]]]):
+        """
+        Replace every board at once, given each player's id, name and sort keys.
+        """
+        rows = ((board, id, name, *key) for id, name, keys in players for board, key in keys.items() if key is not None)
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM rankings")
+            self._connection.executemany(SQL_RANK, rows)
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) != 3:
+        print("Usage: python sqlite_db.py <database.json> <database.sqlite>")
+        sys.exit(1)
+
+    db = SQLiteDatabase(sys.argv[2])
+    count = db.import_json(sys.argv[1])
+    print(f"Imported {count} users into {sys.argv[2]}")
@@ -0,0 +1,28 @@
+'''
+The interface game state storage backends provide, so game_store can use any of them.
+'''
+
+from typing import Any, Callable, Iterator, Optional, Protocol
+
+
+class Storage(Protocol):
+    '''
+    A simple key-value store of user records, keyed by Discord ID as a string.
+    '''
+    dirty_keys: set[str]
+
+    def __getitem__(self, id: str) -> dict[str, Any]: ...
+
+    def __setitem__(self, id: str, value: dict[str, Any]) -> dict[str, Any]: ...
+
+    def get(self, id: str, fallback: Any = ...) -> Any: ...
+
+    def items(self) -> Iterator[tuple[str, dict[str, Any]]]: ...
+
+    def update(self, id: str, update_values: dict[str, Any]) -> dict[str, Any]: ...
+
+    def mark_dirty(self, id: Optional[str] = None): ...
+
+    def save(self): ...
+
+    def begin_save(self) -> Optional[Callable[[], None]]: ...
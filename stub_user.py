@@ -0,0 +1,16 @@
+'''
+A stand-in for a Discord user, for driving the command handlers without Discord.
+'''
+
+
+class StubUser:
+    '''
+    Just enough of a `disnake.User` for the command handlers.
+    '''
+    def __init__(self, id: int):
+        self.id = id
+        self.name = f'Player{id}'
+        self.avatar = None
+
+    def __str__(self):
+        return f'{self.name}#{self.id % 10000:04}'
@@ -0,0 +1,277 @@
+'''
+Runs the bot as several worker processes, each connecting a share of the Discord gateway shards.
+
+All workers use one SQLite database. While a command runs, its player is locked across every
+process with the lock files in `USER_LOCK_DIR`, and any changes are saved before the lock is
+let go, so no two workers ever change the same player at once.
+
+Start the bot with e.g. `python supervisor.py --workers 4 --shards 8`. Workers that exit are
+restarted. Other settings come from the environment as usual, except for these:
+
+ * `DATABASE_BACKEND` is always `sqlite`.
+ * `USER_CACHE_SIZE` and write-behind have no effect, as other workers may change any player.
+ * Leaderboards, `/globalstats` totals and daily results are kept in tables of the shared database.
+   Players are ranked once on starting, and totals from `GLOBAL_STATS_PATH` and `DAILY_RESULTS_PATH`
+   are carried over the first time.
+ * `IDLE_GAME_SECONDS` has no effect, and games in progress aren't counted in the metrics.
+ * `METRICS_PORT` is made different for each worker.
+
+`python supervisor.py --simulate` instead runs workers that play the same players against the
+command handlers directly, with no Discord connection, then checks that no game was lost.
+'''
+
+import os
+import sys
+import time
+import random
+import queue
+import signal
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from typing import Optional
+
+
+def assign_shards(shard_count: int, workers: int) -> list[list[int]]:
+    '''
+    Spread the gateway shards over the workers.
+
+    >>> assign_shards(5, 2)
+    [[0, 2, 4], [1, 3]]
+    '''
+    return [list(range(worker, shard_count, workers)) for worker in range(workers)]
+
+
+def worker_environment(worker: int, shard_ids: Optional[list[int]], shard_count: int, lock_dir: str) -> dict[str, str]:
+    '''
+    Get the environment for a worker process.
+    '''
+    env = dict(os.environ,
+        WORKER_ID=str(worker),
+        DATABASE_BACKEND='sqlite',
+        USER_LOCK_DIR=lock_dir,
+    )
+    env.pop('WRITE_BEHIND_INTERVAL', None)
+
+    if shard_ids is not None:
+        env['SHARD_IDS'] = ','.join(str(shard_id) for shard_id in shard_ids)
+        env['SHARD_COUNT'] = str(shard_count)
+
+    if os.getenv('METRICS_PORT'):
+        env['METRICS_PORT'] = str(int(os.environ['METRICS_PORT']) + worker)
+
+    return env
+
+
+def prepare_database(path: str):
+    '''
+    Get the shared database ready before any workers start: rank every player (rather than having
+    every worker do it), and carry over server-wide totals kept in files by a single process.
+    '''
+    import leaderboard
+    from sqlite_db import SQLiteDatabase, SQLiteRankings
+    from wordy_types import Stats
+
+    start = time.perf_counter()
+    users = SQLiteDatabase(path)
+    leaderboard.share_rankings(SQLiteRankings(path))
+    leaderboard.rebuild((key, raw.get('username'), Stats.parse_obj(raw.get('stats') or {})) for key, raw in users.items())
+    print(f"Ranked every player in {time.perf_counter() - start:.1f}s")
+
+    for table, setting, default in (('global_stats', 'GLOBAL_STATS_PATH', 'global_stats.json'),
+                                    ('daily_results', 'DAILY_RESULTS_PATH', 'daily_results.json')):
+        totals = SQLiteDatabase(path, table)
+        json_path = os.getenv(setting, default)
+        if os.path.exists(json_path) and next(totals.items(), None) is None:
+            print(f"Carried over {totals.import_json(json_path)} records from {json_path}")
+
+
+class Supervisor:
+    '''
+    Starts the worker processes, restarts any that exit, and stops them all on SIGINT or SIGTERM.
+    '''
+    def __init__(self, workers: int, shard_count: int, lock_dir: str, restart_delay: float = 5.0):
+        self.shards = assign_shards(shard_count, workers)
+        self.shard_count = shard_count
+        self.lock_dir = lock_dir
+        self.restart_delay = restart_delay
+        self.processes: list[Optional[subprocess.Popen]] = [None] * workers
+        self.started: list[float] = [0.0] * workers
+        self.failures: list[int] = [0] * workers
+        self.stopping = False
+
+    def start_worker(self, worker: int):
+        env = worker_environment(worker, self.shards[worker], self.shard_count, self.lock_dir)
+        print(f"Starting worker {worker} with shards {env['SHARD_IDS']}")
+        self.processes[worker] = subprocess.Popen([sys.executable, 'main.py'], env=env)
+        self.started[worker] = time.monotonic()
+
+    def stop(self, *_):
+        self.stopping = True
+        for process in self.processes:
+            if process and process.poll() is None:
+                process.terminate()
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        for worker in range(len(self.processes)):
+            self.start_worker(worker)
+
+        restart_at: dict[int, float] = {}
+        while not self.stopping:
+            time.sleep(0.5)
+            for worker, process in enumerate(self.processes):
+                if worker in restart_at:
+                    if time.monotonic() >= restart_at[worker] and not self.stopping:
+                        del restart_at[worker]
+                        self.start_worker(worker)
+                    continue
+
+                if process is None or process.poll() is None:
+                    continue
+
+                # Back off if a worker keeps failing soon after starting
+                quick = time.monotonic() - self.started[worker] < 60
+                self.failures[worker] = self.failures[worker] + 1 if quick else 0
+                delay = min(self.restart_delay * 2 ** self.failures[worker], 300)
+                print(f"Worker {worker} exited with code {process.returncode}, restarting in {delay:.0f}s")
+                restart_at[worker] = time.monotonic() + delay
+
+        for process in self.processes:
+            if process:
+                process.wait()
+
+
+def _simulate_worker(env: dict[str, str], commands: int, concurrency: int, players: int, seed: int, results):
+    '''
+    Play commands for randomly chosen players from the shared pool, and report how many games
+    this worker saw finish for each of them.
+    '''
+    os.environ.clear()
+    os.environ.update(env)
+    random.seed(seed)
+
+    import main
+    import leaderboard
+    from dictionary import get_solution_words_for
+    from stub_user import StubUser
+
+    # Importing main doesn't make the bot, so share the rankings as create_bot would
+    leaderboard.init_shared()
+
+    words = get_solution_words_for('en')
+    finished: dict[int, int] = {}
+
+    async def play(count: int):
+        for _ in range(count):
+            user = StubUser(1 + random.randrange(players))
+            replies: list[str] = []
+
+            async def reply(*args, **kwargs):
+                replies.append(args[0] if args else kwargs['embed'].description)
+                await asyncio.sleep(0)
+
+            if random.random() < 0.05:
+                await main.handle_surrender(user, reply)
+            else:
+                await main.handle_new_guess(random.choice(words), 'en', user, reply)
+
+            if any(text.startswith("You coward") or "Congratulations!" in text or "No more guesses!" in text for text in replies):
+                finished[user.id] = finished.get(user.id, 0) + 1
+
+    async def run():
+        await asyncio.gather(*(play(commands // concurrency) for _ in range(concurrency)))
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    results.put((finished, time.perf_counter() - start))
+
+
+def simulate(workers: int, commands: int, concurrency: int, players: int, locks: bool) -> int:
+    '''
+    Run workers against a temporary shared database, returning how far off it ended up: the number
+    of players whose stats don't match the games the workers finished, plus any games missing from
+    the shared totals and players missing from the shared leaderboard.
+    '''
+    directory = tempfile.mkdtemp()
+    os.environ['DATABASE_PATH'] = os.path.join(directory, 'database.sqlite')
+    os.environ['GLOBAL_STATS_PATH'] = os.path.join(directory, 'global_stats.json')
+    os.environ['DAILY_RESULTS_PATH'] = os.path.join(directory, 'daily_results.json')
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = []
+    for worker in range(workers):
+        env = worker_environment(worker, None, 0, os.path.join(directory, 'locks'))
+        if not locks:
+            # Show what happens to players changed by several processes without any coordination
+            env.pop('USER_LOCK_DIR')
+        process = context.Process(target=_simulate_worker, args=(env, commands, concurrency, players, worker, results))
+        process.start()
+        processes.append(process)
+
+    expected: dict[str, int] = {}
+    slowest = 0.0
+    for _ in processes:
+        while True:
+            try:
+                finished, elapsed = results.get(timeout=1)
+                break
+            except queue.Empty:
+                if any(process.exitcode for process in processes):
+                    raise RuntimeError("A simulated worker failed")
+        slowest = max(slowest, elapsed)
+        for id, count in finished.items():
+            expected[str(id)] = expected.get(str(id), 0) + count
+    for process in processes:
+        process.join()
+
+    from sqlite_db import SQLiteDatabase, SQLiteRankings
+    db = SQLiteDatabase(os.environ['DATABASE_PATH'])
+
+    mismatched = 0
+    for id, raw in db.items():
+        stats = raw['stats']
+        recorded = stats['wins'] + stats['losses'] + stats['surrenders']
+        if recorded != expected.get(id, 0) or recorded != sum(stats['games'].values()):
+            mismatched += 1
+
+    # Every worker's games should be counted in the shared totals and rankings too
+    totals = SQLiteDatabase(os.environ['DATABASE_PATH'], 'global_stats').get('en', None) or {}
+    counted = sum(totals.get(result, 0) for result in ('wins', 'losses', 'surrenders'))
+    ranked = len(SQLiteRankings(os.environ['DATABASE_PATH']).top('', players))
+    players_finished = sum(1 for count in expected.values() if count)
+
+    total = workers * (commands // concurrency) * concurrency
+    print(f"{workers} workers ran {total} commands in {slowest:.1f}s = {total / slowest:.0f} commands/s")
+    print(f"{sum(expected.values())} games finished, {mismatched} of {players} players have stats that don't match")
+    print(f"{counted} games counted in the shared totals, {ranked} of {players_finished} players with games on the leaderboard")
+    return mismatched + abs(counted - sum(expected.values())) + abs(ranked - players_finished)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the bot as several processes sharing one database")
+    parser.add_argument('--workers', type=int, default=2, help="Number of worker processes")
+    parser.add_argument('--shards', type=int, default=None, help="Total number of gateway shards (defaults to one per worker)")
+    parser.add_argument('--lock-dir', default='locks', help="Directory for the player lock files")
+    parser.add_argument('--simulate', action='store_true', help="Play simulated players instead of connecting to Discord")
+    parser.add_argument('--commands', type=int, default=2000, help="Commands each simulated worker runs")
+    parser.add_argument('--concurrency', type=int, default=20, help="Commands each simulated worker runs at once")
+    parser.add_argument('--players', type=int, default=50, help="Number of players shared by the simulated workers")
+    parser.add_argument('--no-locks', action='store_true', help="Simulate without locking or sharing players properly")
+    args = parser.parse_args()
+
+    if args.simulate:
+        sys.exit(1 if simulate(args.workers, args.commands, args.concurrency, args.players, not args.no_locks) else 0)
+
+    if os.getenv('DATABASE_BACKEND', 'json') != 'sqlite':
+        print("Workers share a SQLite database, so set DATABASE_BACKEND=sqlite "
+              "(import an existing json database with `python sqlite_db.py`)")
+        sys.exit(1)
+
+    prepare_database(os.getenv('DATABASE_PATH', 'database.json'))
+    Supervisor(args.workers, args.shards or args.workers, args.lock_dir).run()
@@ -0,0 +1,48 @@
+'''
+Runs the benchmarks from benchmarks.py under pytest. They are skipped by a plain `pytest` run,
+so select them with `pytest -m benchmark -s` to see the timings.
+
+Set `BENCHMARK_BASELINE` to results saved by an earlier run (`BENCHMARK_OUTPUT`, or
+`python benchmarks.py --output`) to fail any benchmark that got slower by more than
+`BENCHMARK_TOLERANCE` (0.2 by default).
+'''
+
+import os
+import json
+
+import pytest
+
+import benchmarks
+
+
+pytestmark = pytest.mark.benchmark
+
+
+@pytest.fixture(scope='module')
+def results():
+    results: dict[str, float] = {}
+    yield results
+
+    output = os.getenv('BENCHMARK_OUTPUT')
+    if output:
+        with open(output, 'wt', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+
+
+@pytest.fixture(scope='module')
+def baseline() -> dict[str, float]:
+    path = os.getenv('BENCHMARK_BASELINE')
+    if not path:
+        return {}
+    with open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('name', list(benchmarks.BENCHMARKS))
+def test_benchmark(name, results, baseline, scratch_database):
+    seconds = results[name] = benchmarks.BENCHMARKS[name]()
+    print(f"{name:>24}: {seconds*1e6:12.2f} µs" + (f" ({seconds / baseline[name]:.2f}x baseline)" if name in baseline else ''))
+
+    tolerance = float(os.getenv('BENCHMARK_TOLERANCE', '0.2'))
+    assert not benchmarks.compare({name: seconds}, baseline, tolerance), \
+        f"{name} took {seconds*1e6:.2f} µs, more than {tolerance:.0%} slower than the baseline's {baseline[name]*1e6:.2f} µs"
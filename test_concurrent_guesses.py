@@ -0,0 +1,137 @@
+'''
+Fires many guesses for the same player at once, checking that the per-user locks keep their stats consistent,
+and that players shared with other processes are only ever saved off the event loop.
+'''
+
+import re
+import random
+import asyncio
+import threading
+
+import pytest
+
+import main
+import daily
+import game_store
+import global_stats
+import leaderboard
+import user_locks
+import wordy_chat
+from dictionary import get_solution_words_for
+from sqlite_db import SQLiteDatabase, SQLiteRankings
+from stub_user import StubUser
+
+
+COMMANDS = 300
+
+
+def yield_after(module, name: str, monkeypatch):
+    '''
+    Make an async function of a module give other tasks a turn once it's done, as a slow one would.
+    '''
+    original = getattr(module, name)
+
+    async def slow(*args, **kwargs):
+        result = await original(*args, **kwargs)
+        await asyncio.sleep(0)
+        return result
+
+    monkeypatch.setattr(module, name, slow)
+
+
+@pytest.mark.parametrize('cache_size', [10000, 0])
+def test_concurrent_commands_keep_stats_consistent(scratch_database, monkeypatch, cache_size):
+    # Without a cache, every command changes its own copy of the player, and the last save wins
+    monkeypatch.setattr(game_store, '_cache_size', cache_size)
+
+    # A small pool of words, so games are won and lost often
+    random.seed(7)
+    pool = random.sample(list(get_solution_words_for('en')), 8)
+    monkeypatch.setattr(wordy_chat, 'generate_new_word', lambda lang: random.choice(pool))
+
+    # Let other commands run while a finished game is being counted, between reading the player and saving them
+    yield_after(global_stats, 'record_game', monkeypatch)
+    yield_after(leaderboard, 'record_stats', monkeypatch)
+
+    user = StubUser(4242)
+    replies: list[str] = []
+
+    async def reply(*args, **kwargs):
+        replies.append(args[0] if args else kwargs['embed'].description)
+        await asyncio.sleep(0)
+
+    def command():
+        roll = random.random()
+        if roll < 0.1:
+            return main.handle_surrender(user, reply)
+        if roll < 0.2:
+            return main.handle_colorblind(user, reply)
+        return main.handle_new_guess(random.choice(pool), 'en', user, reply)
+
+    async def stress():
+        await asyncio.gather(*(command() for _ in range(COMMANDS)))
+
+    asyncio.run(stress())
+
+    player = game_store.get_info_for_user(user.id)
+    stats = player.stats
+    text = '\n'.join(replies)
+    won_in = [int(count) for count in re.findall(r'Completed in (\d+) guesses', text)]
+    lost = text.count('No more guesses!')
+    surrendered = text.count('You coward!')
+    toggles = text.count('Colorblind mode is turned')
+
+    assert len(replies) == COMMANDS
+    assert won_in and lost and surrendered and toggles
+    assert (stats.wins, stats.losses, stats.surrenders) == (len(won_in), lost, surrendered)
+    assert stats.games['en'] == stats.wins + stats.losses + stats.surrenders
+    assert stats.distribution['en'] == [won_in.count(count) for count in range(1, len(stats.distribution['en']) + 1)]
+    assert player.settings.colorblind == (toggles % 2 == 1)
+
+    totals = global_stats.get_totals()['en']
+    assert (totals['wins'], totals['losses'], totals['surrenders'], totals['distribution']) == \
+        (stats.wins, stats.losses, stats.surrenders, stats.distribution['en'])
+
+
+def test_shared_players_are_saved_off_the_event_loop(scratch_database, tmp_path, monkeypatch):
+    # Share players as a worker run by the supervisor does
+    path = str(tmp_path / 'database.sqlite')
+    monkeypatch.setattr(game_store, '_shared_locks', user_locks.StripedFileLock(str(tmp_path / 'locks')))
+    monkeypatch.setattr(game_store, '_db', SQLiteDatabase(path))
+    monkeypatch.setattr(game_store, '_cache_size', 0)
+    monkeypatch.setattr(user_locks, '_shared_hold', game_store.hold_shared_user)
+    monkeypatch.setattr(leaderboard, '_shared', SQLiteRankings(path))
+    monkeypatch.setattr(global_stats._store, '_db', SQLiteDatabase(path, 'global_stats'))
+    monkeypatch.setattr(daily._store, '_db', SQLiteDatabase(path, 'daily_results'))
+
+    # Note whether each commit to the database happens on the event loop's thread
+    on_loop: list[bool] = []
+    def spy(cls, name):
+        original = getattr(cls, name)
+        def record(*args, **kwargs):
+            on_loop.append(threading.current_thread() is threading.main_thread())
+            return original(*args, **kwargs)
+        monkeypatch.setattr(cls, name, record)
+    spy(SQLiteDatabase, '_write')
+    spy(SQLiteDatabase, 'modify')
+    spy(SQLiteRankings, 'update')
+
+    random.seed(7)
+    pool = random.sample(list(get_solution_words_for('en')), 8)
+    monkeypatch.setattr(wordy_chat, 'generate_new_word', lambda lang: random.choice(pool))
+
+    user = StubUser(4343)
+    async def reply(*args, **kwargs):
+        pass
+
+    async def play():
+        for _ in range(20):
+            await main.handle_new_guess(random.choice(pool), 'en', user, reply)
+        await main.handle_colorblind(user, reply)
+        await main.handle_surrender(user, reply)
+
+    asyncio.run(play())
+
+    stats = SQLiteDatabase(path)[str(user.id)]['stats']
+    assert stats['wins'] + stats['losses'] + stats['surrenders'] > 0
+    assert on_loop and not any(on_loop)
@@ -0,0 +1,84 @@
+'''
+Checks that a journalled JSONDatabase gets back everything that was saved after going wrong part way.
+'''
+
+import os
+
+import pytest
+
+from json_db import JSONDatabase
+
+
+def open_journalled(tmp_path, **kwargs) -> JSONDatabase:
+    path = tmp_path / 'database.json'
+    if not path.exists():
+        path.write_text('{}', encoding='utf-8')
+    return JSONDatabase(str(path), journal=True, **kwargs)
+
+
+def test_half_written_record_is_cut_off(tmp_path):
+    db = open_journalled(tmp_path)
+    db['1'] = {'wins': 1}
+    db['2'] = {'wins': 2}
+    db.save()
+
+    # As if the process died part way through writing the next change
+    with open(db.log_filename, 'ab') as log:
+        log.write(b'{"k":"3","v":{"wi')
+    good_length = os.path.getsize(db.log_filename) - len(b'{"k":"3","v":{"wi')
+
+    reopened = open_journalled(tmp_path)
+    assert reopened.data == {'1': {'wins': 1}, '2': {'wins': 2}}
+    assert os.path.getsize(reopened.log_filename) == good_length
+
+    # Changes made after the cut carry on from a clean end of the log
+    reopened['3'] = {'wins': 3}
+    reopened.save()
+    assert open_journalled(tmp_path).data == {'1': {'wins': 1}, '2': {'wins': 2}, '3': {'wins': 3}}
+
+
+def test_failed_compaction_is_finished_by_the_next_save(tmp_path, monkeypatch):
+    db = open_journalled(tmp_path, compact_bytes=1)
+    db['1'] = {'wins': 1}
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(db, '_write', fail)
+        with pytest.raises(OSError):
+            db.save()
+        assert os.path.exists(db.old_log_filename)
+
+        # Nothing is lost if the process stops now
+        assert open_journalled(tmp_path).data == {'1': {'wins': 1}}
+
+        # Nor if the next attempt fails too, as the unmerged changes are added to rather than replaced
+        db['2'] = {'wins': 2}
+        with pytest.raises(OSError):
+            db.save()
+        assert open_journalled(tmp_path).data == {'1': {'wins': 1}, '2': {'wins': 2}}
+
+    # The next save folds both logs into the main file, even though the new log is tiny
+    db['3'] = {'wins': 3}
+    db.save()
+    assert not os.path.exists(db.old_log_filename)
+    assert JSONDatabase(db.filename).data == {'1': {'wins': 1}, '2': {'wins': 2}, '3': {'wins': 3}}
+    assert open_journalled(tmp_path).data == {'1': {'wins': 1}, '2': {'wins': 2}, '3': {'wins': 3}}
+
+
+def test_only_saves_off_the_event_loop_wait_for_the_disk(tmp_path, monkeypatch):
+    synced = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, 'fsync', lambda fd: synced.append(fd) or real_fsync(fd))
+
+    db = open_journalled(tmp_path)
+    db['1'] = {'wins': 1}
+    db.save()
+    assert synced == []
+
+    db['2'] = {'wins': 2}
+    write = db.begin_save()
+    assert write is not None and synced == []
+    write()
+    assert len(synced) == 1
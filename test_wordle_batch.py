@@ -0,0 +1,71 @@
+'''
+Checks that batch guess evaluation agrees with `evaluate_guess`, on tricky repeated-letter cases and
+on a large sample of guesses from each language's own word lists against all of its answers.
+
+Checking the sample takes a couple of minutes in pure Python, so those tests are skipped by a plain
+`pytest` run. Select them with `pytest -m slow`.
+'''
+
+import random
+
+import pytest
+
+from dictionary import languages, get_acceptable_words_for, get_solution_words_for
+from wordle_batch import encode_words, evaluate_guess_batch
+from wordle_logic import encode_result, evaluate_guess
+
+
+# Repeated letters in the guess, the answer or both, where a letter can be correct, present and absent at once
+REPEATED_LETTER_PAIRS = [
+    ('speed', 'abide'),
+    ('speed', 'erase'),
+    ('eerie', 'greet'),
+    ('geese', 'sheep'),
+    ('lever', 'eerie'),
+    ('teeth', 'ethos'),
+    ('llama', 'hello'),
+    ('hello', 'level'),
+    ('abbey', 'babes'),
+    ('kayak', 'yacht'),
+    ('mummy', 'umami'),
+    ('aaaaa', 'abcde'),
+    ('abcde', 'aaaaa'),
+]
+
+# Words with repeated letters from each language's own list, also tried as guesses against all its answers
+REPEATED_LETTER_WORDS = 20
+
+# Guesses from each language's lists tried against all its answers (every pair would take the best part of an hour)
+SAMPLED_GUESSES = 1000
+
+
+def expected_results(guess: str, answers) -> list[int]:
+    return [encode_result(tuple(evaluate_guess(guess, answer))) for answer in answers]
+
+
+@pytest.mark.parametrize('guess, answer', REPEATED_LETTER_PAIRS)
+def test_repeated_letters_match_evaluate_guess(guess, answer):
+    assert evaluate_guess_batch(guess, [answer]).tolist() == expected_results(guess, [answer])
+
+
+@pytest.mark.parametrize('lang', list(languages))
+def test_repeated_letter_guesses_match_evaluate_guess(lang):
+    answers = get_solution_words_for(lang)
+    guesses = [guess for guess, _ in REPEATED_LETTER_PAIRS] + [answer for _, answer in REPEATED_LETTER_PAIRS]
+    guesses += [word for word in answers if len(set(word)) < len(word)][:REPEATED_LETTER_WORDS]
+
+    encoded_answers = encode_words(answers)
+    for guess in guesses:
+        assert evaluate_guess_batch(guess, encoded_answers).tolist() == expected_results(guess, answers), guess
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('lang', list(languages))
+def test_sampled_guesses_match_evaluate_guess(lang):
+    answers = get_solution_words_for(lang)
+    guesses = list(answers) + list(get_acceptable_words_for(lang))
+    guesses = random.Random(lang).sample(guesses, min(SAMPLED_GUESSES, len(guesses)))
+
+    encoded_answers = encode_words(answers)
+    for guess in guesses:
+        assert evaluate_guess_batch(guess, encoded_answers).tolist() == expected_results(guess, answers), guess
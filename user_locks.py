@@ -0,0 +1,203 @@
+'''
+Per-user locking, so that commands from the same player run one at a time.
+
+Commands from different players still run fully concurrently. When several processes share
+the same players, an extra lock can be added that is held across all of them.
+'''
+
+import os
+import zlib
+import asyncio
+import functools
+import inspect
+from contextlib import asynccontextmanager
+from typing import Any, AsyncContextManager, AsyncIterator, Awaitable, Callable, Hashable, Optional, TypeVar
+
+
+TResult = TypeVar('TResult')
+
+
+class KeyedLock:
+    '''
+    A set of asyncio locks created on demand for each key, and discarded once nobody is using them.
+    '''
+    def __init__(self):
+        self._locks: dict[Hashable, tuple[asyncio.Lock, list[int]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        lock, users = self._locks.setdefault(key, (asyncio.Lock(), [0]))
+        users[0] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            users[0] -= 1
+            if not users[0]:
+                del self._locks[key]
+
+
+class StripedFileLock:
+    '''
+    Locks shared between processes, spreading keys over a fixed number of lock files.
+
+    Keys that share a stripe hold each other up, both here and in other processes, so there
+    should be plenty of stripes. The lock file is let go after every use to give other
+    processes a fair chance, and waiting for it is done by polling so as not to block the
+    event loop. Needs `fcntl`, so isn't available on Windows.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> first, second = StripedFileLock(directory), StripedFileLock(directory)
+    >>> async def race():
+    ...     order = []
+    ...     async def use(lock, name):
+    ...         async with lock.hold('player'):
+    ...             order.append(f'{name} in')
+    ...             await asyncio.sleep(0.01)
+    ...             order.append(f'{name} out')
+    ...     await asyncio.gather(use(first, 'first'), use(second, 'second'))
+    ...     return order
+    >>> asyncio.run(race())
+    ['first in', 'first out', 'second in', 'second out']
+    '''
+    def __init__(self, directory: str, stripes: int = 256, poll_interval: float = 0.002):
+        import fcntl
+        self._fcntl = fcntl
+        self.directory = directory
+        self.stripes = stripes
+        self.poll_interval = poll_interval
+        self._files: dict[int, int] = {}
+        self._locks = KeyedLock()
+        os.makedirs(directory, exist_ok=True)
+
+    def stripe_of(self, key: Hashable) -> int:
+        # Must be the same in every process, which rules out `hash`
+        return zlib.crc32(str(key).encode('utf-8')) % self.stripes
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        stripe = self.stripe_of(key)
+        async with self._locks.hold(stripe):
+            file = self._files.get(stripe)
+            if file is None:
+                path = os.path.join(self.directory, f'{stripe}.lock')
+                file = self._files[stripe] = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+            while True:
+                try:
+                    self._fcntl.flock(file, self._fcntl.LOCK_EX | self._fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(self.poll_interval)
+
+            try:
+                yield
+            finally:
+                self._fcntl.flock(file, self._fcntl.LOCK_UN)
+
+
+_user_locks = KeyedLock()
+
+# Held inside the per-user lock when players are shared with other processes
+_shared_hold: Optional[Callable[[str], AsyncContextManager[None]]] = None
+
+
+def hold_across_processes(hold: Optional[Callable[[str], AsyncContextManager[None]]]):
+    '''
+    Also hold the given lock on a player's id whenever their commands run. Passing None turns it off again.
+    '''
+    global _shared_hold
+    _shared_hold = hold
+
+
+@asynccontextmanager
+async def hold_user(id: Hashable) -> AsyncIterator[None]:
+    '''
+    Hold a player's lock, just as their commands do.
+    '''
+    async with _user_locks.hold(id):
+        if _shared_hold is None:
+            yield
+        else:
+            async with _shared_hold(str(id)):
+                yield
+
+
+class HeldReplies:
+    '''
+    Stands in for a command's reply function, keeping its replies to send later.
+
+    >>> sent = []
+    >>> async def reply(text): sent.append(text)
+    >>> held = HeldReplies(reply)
+    >>> async def command():
+    ...     await held('first'); await held('second')
+    ...     sent.append('done')
+    ...     await held.send()
+    >>> asyncio.run(command()); sent
+    ['done', 'first', 'second']
+    '''
+    def __init__(self, reply: Callable[..., Awaitable[Any]]):
+        self._reply = reply
+        self._calls: list[tuple[Callable[..., Awaitable[Any]], tuple, dict]] = []
+        # Replies that can be replaced by a later board keep that ability
+        send_board = getattr(reply, 'send_board', None)
+        if send_board is not None:
+            async def hold_board(*args: Any, **kwargs: Any):
+                self._calls.append((send_board, args, kwargs))
+            self.send_board = hold_board
+
+    async def __call__(self, *args: Any, **kwargs: Any):
+        self._calls.append((self._reply, args, kwargs))
+
+    async def send(self):
+        calls, self._calls = self._calls, []
+        for send, args, kwargs in calls:
+            await send(*args, **kwargs)
+
+
+def serialized_per_user(func: Callable[..., Awaitable[TResult]]) -> Callable[..., Awaitable[TResult]]:
+    '''
+    Decorate a command handler with a `user` argument so calls for the same user never overlap.
+
+    While players are shared with other processes, its `reply` calls are held until the lock
+    across processes has been let go, so other processes aren't kept waiting on Discord.
+
+    >>> from types import SimpleNamespace
+    >>> store = {}
+    >>> @serialized_per_user
+    ... async def bump(user):
+    ...     count = store.get(user.id, 0)
+    ...     await asyncio.sleep(0)
+    ...     store[user.id] = count + 1
+    >>> async def stress():
+    ...     await asyncio.gather(*(bump(SimpleNamespace(id=i % 3)) for i in range(300)))
+    >>> asyncio.run(stress())
+    >>> store
+    {0: 100, 1: 100, 2: 100}
+    >>> len(_user_locks)
+    0
+    '''
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> TResult:
+        bound = signature.bind(*args, **kwargs)
+        user = bound.arguments['user']
+        if _shared_hold is None or 'reply' not in bound.arguments:
+            async with hold_user(user.id):
+                return await func(*args, **kwargs)
+
+        async with _user_locks.hold(user.id):
+            held = bound.arguments['reply'] = HeldReplies(bound.arguments['reply'])
+            try:
+                async with _shared_hold(str(user.id)):
+                    return await func(*bound.args, **bound.kwargs)
+            finally:
+                await held.send()
+
+    return wrapper
@@ -0,0 +1,74 @@
+'''
+Vectorised guess evaluation, scoring one guess against a whole list of answers at once.
+
+Results are returned as base-3 numbers matching `wordle_logic.encode_result`.
+'''
+
+from typing import Sequence
+
+import numpy as np
+
+
+def encode_words(words: Sequence[str]) -> np.ndarray:
+    '''
+    Convert a list of equal length words into an array of character codes, one row per word.
+
+    >>> encode_words(['abc', 'xyz'])
+    array([[ 97,  98,  99],
+           [120, 121, 122]], dtype=uint16)
+    '''
+    if not words:
+        return np.zeros((0, 0), dtype=np.uint16)
+
+    length = len(words[0])
+    codes = np.frombuffer(''.join(words).encode('utf-32-le'), dtype=np.uint32)
+    return codes.reshape(len(words), length).astype(np.uint16)
+
+
+def result_dtype(length: int) -> type:
+    '''
+    Get the smallest unsigned type able to hold a base-3 result for words of the given length.
+    '''
+    if 3**length <= 2**8:
+        return np.uint8
+    if 3**length <= 2**16:
+        return np.uint16
+    return np.uint64
+
+
+def evaluate_guess_batch(guess: str, answers: Sequence[str]|np.ndarray) -> np.ndarray:
+    '''
+    Evaluate a guess against every answer, returning one base-3 result per answer.
+
+    Answers can be given as words or as an array already made by `encode_words`.
+
+    >>> evaluate_guess_batch('aaab', ['abca', 'abcd', 'aaab'])
+    array([64, 55, 80], dtype=uint8)
+    >>> from wordle_logic import encode_result, evaluate_guess
+    >>> [encode_result(tuple(evaluate_guess('aaab', answer))) for answer in ['abca', 'abcd', 'aaab']]
+    [64, 55, 80]
+    '''
+    length = len(guess)
+    if not isinstance(answers, np.ndarray):
+        answers = encode_words(answers)
+    if len(answers) and answers.shape[1] != length:
+        raise ValueError("Guess and answers must be of same length")
+
+    guess_codes = encode_words([guess])[0]
+    correct = answers == guess_codes
+    unmatched = ~correct
+    present = np.zeros_like(correct)
+    results = np.zeros(len(answers), dtype=result_dtype(length))
+
+    for i in range(length):
+        # Copies of this letter left in the answer, ignoring exactly correct positions...
+        available = ((answers == guess_codes[i]) & unmatched).sum(axis=1)
+
+        # ...minus those already claimed by the same letter earlier in the guess
+        earlier = [j for j in range(i) if guess[j] == guess[i]]
+        claimed = present[:, earlier].sum(axis=1) if earlier else 0
+
+        present[:, i] = unmatched[:, i] & (available > claimed)
+        results = results * 3 + np.where(correct[:, i], 2, present[:, i]).astype(results.dtype)
+
+    return results
@@ -53,6 +53,39 @@ def evaluate_guess(guess: str, answer: str) -> Iterator[LetterState]:
         yield LetterState.PRESENT
 
 
+RESULT_DIGITS = {LetterState.ABSENT: 0, LetterState.PRESENT: 1, LetterState.CORRECT: 2}
+DIGIT_RESULTS = (LetterState.ABSENT, LetterState.PRESENT, LetterState.CORRECT)
+
+
+def encode_result(result: tuple[LetterState, ...]) -> int:
+    '''
+    Pack a result into a single base-3 number, with the first letter as the most significant digit.
+
+    >>> encode_result((LetterState.ABSENT, LetterState.PRESENT, LetterState.CORRECT))
+    5
+    >>> encode_result((LetterState.CORRECT,)*5)
+    242
+    '''
+    code = 0
+    for state in result:
+        code = code * 3 + RESULT_DIGITS[state]
+    return code
+
+
+def decode_result(code: int, length: int) -> tuple[LetterState, ...]:
+    '''
+    Unpack a base-3 result made by `encode_result`.
+
+    >>> decode_result(5, 3) == (LetterState.ABSENT, LetterState.PRESENT, LetterState.CORRECT)
+    True
+    '''
+    states = []
+    for _ in range(length):
+        code, digit = divmod(code, 3)
+        states.append(DIGIT_RESULTS[digit])
+    return tuple(reversed(states))
+
+
 def generate_new_word(lang: str):
     '''
     Pick a random word as a new game solution.
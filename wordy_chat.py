@@ -2,8 +2,11 @@
 This part handles the game state management, with each user having their own active game.
 '''
 
+import time
+import functools
+
 from game_store import get_info_for_user, set_info_for_user
-from wordle_logic import evaluate_guess, generate_new_word
+from wordle_logic import decode_result, encode_result, evaluate_guess, generate_new_word
 from wordy_types import ActiveGame, EndResult, LetterState, UserInfo
 
 
@@ -18,7 +21,7 @@ def begin_game(player: UserInfo, lang: str) -> ActiveGame:
     answer = generate_new_word(lang)
 
     # Create and store new game state
-    new_game = ActiveGame(answer=answer, lang=lang)
+    new_game = ActiveGame(answer=answer, lang=lang, last_active=int(time.time()))
 
     return new_game
 
@@ -52,6 +55,7 @@ def enter_guess(guess: str, game: ActiveGame) -> EndResult:
     # Update game state
     game.board_state.append(guess)
     game.results.append(result)
+    game.last_active = int(time.time())
 
     # Check if game is over
     if result == (LetterState.CORRECT,)*len(game.answer):
@@ -74,7 +78,7 @@ def get_emotes_for_colorblind(colorblind: bool) -> tuple[str, str, str]:
         return '⬛', '🟨', '🟩'
 
 
-def render_result(result: tuple[LetterState], colorblind: bool = False) -> str:
+def render_result(result: tuple[LetterState, ...], colorblind: bool = False) -> str:
     """
     Render a result to a string.
 
@@ -86,12 +90,87 @@ def render_result(result: tuple[LetterState], colorblind: bool = False) -> str:
     '⬛⬛⬛⬛'
     """
 
-    absent, present, correct =  get_emotes_for_colorblind(colorblind)
+    return _render_result_row(result, colorblind)
+
+
+def render_code(code: int, length: int, colorblind: bool = False) -> str:
+    """
+    Render a result given as a base-3 code.
+
+    >>> render_code(5, 3)
+    '⬛🟨🟩'
+    """
+    return _get_rendered_rows(length, colorblind)[code]
+
+
+def render_board(game: ActiveGame, colorblind: bool = False) -> str:
+    """
+    Render every guess so far, one per line.
+
+    The rendered board is kept on the game and only new guesses are rendered each time.
+
+    >>> game = ActiveGame(lang="en", answer="abcd")
+    >>> _ = enter_guess("aaaa", game)
+    >>> _ = enter_guess("abce", game)
+    >>> print(render_board(game), end='')
+    🟩⬛⬛⬛ aaaa
+    🟩🟩🟩⬛ abce
+    >>> print(render_board(game, True), end='')
+    🟧⬛⬛⬛ aaaa
+    🟧🟧🟧⬛ abce
+    """
+    if game._board_colorblind != colorblind or game._board_rows > len(game.results):
+        game._board_text = ''
+        game._board_rows = 0
+        game._board_colorblind = colorblind
+
+    for result, word in zip(game.results[game._board_rows:], game.board_state[game._board_rows:]):
+        game._board_text += f"{render_result(result, colorblind)} {word}\n"
+    game._board_rows = len(game.results)
 
-    return "".join(
-        absent if state == LetterState.ABSENT else
-        present if state == LetterState.PRESENT else correct
-        for state in result
+    return game._board_text
+
+
+def render_distribution(counts: list[int], width: int = 12) -> str:
+    """
+    Render how many games were won in each number of guesses as a bar chart, one line per guess count.
+
+    >>> print(render_distribution([0, 1, 4, 2, 0, 0]), end='')
+    1 ▏ 0
+    2 ███ 1
+    3 ████████████ 4
+    4 ██████ 2
+    5 ▏ 0
+    6 ▏ 0
+    """
+    most = max(counts, default=0) or 1
+    text = ''
+    for guesses, count in enumerate(counts, 1):
+        bar = '█' * round(count * width / most) or '▏'
+        text += f"{guesses} {bar} {count}\n"
+    return text
+
+
+@functools.lru_cache(maxsize=None)
+def _render_result_row(result: tuple[LetterState, ...], colorblind: bool) -> str:
+    '''
+    Render a result, keeping the row for next time (there are only 3**length different results).
+    '''
+    return render_code(encode_result(result), len(result), colorblind)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_rendered_rows(length: int, colorblind: bool) -> tuple[str, ...]:
+    '''
+    Render every possible result for a word length, indexed by base-3 result code.
+    '''
+    absent, present, correct = get_emotes_for_colorblind(colorblind)
+    return tuple(
+        "".join(
+            absent if state == LetterState.ABSENT else
+            present if state == LetterState.PRESENT else correct
+            for state in decode_result(code, length))
+        for code in range(3**length)
     )
 
 
@@ -108,8 +187,7 @@ if __name__ == "__main__":
 
         enter_guess(guess, player.current_game)
 
-        for result,word in zip(player.current_game.results, player.current_game.board_state):
-            print(f"{render_result(result)} {word}")
+        print(render_board(player.current_game), end='')
 
         if player.current_game.state == EndResult.WIN:
             print(f"Congratulations! Completed in {len(player.current_game.board_state)} guesses!")
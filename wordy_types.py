@@ -1,7 +1,11 @@
 from enum import Enum
 from typing import Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
+
+
+# Guesses allowed in a game of five letter words
+MAX_GUESSES = 6
 
 
 class LetterState(str, Enum):
@@ -24,13 +28,25 @@ class ActiveGame(BaseModel):
     results: list[tuple[LetterState, ...]] = Field(default_factory=list)
     state: EndResult = Field(default=EndResult.PLAYING)
 
+    # Unix time of the last guess, or of the start of the game (0 for games from before this was kept)
+    last_active: int = 0
+
+    # Rendered board rows so far, kept up to date by `wordy_chat.render_board` (never stored)
+    _board_text: str = PrivateAttr(default='')
+    _board_rows: int = PrivateAttr(default=0)
+    _board_colorblind: bool = PrivateAttr(default=False)
+
 
 class Stats(BaseModel):
     wins: int = 0
     losses: int = 0
     surrenders: int = 0
+    abandoned: int = 0
     games: dict[str, int] = Field(default_factory=dict)
 
+    # Games won in each language, counted by the number of guesses taken (one to MAX_GUESSES)
+    distribution: dict[str, list[int]] = Field(default_factory=dict)
+
 
 class Settings(BaseModel):
     colorblind: bool = False
@@ -41,3 +57,8 @@ class UserInfo(BaseModel):
     settings: Settings = Field(default_factory=Settings)
     stats: Stats = Field(default_factory=Stats)
     username: Optional[str] = None
+
+    # The latest daily game and its day number, and the last day each language's daily was finished
+    daily_game: Optional[ActiveGame] = None
+    daily_day: Optional[int] = None
+    daily_finished: dict[str, int] = Field(default_factory=dict)
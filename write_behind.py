@@ -0,0 +1,89 @@
+'''
+Write-behind persistence, coalescing many database changes into occasional background saves.
+'''
+
+import asyncio
+import traceback
+from typing import Callable, Optional
+
+from storage import Storage
+
+
+class WriteBehindFlusher:
+    '''
+    Periodically saves a database from a worker thread, instead of on every change.
+
+    A save happens every `interval` seconds if anything changed, or sooner once
+    `max_dirty` records are waiting to be written. `before_save` is called on the event loop
+    just before each save, to give callers a chance to push their own changes into the database.
+    '''
+    def __init__(self, db: Storage, interval: float, max_dirty: int, before_save: Optional[Callable[[], None]] = None):
+        self.db = db
+        self.before_save = before_save
+        self.interval = interval
+        self.max_dirty = max_dirty
+        self.flushes = 0
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+
+    def start(self):
+        '''
+        Start flushing in the background. Must be called from within the running event loop.
+        '''
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+
+    async def stop(self):
+        '''
+        Stop the background task and write out any remaining changes.
+        '''
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self.flush()
+
+
+    def notify(self, dirty_count: int):
+        '''
+        Let the flusher know how many records have changed, triggering an early save if enough have built up.
+        '''
+        if dirty_count >= self.max_dirty:
+            self._wake.set()
+
+
+    async def flush(self):
+        '''
+        Save any changes now, doing the serialization and file writing in a worker thread.
+        '''
+        if self.before_save:
+            self.before_save()
+
+        write = self.db.begin_save()
+        if write is None:
+            return
+
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, write)
+            self.flushes += 1
+        except Exception:
+            print("Failed to save database:")
+            traceback.print_exc()
+            self.db.mark_dirty()
+
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self._wake.clear()
+            await self.flush()